@@ -0,0 +1,171 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+from db_connection import PooledSQLiteDataEngine
+
+
+# Description: asyncio front end for PooledSQLiteDataEngine. Every SQLite call runs on a dedicated
+# thread pool, so the event loop never blocks; the executor's FIFO work queue runs concurrent
+# requests in the order they were made. Cancelling an awaiting task interrupts its SQLite statement.
+
+
+# The connection a running call uses, so a cancelled task can interrupt exactly that statement
+class _Interruptible:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self.cancelled = False
+
+    def attach(self, conn):
+        with self._lock:
+            if self.cancelled:
+                raise asyncio.CancelledError()
+            self._conn = conn
+
+    def detach(self):
+        with self._lock:
+            self._conn = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self._conn is not None:
+                self._conn.interrupt()
+
+
+class AsyncSQLiteDataEngine:
+    def __init__(self, db_path="my_database.db", pool_size=4, timeout=5.0, max_workers=None):
+        self.engine = PooledSQLiteDataEngine(db_path, pool_size, timeout)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or pool_size + 1, thread_name_prefix="sse-async")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # run `work(conn)` on the executor; `connect` is a context manager factory for the connection
+    async def _run(self, connect, work):
+        loop = asyncio.get_running_loop()
+        call = _Interruptible()
+
+        def run():
+            with connect() as conn:
+                call.attach(conn)
+                try:
+                    return work(conn)
+                finally:
+                    call.detach()
+
+        try:
+            return await loop.run_in_executor(self._executor, run)
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+
+    # the writer connection, held under the engine's write lock so a cancel only interrupts our own write
+    @contextmanager
+    def _writer(self):
+        with self.engine._writing():
+            yield self.engine.conn
+
+    # Import a CSV file (same arguments as SQLiteDataEngine.import_csv)
+    async def import_csv(self, file_path, table_name=None, **kwargs):
+        return await self._run(self._writer, lambda conn: self.engine.import_csv(file_path, table_name, **kwargs))
+
+    # Run a write statement (SQL string or SQLQueryBuilder) on the writer connection, see
+    # SQLiteDataEngine.execute. Returns the number of changed rows, or the rows of a statement that
+    # returns some (a PRAGMA); read queries go through fetch() or stream().
+    async def execute(self, query, params=None):
+        def work(conn):
+            cursor = self.engine.execute(query, params)
+            return cursor.fetchall() if cursor.description is not None else cursor.rowcount
+
+        return await self._run(self._writer, work)
+
+    # Run a read query on a pooled connection and return all rows
+    async def fetch(self, query, params=None):
+        def work(conn):
+            with self.engine._traced(query, params, conn) as event:
+                with self.engine._guarded(conn, event.sql, event.params):
+                    rows = conn.execute(event.sql, event.params).fetchall()
+                event.rows = len(rows)
+            return rows
+
+        return await self._run(self.engine.reader, work)
+
+    # Async iterator over the result in lists of at most `batch_size` rows. Each batch is fetched
+    # as its own executor job, so long scans take turns with other requests. The query is traced
+    # and watched by the engine's guard from its start until the last batch, like fetch().
+    async def stream(self, query, params=None, batch_size=1000):
+        call = _Interruptible()
+        pending = None
+
+        def step(fn, *args):
+            nonlocal pending
+            pending = self._executor.submit(fn, *args)
+            return asyncio.wrap_future(pending)
+
+        conn = None
+        scope = None
+        cursor = None
+        error = None
+        try:
+            conn = await step(self.engine.pool.acquire)
+            call.attach(conn)
+            scope, event, cursor = await step(self._open_stream, conn, query, params)
+            event.rows = 0
+            while True:
+                batch = await step(cursor.fetchmany, batch_size)
+                if not batch:
+                    break
+                event.rows += len(batch)
+                yield batch
+        except asyncio.CancelledError as e:
+            call.cancel()
+            error = e
+            raise
+        except GeneratorExit:
+            # the consumer stopped iterating, not an error of the query
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # let a job that was already running finish before the connection goes back to the pool
+            if pending is not None and not pending.done():
+                await asyncio.wait([asyncio.wrap_future(pending)])
+            if pending is not None and not pending.cancelled() and pending.exception() is None:
+                if conn is None:
+                    conn = pending.result()
+                elif scope is None:
+                    scope, event, cursor = pending.result()
+            call.detach()
+            try:
+                if scope is not None:
+                    # the guard turns an interrupt past its deadline into QueryBudgetExceeded
+                    await step(scope.__exit__, type(error) if error else None, error,
+                               error.__traceback__ if error else None)
+            finally:
+                if cursor is not None:
+                    cursor.close()
+                if conn is not None:
+                    self.engine.pool.release(conn)
+
+    # enter the engine's trace and guard for a streamed query and start it, on the executor thread
+    def _open_stream(self, conn, query, params):
+        with ExitStack() as scope:
+            event = scope.enter_context(self.engine._traced(query, params, conn))
+            scope.enter_context(self.engine._guarded(conn, event.sql, event.params))
+            cursor = conn.execute(event.sql, event.params)
+            return scope.pop_all(), event, cursor
+
+    def pool_metrics(self):
+        return self.engine.pool_metrics()
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._executor.shutdown)
+        self.engine.close()
@@ -0,0 +1,62 @@
+# Memory and throughput of fetching a large result into pandas: the row path
+# (fetchall + pd.DataFrame(rows)) against SQLiteDataEngine.fetch_df (typed NumPy column buffers).
+#
+#   python benchmarks/bench_columnar.py [rows]
+
+import contextlib
+import gc
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_connection import SQLiteDataEngine
+
+
+def row_path(engine, sql):
+    cursor = engine.conn.execute(sql)
+    rows = cursor.fetchall()
+    return pd.DataFrame(rows, columns=[desc[0] for desc in cursor.description])
+
+
+def columnar_path(engine, sql):
+    return engine.fetch_df(sql)
+
+
+# time without tracing, then peak memory in a second, traced run
+def measure(fn, engine, sql):
+    gc.collect()
+    started = time.perf_counter()
+    n = len(fn(engine, sql))
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    tracemalloc.start()
+    fn(engine, sql)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, n
+
+
+def main(rows=1_000_000):
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = SQLiteDataEngine(":memory:")
+        engine.create_table("events", {"id": "INTEGER", "user_id": "INTEGER", "score": "REAL", "ts": "INTEGER"})
+        engine.cursor.executemany("INSERT INTO events VALUES (?, ?, ?, ?)",
+                                  ((i, i % 1000, i / 7, 1_600_000_000 + i) for i in range(rows)))
+        engine.conn.commit()
+    sql = "SELECT id, user_id, score, ts FROM events"
+
+    print(f"rows: {rows}")
+    for name, fn in (("fetchall + DataFrame", row_path), ("fetch_df (columnar)", columnar_path)):
+        elapsed, peak, n = measure(fn, engine, sql)
+        print(f"{name:<22} {elapsed:6.2f}s  {n / elapsed:>12,.0f} rows/s  peak {peak / 2**20:8.1f} MiB")
+    engine.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
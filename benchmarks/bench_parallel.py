@@ -0,0 +1,56 @@
+# Scaling of SQLiteDataEngine.fetch_parallel with the number of worker processes, against serial
+# fetch(), for grouped aggregates over synthetic titles (datagen.py).
+#
+#   python benchmarks/bench_parallel.py [rows] [processes,...]
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from datagen import write_csv
+from db import SQLQueryBuilder
+from db_connection import SQLiteDataEngine
+
+QUERIES = {
+    "group_avg": lambda: SQLQueryBuilder("titles").select("type", ("AVG(imdb_score)", "avg_score")).group_by("type"),
+    "filter_group_count": lambda: (
+        SQLQueryBuilder("titles").select("genre", ("COUNT(*)", "n"), ("MAX(imdb_votes)", "top"))
+        .where("release_year", (">=", 2000)).group_by("genre")
+    ),
+    "global_sum": lambda: SQLQueryBuilder("titles").select(("SUM(runtime)", "total"), ("COUNT(*)", "n")),
+}
+
+
+def best_of(fn, repeat=3):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def main(rows=1_000_000, processes=(1, 2, 4, 8)):
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = write_csv(os.path.join(directory, "titles.csv"), rows)
+        engine = SQLiteDataEngine(os.path.join(directory, "titles.db"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            engine.import_csv(csv_path, "titles")
+        print(f"{rows:,} rows, {os.cpu_count()} cores")
+        print(f"{'query':<20} {'serial s':>9}" + "".join(f" {f'{n} proc s':>10}" for n in processes))
+        for name, query in QUERIES.items():
+            serial = best_of(lambda: engine.fetch(query()))
+            parallel = [best_of(lambda: engine.fetch_parallel(query(), processes=n)) for n in processes]
+            print(f"{name:<20} {serial:>9.3f}" + "".join(f" {t:>10.3f}" for t in parallel))
+        engine.close()
+
+
+if __name__ == "__main__":
+    counts = tuple(int(n) for n in sys.argv[2].split(",")) if len(sys.argv) > 2 else (1, 2, 4, 8)
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000, counts)
@@ -0,0 +1,64 @@
+# Literal vs parameterized throughput of SQLQueryBuilder queries.
+# Runs the same filter shape with many distinct values: the literal build gives sqlite3 a new
+# statement to parse and plan for every value, the parameterized build reuses one prepared statement.
+#
+#   python benchmarks/bench_parameterized.py [queries]
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import SQLQueryBuilder
+from db_connection import SQLiteDataEngine
+
+
+def build_queries(n):
+    queries = []
+    for i in range(n):
+        queries.append(
+            SQLQueryBuilder("events")
+            .select("kind", ("AVG(score)", "avg_score"))
+            .where("user_id", i)
+            .and_("score", (">=", i % 10))
+            .group_by("kind")
+        )
+    return queries
+
+
+def main(n=10_000):
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = SQLiteDataEngine(":memory:")
+        engine.create_table("events", {"user_id": "INTEGER", "kind": "TEXT", "score": "REAL"})
+        engine.cursor.executemany(
+            "INSERT INTO events VALUES (?, ?, ?)",
+            ((i % n, f"kind{i % 7}", i % 11) for i in range(200_000)),
+        )
+        engine.cursor.execute("CREATE INDEX events_user ON events (user_id)")
+        engine.conn.commit()
+        queries = build_queries(n)
+        literal = [q.build() for q in queries]
+        parameterized = [q.build(params=True) for q in queries]
+
+    started = time.perf_counter()
+    for sql in literal:
+        engine.cursor.execute(sql).fetchall()
+    literal_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for sql, params in parameterized:
+        engine.fetch(sql, params)
+    parameterized_s = time.perf_counter() - started
+
+    print(f"queries:        {n}")
+    print(f"literal:        {n / literal_s:,.0f} queries/s")
+    print(f"parameterized:  {n / parameterized_s:,.0f} queries/s ({literal_s / parameterized_s:.2f}x)")
+    print(f"statement cache: {engine.statement_cache_info()}")
+    engine.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
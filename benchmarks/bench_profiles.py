@@ -0,0 +1,78 @@
+# Import and query timings of every tuning profile on a synthetic table.
+# Each profile gets a fresh database file; the import runs under the profile itself.
+# import: chunked import_csv of the whole file; queries: one pass over three builder queries;
+# commit: one single-row UPDATE committed on its own.
+#
+#   python benchmarks/bench_profiles.py [rows]
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import SQLQueryBuilder
+from db_connection import TUNING_PROFILES, SQLiteDataEngine
+
+
+def write_csv(path, rows):
+    rng = np.random.default_rng(0)
+    pd.DataFrame({
+        "id": np.arange(rows),
+        "type": rng.choice(["MOVIE", "SHOW"], rows),
+        "release_year": rng.integers(1950, 2025, rows),
+        "imdb_score": rng.uniform(1, 10, rows).round(1),
+        "title": [f"title {i}" for i in range(rows)],
+    }).to_csv(path, index=False)
+
+
+def queries():
+    return [
+        SQLQueryBuilder("events").select("type", ("AVG(imdb_score)", "avg_score")).group_by("type"),
+        SQLQueryBuilder("events").select("title").where("release_year", 1999).order_by("imdb_score"),
+        SQLQueryBuilder("events").select(("COUNT(*)", "n")).where("imdb_score", (">=", 7)),
+    ]
+
+
+def run(profile, csv_path, directory, repeats=20):
+    db_path = os.path.join(directory, f"{profile}.db")
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = SQLiteDataEngine(db_path, profile=profile)
+        started = time.perf_counter()
+        engine.import_csv(csv_path, "events", chunksize=50_000, progress=lambda done, rate: None)
+        import_s = time.perf_counter() - started
+
+        workload = queries()
+        started = time.perf_counter()
+        for _ in range(repeats):
+            for query in workload:
+                engine.fetch(query)
+        query_s = (time.perf_counter() - started) / repeats
+
+        started = time.perf_counter()
+        for i in range(2_000):
+            engine.execute("UPDATE events SET imdb_score = imdb_score + 0 WHERE rowid = ?", (i + 1,))
+        commit_s = (time.perf_counter() - started) / 2_000
+        engine.close()
+    return import_s, query_s, commit_s
+
+
+def main(rows=500_000):
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "events.csv")
+        write_csv(csv_path, rows)
+        print(f"rows: {rows}")
+        print(f"{'profile':<12} {'import s':>9} {'queries ms':>11} {'commit ms':>10}")
+        for profile in TUNING_PROFILES:
+            import_s, query_s, commit_s = run(profile, csv_path, directory)
+            print(f"{profile:<12} {import_s:>9.2f} {query_s * 1000:>11.1f} {commit_s * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500_000)
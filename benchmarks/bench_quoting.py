@@ -0,0 +1,77 @@
+# Cost of identifier quoting: the previous check_reserved_word (list scan plus an uncompiled regex
+# on every call) against the set-based quote_identifier, uncached and memoized, and the effect on
+# SQLQueryBuilder throughput.
+#
+#   python benchmarks/bench_quoting.py [builds]
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from db import SQLQueryBuilder
+from db_connection import check_reserved_word, quote_identifier, reserved_words_sqlite
+
+COLUMNS = ["title", "type", "index", "release_year", "imdb_score", "COUNT(index)", "AVG(imdb_score)", "order"]
+
+
+# check_reserved_word as it was before the quoting layer, minus its print() calls
+def legacy_check_reserved_word(wd, dialect="sqlite"):
+    words = [reserved_words_sqlite]
+
+    def quote_if_reserved(d):
+        pattern = r'\b(MIN|MAX|COUNT|SUM|AVG)\(\s*"?(\w+)"?\s*\)'
+        match = re.match(pattern, d)
+        if match:
+            func, col = match.group(1), match.group(2)
+            for w in words:
+                if col.upper() in w:
+                    return f'{func}("{col}")'
+            return f"{func}({col})"
+        for w in words:
+            if d.upper() in w:
+                return f'"{d}"'
+        return d
+
+    if isinstance(wd, list):
+        return tuple(quote_if_reserved(d) for d in wd)
+    return quote_if_reserved(wd)
+
+
+def rate(fn, count):
+    started = time.perf_counter()
+    for i in range(count):
+        fn(COLUMNS[i % len(COLUMNS)])
+    return count / (time.perf_counter() - started)
+
+
+def build_rate(count):
+    started = time.perf_counter()
+    for i in range(count):
+        (SQLQueryBuilder("titles").select("title", "index", ("AVG(imdb_score)", "avg_score"))
+         .where("type", "MOVIE").and_("release_year", (">=", 2000 + i % 20))
+         .group_by("title").order_by("avg_score", desc=True).build(params=True))
+    return count / (time.perf_counter() - started)
+
+
+def main(builds=50_000):
+    calls = builds * 8
+    print(f"{'quoting':<28} {'calls/s':>14}")
+    print(f"{'legacy list scan':<28} {rate(legacy_check_reserved_word, calls):>14,.0f}")
+    print(f"{'set lookup, uncached':<28} {rate(quote_identifier.__wrapped__, calls):>14,.0f}")
+    print(f"{'set lookup, memoized':<28} {rate(check_reserved_word, calls):>14,.0f}")
+
+    db.check_reserved_word = legacy_check_reserved_word
+    legacy = build_rate(builds)
+    db.check_reserved_word = check_reserved_word
+    current = build_rate(builds)
+    print(f"\n{'builder':<28} {'builds/s':>14}")
+    print(f"{'legacy quoting':<28} {legacy:>14,.0f}")
+    print(f"{'memoized quoting':<28} {current:>14,.0f} ({current / legacy:.2f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
@@ -0,0 +1,185 @@
+# Regression benchmarks: import_csv, SQLQueryBuilder.build throughput, query execution for the
+# common filter/group/order shapes and DataOutput CSV export, on synthetic data (datagen.py) at
+# one or more scales. Results go to a JSON file so runs on different commits can be compared.
+#
+#   python benchmarks/bench_suite.py --scales 10k,100k,1m --output results.json
+#   python benchmarks/bench_suite.py --scales 10k --output new.json --compare results.json
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from datagen import write_csv
+from db import SQLQueryBuilder
+from db_connection import SQLiteDataEngine
+from output import DataOutput
+
+TABLE = "titles"
+
+
+# representative query shapes; each is rebuilt per run so build cost is part of the query time
+QUERIES = {
+    "point_filter": lambda: SQLQueryBuilder(TABLE).select("title", "imdb_score").where("id", 4321),
+    "range_order_limit": lambda: (
+        SQLQueryBuilder(TABLE).select("title", "imdb_score")
+        .where("release_year", (">=", 2015)).and_("type", "MOVIE").order_by("imdb_score", desc=True).limit(100)
+    ),
+    "group_aggregate": lambda: (
+        SQLQueryBuilder(TABLE).select("genre", ("AVG(imdb_score)", "avg_score"), ("COUNT(*)", "n")).group_by("genre")
+    ),
+    "filter_group_having": lambda: (
+        SQLQueryBuilder(TABLE).select("release_year", ("COUNT(*)", "n")).where("type", "SHOW")
+        .group_by("release_year").having("COUNT(*)", (">", 10))
+    ),
+    "like_scan": lambda: SQLQueryBuilder(TABLE).select(("COUNT(*)", "n")).like_("title", "title 12%"),
+}
+
+
+def parse_scale(text):
+    text = text.strip().lower()
+    factor = {"k": 1_000, "m": 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip("km")) * factor)
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times), min(times)
+
+
+def result(name, scale, median, best, rows=None):
+    entry = {"name": name, "scale": scale, "median_s": median, "min_s": best}
+    if rows:
+        entry["rows_per_s"] = rows / median
+    return entry
+
+
+def bench_build(repeat, count=20_000):
+    results = []
+    for name, params in (("build", False), ("build_params", True)):
+        def run():
+            for i in range(count):
+                (SQLQueryBuilder(TABLE).select("title", "imdb_score").where("release_year", 2000 + i % 20)
+                 .and_("type", "MOVIE").order_by("imdb_score").build(params=params))
+        median, best = timed(run, repeat)
+        entry = result(name, None, median, best)
+        entry["builds_per_s"] = count / median
+        results.append(entry)
+    return results
+
+
+def bench_scale(rows, directory, repeat):
+    csv_path = write_csv(os.path.join(directory, f"titles_{rows}.csv"), rows)
+    db_path = os.path.join(directory, f"titles_{rows}.db")
+    results = []
+
+    def load(chunksize=None):
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        engine = SQLiteDataEngine(db_path)
+        engine.import_csv(csv_path, TABLE, chunksize=chunksize)
+        engine.close()
+
+    results.append(result("import_csv", rows, *timed(load, repeat), rows))
+    results.append(result("import_csv_chunked", rows, *timed(lambda: load(100_000), repeat), rows))
+
+    engine = SQLiteDataEngine(db_path)
+    for name, query in QUERIES.items():
+        results.append(result(f"query.{name}", rows, *timed(lambda: engine.fetch(query()), repeat)))
+    engine.close()
+
+    export = SQLQueryBuilder(TABLE).select("*").where("type", "MOVIE")
+    with contextlib.chdir(directory):
+        median, best = timed(lambda: DataOutput(db_path, export, "export"), repeat)
+        movies = sum(1 for _ in open("export.csv")) - 1
+    results.append(result("export_csv", rows, median, best, movies))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# print every benchmark next to the baseline run; slower than `threshold` is flagged
+def compare(current, baseline, threshold):
+    base = {(r["name"], r["scale"]): r["median_s"] for r in baseline["results"]}
+    print(f"\nagainst {baseline['meta'].get('commit')}:")
+    print(f"{'benchmark':<28} {'scale':>9} {'base s':>10} {'now s':>10} {'change':>8}")
+    regressions = 0
+    for r in current["results"]:
+        old = base.get((r["name"], r["scale"]))
+        if old is None:
+            continue
+        change = r["median_s"] / old - 1
+        flag = "  <-- slower" if change > threshold else ""
+        regressions += bool(flag)
+        print(f"{r['name']:<28} {str(r['scale']):>9} {old:>10.4f} {r['median_s']:>10.4f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", default="10k,100k", help="comma separated row counts, e.g. 10k,100k,1m,10m")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark; the median is reported")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown flagged by --compare")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": [],
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        report["results"] += bench_build(args.repeat)
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.scales.split(","):
+            with contextlib.redirect_stdout(io.StringIO()):
+                report["results"] += bench_scale(parse_scale(scale), directory, args.repeat)
+
+    print(f"{'benchmark':<28} {'scale':>9} {'median s':>10} {'rate/s':>12}")
+    for r in report["results"]:
+        rate = r.get("rows_per_s") or r.get("builds_per_s")
+        rate = f"{rate:,.0f}" if rate else "-"
+        print(f"{r['name']:<28} {str(r['scale']):>9} {r['median_s']:>10.4f} {rate:>12}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            return 1 if compare(report, json.load(f), args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
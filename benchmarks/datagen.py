@@ -0,0 +1,44 @@
+# Synthetic stand-in for the Netflix titles CSV used by the tests, at any scale.
+# The same seed and row count always give the same file, so runs on different commits compare.
+#
+#   python benchmarks/datagen.py rows path.csv
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+TYPES = ["MOVIE", "SHOW"]
+CERTIFICATIONS = ["G", "PG", "PG-13", "R", "NC-17", "TV-MA", "TV-14", "TV-PG", "TV-Y"]
+GENRES = ["drama", "comedy", "thriller", "documentation", "romance", "action", "crime", "animation"]
+
+
+# a DataFrame of `rows` titles; written in chunks by write_csv so 10M rows fit in memory
+def generate(rows, seed=0, start=0):
+    rng = np.random.default_rng(seed + start)
+    ids = np.arange(start, start + rows)
+    votes = rng.lognormal(8, 2, rows).astype(np.int64)
+    return pd.DataFrame({
+        "id": ids,
+        "title": [f"title {i}" for i in ids],
+        "type": rng.choice(TYPES, rows, p=[0.65, 0.35]),
+        "release_year": rng.integers(1950, 2025, rows),
+        "age_certification": rng.choice(CERTIFICATIONS, rows),
+        "runtime": rng.integers(5, 240, rows),
+        "genre": rng.choice(GENRES, rows),
+        "imdb_score": rng.uniform(1, 10, rows).round(1),
+        # about one title in ten has no votes yet
+        "imdb_votes": np.where(rng.random(rows) < 0.1, np.nan, votes),
+    })
+
+
+def write_csv(path, rows, seed=0, chunk=1_000_000):
+    for start in range(0, rows, chunk):
+        generate(min(chunk, rows - start), seed, start).to_csv(
+            path, mode="w" if start == 0 else "a", header=start == 0, index=False
+        )
+    return path
+
+
+if __name__ == "__main__":
+    write_csv(sys.argv[2], int(sys.argv[1]))
@@ -1,9 +1,54 @@
-from db_connection import check_reserved_word
+import logging
+
+from db_connection import IDENTIFIER_QUOTES, TEXT_INDEX_SUFFIX, check_reserved_word, explain_query_plan
+
+logger = logging.getLogger("simplesqlengine.builder")
 
 
 # Description: A simple SQL data engine for SQLite with automatic schema inference from DataFrames and CSV files.
 
 
+# value bound to a "?" placeholder where the literal form inlines it as SQL (update, insert,
+# between_): SQL string literals like "'2025-01-01'" lose their quotes
+def _unquote(value):
+    if isinstance(value, str) and len(value) >= 2 and value[0] == value[-1] == "'":
+        return value[1:-1].replace("''", "'")
+    return value
+
+
+# column name the builder always quotes (update, insert, between_, like_): quoted with the quote
+# character of the dialect, once, also when check_reserved_word already quoted it
+def _quoted_column(col, dialect="sqlite"):
+    col = check_reserved_word(col, dialect)
+    quote = IDENTIFIER_QUOTES[dialect]
+    return col if col.startswith(quote) else f"{quote}{col}{quote}"
+
+
+def _is_sql_expression(value):
+    return isinstance(value, str) and (value.startswith('"') or value.upper().endswith("()"))
+
+
+# value written into the SQL text the way update() does: plain strings are single-quoted
+def _sql_literal(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, str):
+        if value.startswith("'") or value.startswith('"') or value.upper().endswith("()"):
+            return value
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+# comparison operator of a where/and_/or_ condition value
+def _condition_operator(value):
+    if value is None or value is False:
+        return "IS"
+    if isinstance(value, tuple) and len(value) == 2:
+        op, val = value
+        return "IS" if val is None else op.strip().upper()
+    return "="
+
+
 class SQLQueryBuilder:
     def __init__(self, db_table, db_type="sqlite"):
         self._exists = ""
@@ -18,26 +63,50 @@ class SQLQueryBuilder:
         self._limit = ""
         self._query = ""
         self._having_conditions = []
+        self.insert_columns = []
+        # (column, value SQL) pairs of update(), the value "?" when it is bound
+        self._assignments = []
+        # the same clauses with "?" placeholders, as (sql, params) pairs, for build(params=True)
+        self._query_params = ("", [])
+        self._where_params = []
+        self._having_params = []
+        # plain column names used by the query, for the engine's index advisor
+        self._predicates = []
+        self._group_columns = []
+        self._order_columns = []
 
     def update(self, **kwargs):
         parts = []
+        templates = []
+        params = []
 
+        assignments = []
         for key, val in kwargs.items():
+            col = _quoted_column(key, self.__type)
+            # SQL functions and double-quoted identifiers stay in the statement text
+            if isinstance(val, str) and (val.startswith('"') or val.upper().endswith("()")):
+                templates.append(f'{col} = {val}')
+                assignments.append((key, val))
+            else:
+                templates.append(f'{col} = ?')
+                assignments.append((key, "?"))
+                params.append(_unquote(val))
             # Auto-quote plain strings that are not already quoted or SQL functions
             if isinstance(val, str) and not (
                     val.startswith("'") or val.startswith('"') or val.upper().endswith("()")
             ):
                 val = f"'{val}'"
-            parts.append(f'"{key}" = {val}')
+            parts.append(f'{col} = {val}')
 
-        print(parts)
+        logger.debug("update parts: %s", parts)
 
         if not parts:
             raise ValueError("No columns to update provided.")
 
         self._select = ", ".join(parts)
-        print(self._select)
         self._query = f"UPDATE {self.table} SET {self._select} "
+        self._query_params = (f"UPDATE {self.table} SET {', '.join(templates)} ", params)
+        self._assignments = assignments
         return self
     def delete(self, *columns):
 
@@ -50,18 +119,72 @@ class SQLQueryBuilder:
                 parts.append(col)
         self._select = ", ".join(parts)
         self._query = f"DELETE FROM {self.table} "
+        self._query_params = (self._query, [])
+
+        return self
+
+    # Single-row INSERT: insert(title="Heat", release_year=1995).
+    # build() inlines the values, build(params=True) binds them to "?" placeholders.
+    def insert(self, **values):
+        if not values:
+            raise ValueError("No columns to insert provided.")
+        self._set_insert(list(values), list(values.values()))
+        return self
+
+    # INSERT shape for many rows: insert_many("title", "release_year") builds
+    # INSERT INTO t ("title", "release_year") VALUES (?, ?) for SQLiteDataEngine.executemany.
+    def insert_many(self, *columns):
+        if not columns:
+            raise ValueError("No columns to insert provided.")
+        self._set_insert(list(columns))
+        return self
 
+    # INSERT ... ON CONFLICT (key) DO UPDATE: upsert("id", "score", key="id") for many rows, or
+    # upsert(key="id", id=3, score=8.5) for one. `update` lists the columns overwritten on conflict
+    # (default: every non-key column); with none left the conflict is ignored (DO NOTHING).
+    def upsert(self, *columns, key, update=None, **values):
+        if columns and values:
+            raise ValueError("Pass either column names or column values to upsert, not both.")
+        keys = [key] if isinstance(key, str) else list(key)
+        names = list(columns) or list(values)
+        if not names:
+            raise ValueError("No columns to insert provided.")
+        update = [col for col in names if col not in keys] if update is None else list(update)
+        conflict = ", ".join(_quoted_column(col, self.__type) for col in keys)
+        if update:
+            quoted = [_quoted_column(col, self.__type) for col in update]
+            sets = ", ".join(f"{col} = excluded.{col}" for col in quoted)
+            suffix = f"ON CONFLICT ({conflict}) DO UPDATE SET {sets} "
+        else:
+            suffix = f"ON CONFLICT ({conflict}) DO NOTHING "
+        self._set_insert(names, list(values.values()) if values else None, suffix)
         return self
+
+    # INSERT statement for `columns`; without `values` every column gets a "?" placeholder
+    def _set_insert(self, columns, values=None, suffix=""):
+        self.insert_columns = columns
+        cols = ", ".join(_quoted_column(col, self.__type) for col in columns)
+        head = f"INSERT INTO {self.table} ({cols}) VALUES "
+        if values is None:
+            marks = ", ".join("?" for _ in columns)
+            self._query = f"{head}({marks}) {suffix}"
+            self._query_params = (self._query, [])
+            return
+        # SQL functions and double-quoted identifiers stay in the statement text, like update()
+        marks = [v if _is_sql_expression(v) else "?" for v in values]
+        params = [_unquote(v) for v in values if not _is_sql_expression(v)]
+        self._query = f"{head}({', '.join(_sql_literal(v) for v in values)}) {suffix}"
+        self._query_params = (f"{head}({', '.join(marks)}) {suffix}", params)
     def select(self, *columns,top=False,top_count=None):
         parts = []
         for col in columns:
             if isinstance(col, tuple):
                 expr, alias = col
-                expr = check_reserved_word(expr)
-                alias = check_reserved_word(alias)
+                expr = check_reserved_word(expr, self.__type)
+                alias = check_reserved_word(alias, self.__type)
                 parts.append(f"{expr} AS {alias}")
             else:
-                col = check_reserved_word(col)
+                col = check_reserved_word(col, self.__type)
                 parts.append(col)
         self._select = ", ".join(parts)
 
@@ -74,20 +197,22 @@ class SQLQueryBuilder:
                 if top_count is not None:
                     raise ValueError("top_count should not be specified when top is False.")
                 self._query = f"SELECT {self._select} FROM {self.table} "
-
+        self._query_params = (self._query, [])
 
         return self
 
+    # With parameterized=True the values become "?" placeholders and (sql, params) is returned
     @staticmethod
-    def _parse_condition(col, value):
-        col = check_reserved_word(col)
+    def _parse_condition(col, value, parameterized=False, dialect="sqlite"):
+        col = check_reserved_word(col, dialect)
         # 1) NULL‐check
         if value is None:
-            return f'{col} IS NULL'
+            sql = f'{col} IS NULL'
+            return (sql, []) if parameterized else sql
           # 1b) interpret False as “IS NOT NULL”
         if value is False:
-
-            return f'{col} IS NOT NULL'
+            sql = f'{col} IS NOT NULL'
+            return (sql, []) if parameterized else sql
 
         # 2) tuple for operators, including NULL/not‐NULL if you want
         if isinstance(value, tuple) and len(value) == 2:
@@ -95,11 +220,14 @@ class SQLQueryBuilder:
             # e.g. ("!=", None) → IS NOT NULL
             if val is None:
                 if op in ("!=", "<>"):
-                    return f'{col} IS NOT NULL'
+                    sql = f'{col} IS NOT NULL'
                 elif op == "=":
-                    return f'{col} IS NULL'
+                    sql = f'{col} IS NULL'
                 else:
                     raise ValueError(f"Unsupported NULL operator: {op}")
+                return (sql, []) if parameterized else sql
+            if parameterized:
+                return f'{col} {op} ?', [val]
             # non‐NULL tuple
             if isinstance(val, str):
                 return f'{col}  {op} "{val}"'
@@ -108,46 +236,83 @@ class SQLQueryBuilder:
 
         # 3) simple scalar equality
         if isinstance(value, (int, float, bool)):
+            if parameterized:
+                return f'{col} = ?', [value]
             # bools map to SQL TRUE/FALSE if you like, or as 1/0
             return f'{col} = {value!r}'  # repr(True)->'True', repr(3)->'3'
 
         if isinstance(value, str):
+            if parameterized:
+                # bound as-is: the literal form compares against the whole string, quotes included
+                return f'{col} = ?', [value]
             return f'{col} = "{value}"'
 
         raise ValueError(f"Unsupported condition type: {value!r}")
 
-    def where(self, col, value):
-        self._where_conditions = [self._parse_condition(col, value)]
+    # append a condition in both its literal and its parameterized form
+    def _add_condition(self, prefix, col, value, having=False, reset=False):
+        literal = self._having_conditions if having else self._where_conditions
+        templates = self._having_params if having else self._where_params
+        if reset:
+            literal.clear()
+            templates.clear()
+            if not having:
+                self._predicates.clear()
+        if not having:
+            self._predicates.append((prefix.strip(), col, _condition_operator(value), value))
+        literal.append(prefix + self._parse_condition(col, value, dialect=self.__type))
+        sql, params = self._parse_condition(col, value, parameterized=True, dialect=self.__type)
+        templates.append((prefix + sql, params))
         return self
 
+    def where(self, col, value):
+        return self._add_condition("", col, value, reset=True)
+
     def and_(self, col, value):
-        self._where_conditions.append("AND " + self._parse_condition(col, value))
-        return self
+        return self._add_condition("AND ", col, value)
 
     def or_(self, col, value):
-        self._where_conditions.append("OR " + self._parse_condition(col, value))
-        return self
+        return self._add_condition("OR ", col, value)
 
     def in_(self, col, values):
-        self._where_conditions.append("IN" + self._parse_condition(col, values))
-        return self
+        return self._add_condition("IN", col, values)
     def not_in_(self, col, values):
-        self._where_conditions.append("NOT IN" + self._parse_condition(col, values))
-        return self
+        return self._add_condition("NOT IN", col, values)
     def between_(self, col, start, end):
-        col = check_reserved_word(col)
-        start = check_reserved_word(start)
-        end = check_reserved_word(end)
-        self._where_conditions.append(f'"{col}" BETWEEN {start} AND {end}')
+        self._predicates.append(("AND", col, "BETWEEN", (_unquote(start), _unquote(end))))
+        col = _quoted_column(col, self.__type)
+        self._where_params.append((f'{col} BETWEEN ? AND ?', [_unquote(start), _unquote(end)]))
+        self._where_conditions.append(f'{col} BETWEEN {start} AND {end}')
         return self
     def not_between_(self, col, start, end):
-        self._where_conditions.append(f'"{col}" NOT BETWEEN {start} AND {end}')
+        self._predicates.append(("AND", col, "NOT BETWEEN", (_unquote(start), _unquote(end))))
+        col = _quoted_column(col, self.__type)
+        self._where_params.append((f'{col} NOT BETWEEN ? AND ?', [_unquote(start), _unquote(end)]))
+        self._where_conditions.append(f'{col} NOT BETWEEN {start} AND {end}')
         return self
     def like_(self, col, pattern):
-        col = check_reserved_word(col)
+        self._predicates.append(("AND", col, "LIKE", pattern))
+        col = _quoted_column(col, self.__type)
         if not isinstance(pattern, str):
             raise ValueError("LIKE pattern must be a string.")
-        self._where_conditions.append(f'"{col}" LIKE "{pattern}"')
+        self._where_conditions.append(f'{col} LIKE "{pattern}"')
+        self._where_params.append((f'{col} LIKE ?', [pattern]))
+        return self
+
+    # Full-text search through the table's FTS5 index (SQLiteDataEngine.create_text_index), as a
+    # rowid semi-join: match_("description", "heist") searches one indexed column, match_(None, ...)
+    # all of them. `query` uses FTS5 syntax, e.g. "heat*" for a prefix or "heat OR heist".
+    def match_(self, col, query):
+        if not isinstance(query, str):
+            raise ValueError("MATCH query must be a string.")
+        fts = f'"{self.table}{TEXT_INDEX_SUFFIX}"'
+        target = fts if col is None else f'"{col}"'
+        prefix = "AND " if self._where_conditions else ""
+        if col is not None:
+            self._predicates.append(("AND", col, "MATCH", query))
+        literal = "'" + query.replace("'", "''") + "'"
+        self._where_conditions.append(f"{prefix}rowid IN (SELECT rowid FROM {fts} WHERE {target} MATCH {literal})")
+        self._where_params.append((f"{prefix}rowid IN (SELECT rowid FROM {fts} WHERE {target} MATCH ?)", [query]))
         return self
 
     def exists_(self, query, with_where=True):
@@ -155,6 +320,7 @@ class SQLQueryBuilder:
             raise ValueError("EXISTS query must be a string.")
         if with_where:
             self._where_conditions.append(f'EXISTS ({query})')
+            self._where_params.append((f'EXISTS ({query})', []))
         else:
             self._exists = f' AND EXISTS ({query})'
 
@@ -163,29 +329,31 @@ class SQLQueryBuilder:
     def group_by(self, *fields):
 
         self._group_by = f"GROUP BY {', '.join(fields)}"
+        self._group_columns = list(fields)
         return self
 
     def having(self, col, value):
-        self._having_conditions = [self._parse_condition(col, value)]
-        return self
+        return self._add_condition("", col, value, having=True, reset=True)
 
     def and_having(self, col, value):
-        self._having_conditions.append("AND " + self._parse_condition(col, value))
-        return self
+        return self._add_condition("AND ", col, value, having=True)
 
     def having_exists(self, subquery: str):
 
         self._having_conditions.append(f"EXISTS ({subquery})")
+        self._having_params.append((f"EXISTS ({subquery})", []))
         return self
     def and_exist_having(self, subquery: str):
         self._having_conditions.append(f"AND EXISTS ({subquery})")
+        self._having_params.append((f"AND EXISTS ({subquery})", []))
         return self
 
     def order_by(self, *fields, desc=False):
         order = "DESC" if desc else "ASC"
         if not fields:
             raise ValueError("At least one field must be specified for ORDER BY.")
-        fields = [check_reserved_word(field) for field in fields]
+        self._order_columns = list(fields)
+        fields = [check_reserved_word(field, self.__type) for field in fields]
 
         self._order_by = f"ORDER BY {', '.join(fields)} {order}"
         return self
@@ -194,8 +362,101 @@ class SQLQueryBuilder:
         self._limit = f"LIMIT {n}"
         return self
 
-
-    def build(self,exists=False):
+    # One keyset page of a SELECT as (sql, params): the rows after `after` (the key value, or tuple of
+    # values, of the previous page's last row) in `key` order, at most `page_size` of them. The key
+    # columns are prepended to every row. A key that is not unique should end in "rowid", e.g.
+    # key=("date_added", "rowid"), or rows sharing a key value across a page boundary are skipped.
+    # NULL keys never compare greater or less than `after`, so only the first page can hold them.
+    def page(self, page_size, key="rowid", after=None, desc=False):
+        if not self._query.lstrip().upper().startswith("SELECT"):
+            raise ValueError("Only SELECT queries can be paginated.")
+        if self._group_by or self._having_params:
+            raise ValueError("Keyset pagination does not support GROUP BY or HAVING.")
+        if self._order_by or self._limit or self._exists:
+            raise ValueError("Keyset pagination orders and limits pages itself, it does not support "
+                             "order_by, limit or having_exists.")
+        if int(page_size) <= 0:
+            raise ValueError("page_size must be a positive integer.")
+        keys = [check_reserved_word(k, self.__type) for k in ((key,) if isinstance(key, str) else key)]
+        query, values = self._query_params
+        values = list(values)
+        query = f"SELECT {', '.join(keys)}, " + query.lstrip()[len("SELECT "):]
+
+        filters = []
+        if self._where_params:
+            filters.append("(" + " ".join(sql for sql, _ in self._where_params) + ")")
+            values += [v for _, params in self._where_params for v in params]
+        if after is not None:
+            after = tuple(after) if isinstance(after, (tuple, list)) else (after,)
+            if len(after) != len(keys):
+                raise ValueError(f"after must have one value per key column ({len(keys)}).")
+            op = "<" if desc else ">"
+            if len(keys) == 1:
+                filters.append(f"{keys[0]} {op} ?")
+            else:
+                filters.append(f"({', '.join(keys)}) {op} ({', '.join(['?'] * len(keys))})")
+            values += after
+        if filters:
+            query += "WHERE " + " AND ".join(filters) + " "
+        order = "DESC" if desc else "ASC"
+        query += f"ORDER BY {', '.join(f'{k} {order}' for k in keys)} LIMIT {int(page_size)}"
+        return query + ";", tuple(values)
+
+    # Walk the query page by page with keyset predicates (`WHERE key > last`), yielding lists of rows
+    # without the key columns. Every page is an index range seek, so memory and per-page latency stay
+    # constant however far into the table the scan is. `connect` is an engine or a sqlite3 connection.
+    # Views (dictionary-encoded and partitioned tables) have no rowid, page them on a key column.
+    def paginate(self, connect, page_size=10000, key="rowid", desc=False):
+        width = 1 if isinstance(key, str) else len(key)
+        keys = (key,) if isinstance(key, str) else tuple(key)
+
+        def fetch(sql, params=()):
+            if hasattr(connect, "fetch"):
+                return connect.fetch(sql, params)
+            return connect.execute(sql, params).fetchall()
+
+        if "rowid" in keys and fetch("SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = ?", (self.table,)):
+            raise ValueError(f"'{self.table}' is a view without rowids, paginate it on a key column.")
+        after = None
+        while True:
+            sql, params = self.page(page_size, key, after, desc)
+            rows = fetch(sql, params)
+            if not rows:
+                return
+            last = rows[-1]
+            after = last[0] if width == 1 else last[:width]
+            if after is None or width > 1 and None in after:
+                raise ValueError(f"The key {keys} of '{self.table}' came back NULL, it cannot be paged on.")
+            yield [row[width:] for row in rows]
+            if len(rows) < page_size:
+                return
+
+    iter_batches = paginate
+
+
+    # Columns the query filters, groups and orders on, as plain names:
+    # {"table": ..., "filters": [(connector, column, operator), ...], "group_by": [...], "order_by": [...]}
+    def columns_used(self):
+        return {
+            "table": self.table,
+            "filters": [(connector, col.strip('"'), op) for connector, col, op, _ in self._predicates],
+            "group_by": [col.strip('"') for col in self._group_columns],
+            "order_by": [col.strip('"') for col in self._order_columns],
+        }
+
+    # EXPLAIN QUERY PLAN of the query as a QueryPlan tree, on an engine (compiled as the engine
+    # would run it) or on a sqlite3 connection
+    def explain(self, target):
+        if hasattr(target, "explain"):
+            return target.explain(self)
+        sql, params = self.build(params=True)
+        return explain_query_plan(target, sql, params)
+
+    # With params=True the values are left out of the SQL text as "?" placeholders and
+    # (sql, params) is returned, so every filter value shares one statement in sqlite3's cache.
+    def build(self,exists=False, params=False):
+        if params:
+            return self._build_parameterized(exists)
         # query = f"SELECT {self._select} FROM {self.table} "
         query = self._query
         if self._where_conditions:
@@ -216,5 +477,22 @@ class SQLQueryBuilder:
             r = query.strip() + ";"
         return r
 
-
-
+    def _build_parameterized(self, exists=False):
+        query, values = self._query_params
+        values = list(values)
+        if self._where_params:
+            query += "WHERE " + " ".join(sql for sql, _ in self._where_params) + " "
+            values += [v for _, params in self._where_params for v in params]
+        if self._group_by:
+            query += self._group_by + " "
+        if self._having_params:
+            query += "HAVING " + " ".join(sql for sql, _ in self._having_params) + " "
+            values += [v for _, params in self._having_params for v in params]
+        if self._order_by:
+            query += self._order_by + " "
+        if self._limit:
+            query += self._limit
+        if self._exists:
+            query += self._exists
+        r = query.strip() if exists else query.strip() + ";"
+        return r, tuple(values)
@@ -1,38 +1,62 @@
+import glob
+import hashlib
+import json
+import logging
+import multiprocessing
 import os
+import pathlib
+import queue
 import re
 import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from itertools import count, islice
 
+import numpy as np
 import pandas as pd
 
-def check_reserved_word(wd):
-    print("wd is:", wd)
-
-    words = [reserved_words_sqlite]
-
-    def quote_if_reserved(d):
-        pattern = r'\b(MIN|MAX|COUNT|SUM|AVG)\(\s*"?(\w+)"?\s*\)'
-        match = re.match(pattern, d)
-        if match:
-            func, col = match.group(1), match.group(2)
-            for w in words:
-                if col.upper() in w:
-                    print(f"Warning: {col} is a reserved word in SQL, so it has been quoted.")
-                    return f'{func}("{col}")'
-            print(f"No reserved word found in {col}, no quoting needed.")
-            return f"{func}({col})"
-        else:
-            for w in words:
-                if d.upper() in w:
-                    print(f"Warning: {d} is a reserved word in SQL, so it has been quoted.")
-                    return f'"{d}"'
-            print(f"No reserved word found in {d}, no quoting needed.")
-            return d
+# Library logger: silent unless the application configures logging, e.g.
+# logging.getLogger("simplesqlengine").setLevel(logging.DEBUG) plus a handler.
+logger = logging.getLogger("simplesqlengine")
+logger.addHandler(logging.NullHandler())
+
+
+# aggregate over a single column, e.g. COUNT(index) or AVG("imdb_score")
+_AGGREGATE_PATTERN = re.compile(r'\b(MIN|MAX|COUNT|SUM|AVG)\(\s*"?(\w+)"?\s*\)')
+
+
+# Quote an identifier (or the column of a single-column aggregate) when it is a reserved word of
+# the dialect. Results are memoized: queries are built over and over from a few column names.
+@lru_cache(maxsize=4096)
+def quote_identifier(name, dialect="sqlite"):
+    if not isinstance(name, str):
+        return name
+    words = RESERVED_WORDS[dialect]
+    quote = IDENTIFIER_QUOTES[dialect]
+    match = _AGGREGATE_PATTERN.match(name)
+    if match:
+        func, col = match.group(1), match.group(2)
+        if col.upper() in words:
+            logger.debug("%s is a reserved word in SQL, so it has been quoted.", col)
+            return f"{func}({quote}{col}{quote})"
+        return f"{func}({col})"
+    if name.upper() in words:
+        logger.debug("%s is a reserved word in SQL, so it has been quoted.", name)
+        return f"{quote}{name}{quote}"
+    return name
 
+
+def check_reserved_word(wd, dialect="sqlite"):
     # Handle list or single string
     if isinstance(wd, list):
-        return tuple(quote_if_reserved(d) for d in wd)
+        return tuple(quote_identifier(d, dialect) for d in wd)
     else:
-        return quote_if_reserved(wd)
+        return quote_identifier(wd, dialect)
 
 
 # SQLite
@@ -66,6 +90,76 @@ reserved_words_sqlite = [
     "WITH", "WITHOUT"
 ]
 
+# MySQL 8.0 (identifiers are quoted with backticks)
+
+reserved_words_mysql = [
+    "ACCESSIBLE", "ADD", "ALL", "ALTER", "ANALYZE", "AND", "AS", "ASC", "ASENSITIVE",
+    "BEFORE", "BETWEEN", "BIGINT", "BINARY", "BLOB", "BOTH", "BY",
+    "CALL", "CASCADE", "CASE", "CHANGE", "CHAR", "CHARACTER", "CHECK", "COLLATE", "COLUMN",
+    "CONDITION", "CONSTRAINT", "CONTINUE", "CONVERT", "CREATE", "CROSS", "CUBE", "CUME_DIST",
+    "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP", "CURRENT_USER", "CURSOR",
+    "DATABASE", "DATABASES", "DAY_HOUR", "DAY_MICROSECOND", "DAY_MINUTE", "DAY_SECOND",
+    "DEC", "DECIMAL", "DECLARE", "DEFAULT", "DELAYED", "DELETE", "DENSE_RANK", "DESC",
+    "DESCRIBE", "DETERMINISTIC", "DISTINCT", "DISTINCTROW", "DIV", "DOUBLE", "DROP", "DUAL",
+    "EACH", "ELSE", "ELSEIF", "EMPTY", "ENCLOSED", "ESCAPED", "EXCEPT", "EXISTS", "EXIT", "EXPLAIN",
+    "FALSE", "FETCH", "FIRST_VALUE", "FLOAT", "FLOAT4", "FLOAT8", "FOR", "FORCE", "FOREIGN",
+    "FROM", "FULLTEXT", "FUNCTION",
+    "GENERATED", "GET", "GRANT", "GROUP", "GROUPING", "GROUPS",
+    "HAVING", "HIGH_PRIORITY", "HOUR_MICROSECOND", "HOUR_MINUTE", "HOUR_SECOND",
+    "IF", "IGNORE", "IN", "INDEX", "INFILE", "INNER", "INOUT", "INSENSITIVE", "INSERT",
+    "INT", "INT1", "INT2", "INT3", "INT4", "INT8", "INTEGER", "INTERSECT", "INTERVAL", "INTO",
+    "IO_AFTER_GTIDS", "IO_BEFORE_GTIDS", "IS", "ITERATE",
+    "JOIN", "JSON_TABLE", "KEY", "KEYS", "KILL",
+    "LAG", "LAST_VALUE", "LATERAL", "LEAD", "LEADING", "LEAVE", "LEFT", "LIKE", "LIMIT",
+    "LINEAR", "LINES", "LOAD", "LOCALTIME", "LOCALTIMESTAMP", "LOCK", "LONG", "LONGBLOB",
+    "LONGTEXT", "LOOP", "LOW_PRIORITY",
+    "MASTER_BIND", "MASTER_SSL_VERIFY_SERVER_CERT", "MATCH", "MAXVALUE", "MEDIUMBLOB",
+    "MEDIUMINT", "MEDIUMTEXT", "MIDDLEINT", "MINUTE_MICROSECOND", "MINUTE_SECOND", "MOD", "MODIFIES",
+    "NATURAL", "NOT", "NO_WRITE_TO_BINLOG", "NTH_VALUE", "NTILE", "NULL", "NUMERIC",
+    "OF", "ON", "OPTIMIZE", "OPTIMIZER_COSTS", "OPTION", "OPTIONALLY", "OR", "ORDER", "OUT",
+    "OUTER", "OUTFILE", "OVER",
+    "PARTITION", "PERCENT_RANK", "PRECISION", "PRIMARY", "PROCEDURE", "PURGE",
+    "RANGE", "RANK", "READ", "READS", "READ_WRITE", "REAL", "RECURSIVE", "REFERENCES", "REGEXP",
+    "RELEASE", "RENAME", "REPEAT", "REPLACE", "REQUIRE", "RESIGNAL", "RESTRICT", "RETURN",
+    "REVOKE", "RIGHT", "RLIKE", "ROW", "ROWS", "ROW_NUMBER",
+    "SCHEMA", "SCHEMAS", "SECOND_MICROSECOND", "SELECT", "SENSITIVE", "SEPARATOR", "SET", "SHOW",
+    "SIGNAL", "SMALLINT", "SPATIAL", "SPECIFIC", "SQL", "SQLEXCEPTION", "SQLSTATE", "SQLWARNING",
+    "SQL_BIG_RESULT", "SQL_CALC_FOUND_ROWS", "SQL_SMALL_RESULT", "SSL", "STARTING", "STORED",
+    "STRAIGHT_JOIN", "SYSTEM",
+    "TABLE", "TERMINATED", "THEN", "TINYBLOB", "TINYINT", "TINYTEXT", "TO", "TRAILING",
+    "TRIGGER", "TRUE",
+    "UNDO", "UNION", "UNIQUE", "UNLOCK", "UNSIGNED", "UPDATE", "USAGE", "USE", "USING",
+    "UTC_DATE", "UTC_TIME", "UTC_TIMESTAMP",
+    "VALUES", "VARBINARY", "VARCHAR", "VARCHARACTER", "VARYING", "VIRTUAL",
+    "WHEN", "WHERE", "WHILE", "WINDOW", "WITH", "WRITE", "XOR", "YEAR_MONTH", "ZEROFILL"
+]
+
+# PostgreSQL (the key words marked "reserved" in its documentation)
+
+reserved_words_postgresql = [
+    "ALL", "ANALYSE", "ANALYZE", "AND", "ANY", "ARRAY", "AS", "ASC", "ASYMMETRIC",
+    "AUTHORIZATION", "BINARY", "BOTH", "CASE", "CAST", "CHECK", "COLLATE", "COLLATION",
+    "COLUMN", "CONCURRENTLY", "CONSTRAINT", "CREATE", "CROSS", "CURRENT_CATALOG",
+    "CURRENT_DATE", "CURRENT_ROLE", "CURRENT_SCHEMA", "CURRENT_TIME", "CURRENT_TIMESTAMP",
+    "CURRENT_USER", "DEFAULT", "DEFERRABLE", "DESC", "DISTINCT", "DO", "ELSE", "END",
+    "EXCEPT", "FALSE", "FETCH", "FOR", "FOREIGN", "FREEZE", "FROM", "FULL", "GRANT",
+    "GROUP", "HAVING", "ILIKE", "IN", "INITIALLY", "INNER", "INTERSECT", "INTO", "IS",
+    "ISNULL", "JOIN", "LATERAL", "LEADING", "LEFT", "LIKE", "LIMIT", "LOCALTIME",
+    "LOCALTIMESTAMP", "NATURAL", "NOT", "NOTNULL", "NULL", "OFFSET", "ON", "ONLY", "OR",
+    "ORDER", "OUTER", "OVERLAPS", "PLACING", "PRIMARY", "REFERENCES", "RETURNING", "RIGHT",
+    "SELECT", "SESSION_USER", "SIMILAR", "SOME", "SYMMETRIC", "SYSTEM_USER", "TABLE",
+    "TABLESAMPLE", "THEN", "TO", "TRAILING", "TRUE", "UNION", "UNIQUE", "USER", "USING",
+    "VARIADIC", "VERBOSE", "WHEN", "WHERE", "WINDOW", "WITH"
+]
+
+# reserved words and identifier quote of each SQLQueryBuilder db_type, as sets for O(1) lookups
+RESERVED_WORDS = {
+    "sqlite": frozenset(reserved_words_sqlite),
+    "mysql": frozenset(reserved_words_mysql),
+    "postgresql": frozenset(reserved_words_postgresql),
+}
+IDENTIFIER_QUOTES = {"sqlite": '"', "mysql": "`", "postgresql": '"'}
+
 # data type of sqlite
 def infer_sql_type(value):
     if pd.isnull(value):
@@ -79,62 +173,2834 @@ def infer_sql_type(value):
     return "TEXT"
 
 
+# data type of a whole column, from its pandas dtype. Object columns are checked with vectorized
+# numeric/date parsing over every value (or `sample` random values) instead of a single row.
+def infer_column_type(series: pd.Series, sample=None):
+    values = series.dropna()
+    if sample is not None and len(values) > sample:
+        values = values.sample(n=sample, random_state=0)
+    if values.empty:
+        return "TEXT"
+
+    if pd.api.types.is_bool_dtype(values):
+        return "INTEGER"
+    if pd.api.types.is_integer_dtype(values):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(values):
+        # pandas reads integer columns with gaps as float64
+        return "INTEGER" if (values % 1 == 0).all() else "REAL"
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return "TIMESTAMP"
+    if pd.api.types.is_numeric_dtype(values):
+        return "REAL"
+
+    if values.map(lambda v: isinstance(v, bool)).all():
+        return "INTEGER"
+    numbers = pd.to_numeric(values, errors="coerce")
+    if numbers.notna().all():
+        return infer_column_type(numbers.astype("float64"))
+    dates = pd.to_datetime(values, errors="coerce", format="ISO8601")
+    if dates.notna().all():
+        return "TIMESTAMP"
+    return "TEXT"
+
+
+# schema of a DataFrame, one inferred type per column; `types` overrides the inferred ones
+def infer_schema(df: pd.DataFrame, sample=None, types=None):
+    schema = {col: infer_column_type(df[col], sample) for col in df.columns}
+    for col, typ in (types or {}).items():
+        if col not in schema:
+            raise ValueError(f"Cannot declare a type for unknown column: {col}")
+        schema[col] = typ.upper()
+    return schema
+
+
+# TEXT columns of `schema` worth dictionary-encoding: at most `threshold` distinct values per
+# non-null value, counted over the whole DataFrame at once
+def low_cardinality_columns(df: pd.DataFrame, schema, threshold=0.05):
+    text = [col for col, typ in schema.items() if typ == "TEXT"]
+    if not text:
+        return []
+    counts = df[text].notna().sum()
+    distinct = df[text].nunique(dropna=True)
+    return [col for col in text if counts[col] and distinct[col] <= threshold * counts[col]]
+
+
+# Raised by a chunked import when one chunk cannot be inserted. Every chunk before it has been
+# committed, so the import can be resumed with import_csv(..., resume_from=err.rows_done).
+class ChunkImportError(Exception):
+    def __init__(self, table_name, chunk_index, rows_done, cause):
+        self.table_name = table_name
+        self.chunk_index = chunk_index
+        self.rows_done = rows_done
+        super().__init__(
+            f"Chunk {chunk_index} of '{table_name}' failed after {rows_done} rows were committed: {cause}"
+        )
+
+
+# PRAGMA settings of the named tuning profiles, applied in this order at connect time or with
+# SQLiteDataEngine.apply_profile(). page_size only takes effect on a new database (or after VACUUM,
+# outside WAL mode). Measured effects are in documentation.md (benchmarks/bench_profiles.py).
+TUNING_PROFILES = {
+    # sqlite3 defaults: rollback journal, full sync, ~2 MB page cache, no memory-mapped I/O
+    "default": {
+        "journal_mode": "DELETE", "synchronous": "FULL", "cache_size": -2000,
+        "mmap_size": 0, "temp_store": "DEFAULT",
+    },
+    # imports: journal kept in memory and no fsync, a crash can lose the import in progress
+    "bulk-load": {
+        "page_size": 8192, "journal_mode": "MEMORY", "synchronous": "OFF", "cache_size": -262144,
+        "mmap_size": 0, "temp_store": "MEMORY",
+    },
+    # analytics: WAL for concurrent readers, memory-mapped reads, big page cache, in-memory sorts
+    "read-heavy": {
+        "page_size": 8192, "journal_mode": "WAL", "synchronous": "NORMAL", "cache_size": -131072,
+        "mmap_size": 1 << 30, "temp_store": "MEMORY",
+    },
+    # every commit is synced to disk before it returns
+    "durable": {
+        "journal_mode": "WAL", "synchronous": "FULL", "cache_size": -2000,
+        "mmap_size": 0, "temp_store": "DEFAULT",
+    },
+}
+
+_TEMP_STORE = {0: "DEFAULT", 1: "FILE", 2: "MEMORY"}
+_SYNCHRONOUS = {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"}
+
+
+def _profile_pragmas(profile):
+    if profile is None:
+        return {}
+    if isinstance(profile, dict):
+        return profile
+    if profile not in TUNING_PROFILES:
+        raise ValueError(f"Unknown tuning profile: {profile}. Available profiles are {', '.join(TUNING_PROFILES)}.")
+    return TUNING_PROFILES[profile]
+
+
+# Set PRAGMAs on a connection, returns their previous values
+def _apply_pragmas(conn, pragmas):
+    if pragmas and conn.in_transaction:
+        conn.commit()
+    previous = {}
+    for name, value in pragmas.items():
+        current = conn.execute(f"PRAGMA {name}").fetchone()[0]
+        if name == "temp_store":
+            current = _TEMP_STORE.get(current, current)
+        elif name == "synchronous":
+            current = _SYNCHRONOUS.get(current, current)
+        elif name == "journal_mode":
+            current = current.upper()
+        previous[name] = current
+        conn.execute(f"PRAGMA {name} = {value}")
+    return previous
+
+
+# NumPy dtype a column starts out with, from its declared SQL type (unknown columns start as int64)
+def _column_dtype(sql_type):
+    if sql_type is None:
+        return np.int64
+    sql_type = sql_type.upper()
+    if "INT" in sql_type:
+        return np.int64
+    if any(name in sql_type for name in ("REAL", "FLOA", "DOUB")):
+        return np.float64
+    return object
+
+
+# Pull a cursor's rows with fetchmany into one preallocated NumPy buffer per column, growing the
+# buffers by doubling. An int64 column moves to float64 when it meets NULLs or fractions and any
+# column moves to object when it meets text, so no value is truncated. `positions` picks columns.
+def _fetch_columnar(cursor, dtypes, batch_size=65_536, positions=None):
+    positions = list(range(len(dtypes))) if positions is None else positions
+    capacity = batch_size
+    buffers = [np.empty(capacity, dtype=dtypes[pos]) for pos in positions]
+    n = 0
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        m = len(batch)
+        if n + m > capacity:
+            capacity = max(capacity * 2, n + m)
+            for j, buf in enumerate(buffers):
+                grown = np.empty(capacity, dtype=buf.dtype)
+                grown[:n] = buf[:n]
+                buffers[j] = grown
+        columns = list(zip(*batch))
+        for j, pos in enumerate(positions):
+            buffers[j] = _store_column(buffers[j], n, columns[pos])
+        n += m
+    return [buf if len(buf) == n else buf[:n].copy() for buf in buffers]
+
+
+def _store_column(buf, n, values):
+    end = n + len(values)
+    if buf.dtype != object:
+        arr = np.asarray(values)
+        if arr.dtype.kind == "O" and all(v is None or isinstance(v, (int, float)) for v in values):
+            arr = arr.astype(np.float64)
+        if arr.dtype.kind in "iub":
+            buf[n:end] = arr
+            return buf
+        if arr.dtype.kind == "f":
+            if buf.dtype.kind == "i":
+                buf = buf.astype(np.float64)
+            buf[n:end] = arr
+            return buf
+        buf = buf.astype(object)
+    buf[n:end] = values
+    return buf
+
+
+# import metadata of import_csv(..., incremental=True)
+IMPORTS_TABLE = "_sse_imports"
+# partitioning of the tables split with SQLiteDataEngine.partition_table
+PARTITIONS_TABLE = "_sse_partitions"
+# aggregates registered with SQLiteDataEngine.materialize
+MATERIALIZED_TABLE = "_sse_materialized"
+
+
+# sha256 of the first `prefix` bytes and of the whole file, plus the number of bytes after the prefix;
+# the file is read in blocks, never whole
+def _hash_file(path, prefix, block=1 << 20):
+    digest = hashlib.sha256()
+    tail = 0
+    with open(path, "rb") as f:
+        remaining = prefix
+        while remaining:
+            data = f.read(min(block, remaining))
+            if not data:
+                break
+            digest.update(data)
+            remaining -= len(data)
+        prefix_hash = digest.hexdigest()
+        for data in iter(lambda: f.read(block), b""):
+            digest.update(data)
+            tail += len(data)
+    return prefix_hash, digest.hexdigest(), tail
+
+
+# whether the first `size` bytes end on a line break, so new rows start on a fresh line
+def _ends_with_newline(path, size):
+    if size == 0:
+        return False
+    with open(path, "rb") as f:
+        f.seek(size - 1)
+        return f.read(1) == b"\n"
+
+
+# FTS5 tables created by SQLiteDataEngine.create_text_index, one per indexed table
+TEXT_INDEX_SUFFIX = "_fts"
+_FTS_SHADOW_SUFFIXES = ("_data", "_idx", "_content", "_docsize", "_config")
+
+
+# FTS5 virtual tables of a database, and the shadow tables SQLite keeps their index in
+def _text_index_tables(conn):
+    virtual = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%'")}
+    return virtual, {name + suffix for name in virtual for suffix in _FTS_SHADOW_SUFFIXES}
+
+
+# triggers that mirror every insert, update and delete of `table_name` into its FTS5 index
+def _text_index_triggers(table_name, columns):
+    fts = table_name + TEXT_INDEX_SUFFIX
+    cols = ", ".join(f'"{col}"' for col in columns)
+    new = ", ".join(f'new."{col}"' for col in columns)
+    old = ", ".join(f'old."{col}"' for col in columns)
+    delete = f"INSERT INTO \"{fts}\"(\"{fts}\", rowid, {cols}) VALUES ('delete', old.rowid, {old});"
+    insert = f'INSERT INTO "{fts}"(rowid, {cols}) VALUES (new.rowid, {new});'
+    return [
+        f'CREATE TRIGGER "{fts}_ai" AFTER INSERT ON "{table_name}" BEGIN {insert} END',
+        f'CREATE TRIGGER "{fts}_ad" AFTER DELETE ON "{table_name}" BEGIN {delete} END',
+        f'CREATE TRIGGER "{fts}_au" AFTER UPDATE OF {cols} ON "{table_name}" BEGIN {delete} {insert} END',
+    ]
+
+
+# A dictionary-encoded table "<table>" is a view over "<table>__data", which stores an INTEGER code
+# per encoded column, joined with one "<table>__<column>" lookup table (code, value) per encoded column
+ENCODED_SEPARATOR = "__"
+
+
+# storage tables of a dictionary-encoded table, or None when `table_name` is not one
+def _encoded_tables(conn, table_name):
+    trigger = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ? AND tbl_name = ?",
+                           (f"{table_name}{ENCODED_SEPARATOR}insert", table_name)).fetchone()
+    if trigger is None:
+        return None
+    names = {f"{table_name}{ENCODED_SEPARATOR}data"} | {
+        f"{table_name}{ENCODED_SEPARATOR}{row[1]}" for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return sorted(names & existing)
+
+
+# The rows of a dictionary-encoded table with the encoded columns decoded by a join with their
+# lookup tables. Only the encoded columns in `used` are selectable, the default is all of them.
+# Columns in `grouped` are decoded by a scalar subquery instead, which a query grouping on their
+# "<column>__code" evaluates once per group rather than once per row. With rowid=True the rowid
+# of the data table comes first, as "__rowid".
+def _encoded_select(table_name, columns, encoded, used=None, grouped=(), rowid=False):
+    select, joins = ([f'd.rowid AS "{ENCODED_SEPARATOR}rowid"'] if rowid else []), []
+    for i, col in enumerate(columns):
+        lookup = f"{table_name}{ENCODED_SEPARATOR}{col}"
+        if col not in encoded:
+            select.append(f'd."{col}"')
+        elif col in grouped:
+            select.append(f'(SELECT "value" FROM "{lookup}" WHERE "code" = d."{col}") AS "{col}"')
+            select.append(f'd."{col}" AS "{col}{ENCODED_SEPARATOR}code"')
+        elif used is None or col in used:
+            select.append(f'k{i}."value" AS "{col}"')
+            joins.append(f'LEFT JOIN "{lookup}" AS k{i} ON k{i}."code" = d."{col}"')
+    return f'SELECT {", ".join(select)} FROM "{table_name}{ENCODED_SEPARATOR}data" AS d {" ".join(joins)}'.strip()
+
+
+# Condition picking one row of `table_name` whose columns hold `values` (SQL expressions, NULL
+# matching NULL). Views have no rowid, so the INSTEAD OF UPDATE/DELETE triggers of a view find the
+# stored row of OLD this way; a view row that is there twice is updated or deleted once per trigger.
+def _same_row(table_name, columns, values):
+    match = " AND ".join(f'"{col}" IS {value}' for col, value in zip(columns, values))
+    return f'rowid = (SELECT rowid FROM "{table_name}" WHERE {match} LIMIT 1)'
+
+
+# view of a dictionary-encoded table, and the INSTEAD OF triggers that encode inserted and updated
+# rows and apply updates and deletes to its data table
+def _encoded_view(table_name, columns, encoded):
+    data = f"{table_name}{ENCODED_SEPARATOR}data"
+
+    def codes(ref):
+        return [f'(SELECT "code" FROM "{table_name}{ENCODED_SEPARATOR}{col}" WHERE "value" = {ref}."{col}")'
+                if col in encoded else f'{ref}."{col}"' for col in columns]
+
+    lookups = " ".join(
+        f'INSERT OR IGNORE INTO "{table_name}{ENCODED_SEPARATOR}{col}" ("value") '
+        f'SELECT new."{col}" WHERE new."{col}" IS NOT NULL;' for col in columns if col in encoded)
+    cols = ", ".join(f'"{col}"' for col in columns)
+    old_row = _same_row(data, columns, codes("old"))
+    sets = ", ".join(f'"{col}" = {code}' for col, code in zip(columns, codes("new")))
+    trigger = f'CREATE TRIGGER "{table_name}{ENCODED_SEPARATOR}'
+    return [
+        f'CREATE VIEW "{table_name}" AS {_encoded_select(table_name, columns, encoded)}',
+        f'{trigger}insert" INSTEAD OF INSERT ON "{table_name}" '
+        f'BEGIN {lookups} INSERT INTO "{data}" ({cols}) VALUES ({", ".join(codes("new"))}); END',
+        f'{trigger}update" INSTEAD OF UPDATE ON "{table_name}" '
+        f'BEGIN {lookups} UPDATE "{data}" SET {sets} WHERE {old_row}; END',
+        f'{trigger}delete" INSTEAD OF DELETE ON "{table_name}" BEGIN DELETE FROM "{data}" WHERE {old_row}; END',
+    ]
+
+
+# a value written into SQL text: numbers as they are, strings single-quoted
+def _value_literal(value):
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return repr(value)
+
+
+# How a partitioned table splits its rows on `column` into child tables "<table>__p0", "<table>__p1"...
+# kind="range": sorted `bounds` b0 < b1 < ... give the children v < b0 (and NULL), b0 <= v < b1, ...,
+# v >= b[-1]. kind="list": one child per value in `bounds`, then one for every other value and NULL.
+class Partitioning:
+    def __init__(self, table_name, column, kind, bounds):
+        if kind not in ("range", "list"):
+            raise ValueError(f"Unsupported partitioning: {kind}, supported kinds are 'range', 'list'.")
+        if not bounds:
+            raise ValueError("At least one partition bound or value must be specified.")
+        if kind == "range" and list(bounds) != sorted(set(bounds)):
+            raise ValueError("Range bounds must be strictly increasing.")
+        if kind == "list" and len(set(bounds)) != len(bounds):
+            raise ValueError("List partition values must be unique.")
+        self.table_name = table_name
+        self.column = column
+        self.kind = kind
+        self.bounds = list(bounds)
+
+    @property
+    def children(self):
+        return [f"{self.table_name}{ENCODED_SEPARATOR}p{i}" for i in range(len(self.bounds) + 1)]
+
+    # SQL condition on `ref` (a column reference, e.g. new."year") that holds for the rows of each child
+    def conditions(self, ref=None):
+        ref = ref or f'"{self.column}"'
+        values = [_value_literal(bound) for bound in self.bounds]
+        if self.kind == "list":
+            return [f"{ref} = {value}" for value in values] + [f"({ref} IS NULL OR {ref} NOT IN ({', '.join(values)}))"]
+        conditions = [f"({ref} < {values[0]} OR {ref} IS NULL)"]
+        conditions += [f"{ref} >= {lo} AND {ref} < {hi}" for lo, hi in zip(values, values[1:])]
+        return conditions + [f"{ref} >= {values[-1]}"]
+
+    # child index of every value of a Series, computed for the whole Series at once
+    def assign(self, values: pd.Series):
+        missing = values.isna().to_numpy()
+        if self.kind == "list":
+            index = pd.Index(self.bounds).get_indexer(values)
+            return np.where((index < 0) | missing, len(self.bounds), index)
+        index = np.zeros(len(values), dtype=np.int64)
+        index[~missing] = np.searchsorted(np.asarray(self.bounds), values[~missing].to_numpy(), side="right")
+        return index
+
+    # Children that can hold rows matching the AND-ed `predicates` of a builder (see
+    # SQLQueryBuilder.columns_used), all of them when the predicates cannot rule any out
+    def prune(self, predicates):
+        matching = set(range(len(self.bounds) + 1))
+        if any(connector not in ("", "AND") for connector, *_ in predicates):
+            return matching
+        for _, col, op, value in predicates:
+            if col.strip('"') != self.column:
+                continue
+            try:
+                matching &= self._matching(op, value)
+            except TypeError:
+                # values SQLite would compare after type affinity, Python cannot
+                continue
+        return matching
+
+    def _matching(self, op, value):
+        everything = set(range(len(self.bounds) + 1))
+        if op == "IS":
+            # IS NULL lives in the first range child or the last list child, IS NOT NULL anywhere
+            if value is None or (isinstance(value, tuple) and value[0].strip() == "="):
+                return {0} if self.kind == "range" else {len(self.bounds)}
+            return everything
+        if isinstance(value, tuple) and op != "BETWEEN":
+            value = value[1]
+        if op == "==":
+            op = "="
+        if self.kind == "list":
+            # a listed child holds one value; values outside the list are all in the last child
+            tests = {
+                "=": lambda b, v: b == v, "<": lambda b, v: b < v, "<=": lambda b, v: b <= v,
+                ">": lambda b, v: b > v, ">=": lambda b, v: b >= v, "BETWEEN": lambda b, v: v[0] <= b <= v[1],
+            }
+            if op not in tests:
+                return everything
+            if op == "=" and value in self.bounds:
+                return {self.bounds.index(value)}
+            return {i for i, bound in enumerate(self.bounds) if tests[op](bound, value)} | {len(self.bounds)}
+        # a range child holds lo <= v < hi, open-ended at both ends
+        tests = {
+            "=": lambda lo, hi, v: (lo is None or lo <= v) and (hi is None or v < hi),
+            "<": lambda lo, hi, v: lo is None or lo < v,
+            "<=": lambda lo, hi, v: lo is None or lo <= v,
+            ">": lambda lo, hi, v: hi is None or hi > v,
+            ">=": lambda lo, hi, v: hi is None or hi > v,
+            "BETWEEN": lambda lo, hi, v: (lo is None or lo <= v[1]) and (hi is None or hi > v[0]),
+        }
+        if op not in tests:
+            return everything
+        edges = [None] + self.bounds + [None]
+        return {i for i in everything if tests[op](edges[i], edges[i + 1], value)}
+
+
+# table name import_csv uses for a file: the file name without extension, spaces as underscores
+def _table_name_for(file_path):
+    return os.path.splitext(os.path.basename(file_path))[0].replace(" ", "_")
+
+
+# Parse one CSV file in a worker process of import_many. Its columns, inferred schema and the columns
+# to dictionary-encode (from the table's recorded `encoding`, see create_table_from_df), then its
+# insert-ready row tuples in lists of at most `batch_rows`, are put on the bounded `batches` queue
+# for the writer, followed by None. Returns the parse time.
+def _parse_csv_file(file_path, batches, batch_rows, sample=None, types=None, encoding=None):
+    started = time.perf_counter()
+    try:
+        df = pd.read_csv(file_path)
+        schema = infer_schema(df, sample, types)
+        encode, encode_threshold = encoding or (None, None)
+        if encode is True:
+            encode = low_cardinality_columns(df, schema, encode_threshold)
+        elif isinstance(encode, str):
+            encode = [encode]
+        parse_seconds = time.perf_counter() - started
+        batches.put((list(df.columns), schema, encode))
+        for start in range(0, len(df), batch_rows):
+            batches.put(list(_rows_from_df(df.iloc[start:start + batch_rows])))
+    finally:
+        batches.put(None)
+    return parse_seconds
+
+
+# Partial aggregate of one rowid range, run in a worker process of fetch_parallel on its own
+# read-only connection
+def _partial_aggregate(db_file, sql, params):
+    conn = sqlite3.connect(f"{pathlib.Path(db_file).as_uri()}?mode=ro", uri=True)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+_AGGREGATE_CALL = re.compile(r"^(COUNT|SUM|MIN|MAX|AVG)\(\s*(.+?)\s*\)$", re.IGNORECASE)
+# how the partial results of each aggregate combine
+_MERGE_FUNCTIONS = {"COUNT": "SUM", "SUM": "SUM", "MIN": "MIN", "MAX": "MAX"}
+
+
+# top-level comma separated items of a SELECT list
+def _select_items(select):
+    items, depth, start = [], 0, 0
+    for i, char in enumerate(select):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            items.append(select[start:i].strip())
+            start = i + 1
+    items.append(select[start:].strip())
+    return items
+
+
+# Split a builder's grouped COUNT/SUM/MIN/MAX/AVG query into the partial query each rowid range
+# runs, "... WHERE rowid BETWEEN ? AND ? AND (filters) GROUP BY ..." with the group columns as g<i>
+# and the partial aggregates as p<i>, and the query that merges the partials from a "partials" table:
+# COUNT and SUM partials add up, MIN and MAX take the extreme, AVG is carried as a SUM and a COUNT.
+# Returns (partial_sql, filter_params, columns, merge_sql), or None and the reason it does not split.
+def _decompose_aggregate(query):
+    if query._having_params or query._exists:
+        return None, "HAVING and EXISTS are not merged"
+    if not query._query_params[0].startswith("SELECT "):
+        return None, "not a SELECT"
+    groups = [col.strip('"') for col in query._group_columns]
+    columns = [f"g{i}" for i in range(len(groups))]
+    partial = [f"{col} AS g{i}" for i, col in enumerate(query._group_columns)]
+    merged, names, aggregates = [], [], 0
+    for item in _select_items(query._select):
+        expr, alias = item.rsplit(" AS ", 1) if " AS " in item else (item, None)
+        name = (alias or expr).strip('"')
+        names.append(name)
+        call = _AGGREGATE_CALL.match(expr)
+        if call is None:
+            column = expr.strip('"')
+            if column not in groups:
+                return None, f"'{expr}' is neither grouped nor an aggregate"
+            merged.append(f'g{groups.index(column)} AS "{name}"')
+            continue
+        func, arg = call.group(1).upper(), call.group(2)
+        if arg.upper().startswith("DISTINCT "):
+            return None, "DISTINCT aggregates do not merge"
+        aggregates += 1
+        k = len(columns) - len(groups)
+        if func == "AVG":
+            partial += [f"SUM({arg}) AS p{k}", f"COUNT({arg}) AS p{k + 1}"]
+            columns += [f"p{k}", f"p{k + 1}"]
+            merged.append(f'SUM(p{k}) * 1.0 / SUM(p{k + 1}) AS "{name}"')
+        else:
+            partial.append(f"{func}({arg}) AS p{k}")
+            columns.append(f"p{k}")
+            merged.append(f'{_MERGE_FUNCTIONS[func]}(p{k}) AS "{name}"')
+    if not aggregates:
+        return None, "no aggregate to split"
+
+    order_by = ""
+    if query._order_by:
+        fields = [field.strip('"') for field in query._order_columns]
+        if any(field not in names for field in fields):
+            return None, "ORDER BY a column that is not selected"
+        quoted = ", ".join(f'"{field}"' for field in fields)
+        order_by = f" ORDER BY {quoted} {query._order_by.rsplit(' ', 1)[1]}"
+    filters = " ".join(sql for sql, _ in query._where_params)
+    params = [value for _, values in query._where_params for value in values]
+    where = f" AND ({filters})" if filters else ""
+    group_by = f" GROUP BY {', '.join(query._group_columns)}" if groups else ""
+    limit = f" {query._limit}" if query._limit else ""
+    partial_sql = f"SELECT {', '.join(partial)} FROM {query.table} WHERE rowid BETWEEN ? AND ?{where}{group_by}"
+    merge_group = f" GROUP BY {', '.join(columns[:len(groups)])}" if groups else ""
+    merge_sql = f"SELECT {', '.join(merged)} FROM partials{merge_group}{order_by}{limit}"
+    return (partial_sql, params, columns, merge_sql), None
+
+
+# parameterized SQL with its "?" placeholders replaced by the values written as literals
+def _inline_params(sql, params):
+    values = iter(params)
+    return re.sub(r"\?", lambda _: _value_literal(int(v) if isinstance(v := next(values), bool) else v), sql)
+
+
+# Groups, filters (values written in) and [(function, column)] aggregates of a builder that
+# SQLiteDataEngine.materialize can register: a SELECT of group columns and COUNT/SUM/MIN/MAX/AVG
+# calls on "*" or plain columns, with where/and_/or_ filters and nothing after GROUP BY
+def _materialized_shape(query):
+    if not query._query_params[0].startswith("SELECT ") or query._query_params[1]:
+        raise ValueError("Only builder SELECTs can be materialized.")
+    if query._having_params or query._order_by or query._limit or query._exists:
+        raise ValueError("Materialized aggregates cannot have HAVING, ORDER BY, LIMIT or EXISTS; "
+                         "apply them when querying.")
+    filters = " ".join(sql for sql, _ in query._where_params)
+    if "MATCH ?" in filters or "EXISTS (" in filters:
+        raise ValueError("Materialized aggregates cannot filter with match_ or EXISTS.")
+    groups = [col.strip('"') for col in query._group_columns]
+    aggregates = []
+    for item in _select_items(query._select):
+        expr = item.rsplit(" AS ", 1)[0]
+        call = _AGGREGATE_CALL.match(expr)
+        if call is None:
+            if expr.strip('"') not in groups:
+                raise ValueError(f"'{expr}' is neither grouped nor an aggregate.")
+            continue
+        func, arg = call.group(1).upper(), call.group(2).strip('"')
+        if arg == "*" and func != "COUNT" or "(" in arg or arg.upper().startswith("DISTINCT "):
+            raise ValueError(f"Cannot materialize '{expr}', aggregates must be over * or a column.")
+        aggregates.append((func, arg))
+    if not aggregates:
+        raise ValueError("A materialized aggregate needs at least one COUNT/SUM/MIN/MAX/AVG.")
+    params = [value for _, values in query._where_params for value in values]
+    return groups, _inline_params(filters, params), aggregates
+
+
+_AGGREGATE_IN_TEXT = re.compile(r"\b(COUNT|SUM|MIN|MAX|AVG)\(\s*([^()]*?)\s*\)", re.IGNORECASE)
+
+
+# A grouped aggregate of `table_name` kept in the real table `name`: one row per group of the
+# `groups` columns among the rows matching `filters` (SQL with the values written in), holding the
+# row count "_n" and, for each aggregated column c, "_count_c" plus "_sum_c", "_min_c" and "_max_c"
+# as its aggregates need them. AVG is answered from the sum and the count.
+class MaterializedAggregate:
+    def __init__(self, name, table_name, groups, filters, aggregates):
+        self.name = name
+        self.table_name = table_name
+        self.groups = list(groups)
+        self.filters = filters
+        self.aggregates = [tuple(aggregate) for aggregate in aggregates]
+
+    # state columns and the aggregate over the base table that fills each
+    @property
+    def states(self):
+        states = {"_n": "COUNT(*)"}
+        for func, col in self.aggregates:
+            if col == "*":
+                continue
+            states[f"_count_{col}"] = f'COUNT("{col}")'
+            kind = {"SUM": "sum", "AVG": "sum", "MIN": "min", "MAX": "max"}.get(func)
+            if kind:
+                states[f"_{kind}_{col}"] = f'{kind.upper()}("{col}")'
+        return states
+
+    @property
+    def columns(self):
+        return self.groups + list(self.states)
+
+    @property
+    def triggers(self):
+        return [f"{self.name}{ENCODED_SEPARATOR}{suffix}" for suffix in ("ai", "ad", "au")]
+
+    # SELECT of the groups and their states over `source` (a table, or a subquery of a row's values)
+    # for the rows matching the filters and `extra`; no row for groups without matching rows
+    def aggregate_sql(self, source, extra=None):
+        conditions = [f"({condition})" for condition in (self.filters, extra) if condition]
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        groups = ", ".join(f'"{col}"' for col in self.groups)
+        select = [f'"{col}"' for col in self.groups] + [f'{expr} AS "{state}"' for state, expr in self.states.items()]
+        group_by = f" GROUP BY {groups}" if groups else ""
+        return f"SELECT {', '.join(select)} FROM {source}{where}{group_by} HAVING COUNT(*) > 0"
+
+    # the stored group matching the group of `ref` (a table alias, or new/old in a trigger)
+    def _same_group(self, ref):
+        return " AND ".join(f'"{self.name}"."{col}" IS {ref}."{col}"' for col in self.groups) or "1"
+
+    # Statements that add the aggregates of `source` (see aggregate_sql) to the stored groups, or
+    # with remove=True take them away again. MIN and MAX of a group lose their value when the
+    # removed rows held it, then they are recomputed from the group's rows in the base table; groups
+    # left without rows are deleted (`ref` names the group that can empty out).
+    def merge(self, source, remove=False, ref="old"):
+        sets = []
+        for state in self.states:
+            kind, col = (state.split("_", 2) + [None])[1:3]
+            current, delta = f'"{self.name}"."{state}"', f'd."{state}"'
+            if kind in ("n", "count"):
+                sets.append(f'"{state}" = {current} {"-" if remove else "+"} {delta}')
+            elif kind == "sum":
+                sets.append(f'"{state}" = IFNULL({current}, 0) {"-" if remove else "+"} IFNULL({delta}, 0)')
+            elif not remove:
+                sets.append(f'"{state}" = COALESCE({kind.upper()}({current}, {delta}), {current}, {delta})')
+            else:
+                beyond = ">" if kind == "min" else "<"
+                group = " AND ".join([f'"{self.table_name}"."{g}" IS d."{g}"' for g in self.groups]
+                                     + ([f"({self.filters})"] if self.filters else [])) or "1"
+                sets.append(f'"{state}" = CASE WHEN {delta} IS NULL OR {delta} {beyond} {current} THEN {current} '
+                            f'ELSE (SELECT {kind.upper()}("{col}") FROM "{self.table_name}" WHERE {group}) END')
+        statements = [f'UPDATE "{self.name}" SET {", ".join(sets)} FROM ({source}) AS d WHERE {self._same_group("d")}']
+        if remove:
+            statements.append(f'DELETE FROM "{self.name}" WHERE "_n" = 0 AND {self._same_group(ref)}')
+        else:
+            cols = ", ".join(f'"{col}"' for col in self.columns)
+            statements.append(f'INSERT INTO "{self.name}" ({cols}) SELECT {cols} FROM ({source}) AS d '
+                              f'WHERE NOT EXISTS (SELECT 1 FROM "{self.name}" WHERE {self._same_group("d")})')
+        return statements
+
+    # CREATE TRIGGER statements that keep the stored groups current on row-level writes to the base
+    # table with `columns`; updates only fire for the columns the aggregate reads
+    def trigger_sql(self, columns):
+        def row(ref):
+            return "(SELECT " + ", ".join(f'{ref}."{col}" AS "{col}"' for col in columns) + ")"
+
+        add = " ".join(sql + ";" for sql in self.merge(self.aggregate_sql(row("new"))))
+        remove = " ".join(sql + ";" for sql in self.merge(self.aggregate_sql(row("old")), remove=True))
+        read = {col for _, col in self.aggregates} | set(self.groups)
+        watched = ", ".join(f'"{col}"' for col in columns
+                            if col in read or re.search(rf"\b{re.escape(col)}\b", self.filters))
+        table = f'"{self.table_name}"'
+        insert, delete, update = self.triggers
+        return [
+            f'CREATE TRIGGER "{insert}" AFTER INSERT ON {table} BEGIN {add} END',
+            f'CREATE TRIGGER "{delete}" AFTER DELETE ON {table} BEGIN {remove} END',
+            f'CREATE TRIGGER "{update}" AFTER UPDATE OF {watched} ON {table} BEGIN {remove} {add} END',
+        ]
+
+    # the stored expression that answers an aggregate call, or None
+    def _answer(self, func, arg):
+        func, arg = func.upper(), arg.strip('"')
+        states = self.states
+        if arg == "*":
+            return 'IFNULL(SUM("_n"), 0)' if func == "COUNT" else None
+        if f"_count_{arg}" not in states:
+            return None
+        count = f'SUM("_count_{arg}")'
+        answers = {
+            "COUNT": f"IFNULL({count}, 0)",
+            "SUM": f'CASE WHEN {count} > 0 THEN SUM("_sum_{arg}") END',
+            "AVG": f'SUM("_sum_{arg}") * 1.0 / NULLIF({count}, 0)',
+            "MIN": f'MIN("_min_{arg}")',
+            "MAX": f'MAX("_max_{arg}")',
+        }
+        needs = {"SUM": "_sum_", "AVG": "_sum_", "MIN": "_min_", "MAX": "_max_"}
+        if func in needs and f"{needs[func]}{arg}" not in states:
+            return None
+        return answers[func]
+
+    # (sql, params) answering a builder SELECT from the stored groups, or None when it does not
+    # match: same table, its group columns among the stored ones, aggregates the states can answer,
+    # and either the same filters or (with no stored filters) filters on stored group columns only.
+    # HAVING, ORDER BY and LIMIT are applied to the regrouped rows.
+    def answer(self, query):
+        if query.table != self.table_name or query._exists or query._query_params[1]:
+            return None
+        if not query._query_params[0].startswith("SELECT "):
+            return None
+        groups = [col.strip('"') for col in query._group_columns]
+        if any(col not in self.groups for col in groups):
+            return None
+        filters = " ".join(sql for sql, _ in query._where_params)
+        params = [value for _, values in query._where_params for value in values]
+        where = ""
+        if _inline_params(filters, params) != self.filters:
+            # every condition has to be a predicate on a stored group column
+            filtered = [col for _, col, _ in query.columns_used()["filters"]]
+            if self.filters or len(filtered) != len(query._where_params) or not set(filtered) <= set(self.groups) \
+                    or "MATCH ?" in filters:
+                return None
+            where = f"WHERE {filters} "
+        else:
+            params = []
+
+        unanswered = []
+
+        def substitute(match):
+            answer = self._answer(match.group(1), match.group(2))
+            if answer is None:
+                unanswered.append(match.group(0))
+                return match.group(0)
+            return answer
+
+        items = []
+        for item in _select_items(query._select):
+            expr, alias = item.rsplit(" AS ", 1) if " AS " in item else (item, None)
+            call = _AGGREGATE_CALL.match(expr)
+            if call is None:
+                if expr.strip('"') not in groups:
+                    return None
+                items.append(item)
+                continue
+            name = alias or '"' + expr.replace('"', '""') + '"'
+            items.append(f"{_AGGREGATE_IN_TEXT.sub(substitute, expr)} AS {name}")
+        having = " ".join(sql for sql, _ in query._having_params)
+        having = f"HAVING {_AGGREGATE_IN_TEXT.sub(substitute, having)} " if having else ""
+        order_by = f"{_AGGREGATE_IN_TEXT.sub(substitute, query._order_by)} " if query._order_by else ""
+        if unanswered:
+            return None
+        group_by = f"{query._group_by} " if query._group_by else ""
+        params += [value for _, values in query._having_params for value in values]
+        sql = f'SELECT {", ".join(items)} FROM "{self.name}" {where}{group_by}{having}{order_by}{query._limit}'
+        return sql.strip() + ";", tuple(params)
+
+
+# INSERT statement with one placeholder per column
+def _insert_statement(table_name, columns):
+    cols = ", ".join(f'"{col}"' for col in columns)
+    marks = ", ".join("?" for _ in columns)
+    return f'INSERT INTO "{table_name}" ({cols}) VALUES ({marks})'
+
+
+# Row tuples of a DataFrame with NaN/NaT mapped to None and dates as ISO strings, ready for executemany
+def _rows_from_df(df: pd.DataFrame):
+    dates = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])]
+    if dates:
+        df = df.assign(**{col: df[col].map(lambda v: v.isoformat(sep=" "), na_action="ignore") for col in dates})
+    frame = df.astype(object).where(df.notna(), None)
+    return frame.itertuples(index=False, name=None)
+
+
+# What a query hook receives for every query an engine runs. Times are in seconds. `rows` is the
+# number of rows returned, or changed by a write (None when the caller reads the cursor itself);
+# `plan` is the EXPLAIN QUERY PLAN detail joined with "; ", filled in when a hook was added with plan=True.
+class QueryEvent:
+    __slots__ = ("sql", "params", "build_s", "exec_s", "rows", "plan", "cached", "error")
+
+    def __init__(self, sql, params, build_s=0.0):
+        self.sql = sql
+        self.params = params
+        self.build_s = build_s
+        self.exec_s = 0.0
+        self.rows = None
+        self.plan = None
+        self.cached = False
+        self.error = None
+
+    def __repr__(self):
+        return (f"QueryEvent(sql={self.sql!r}, params={self.params!r}, build_s={self.build_s:.6f}, "
+                f"exec_s={self.exec_s:.6f}, rows={self.rows!r}, plan={self.plan!r})")
+
+
+# LRU of the statement shapes (SQL text with "?" placeholders) an engine has run. It is sized like
+# the connection's sqlite3 statement cache, so a hit here means sqlite3 reused the prepared statement.
+class StatementCache:
+    def __init__(self, size=256):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._shapes = OrderedDict()
+        self._lock = threading.Lock()
+
+    # record one execution of `sql`, returns True when the shape was already cached
+    def lookup(self, sql):
+        with self._lock:
+            if sql in self._shapes:
+                self._shapes.move_to_end(sql)
+                self._shapes[sql] += 1
+                self.hits += 1
+                return True
+            self.misses += 1
+            self._shapes[sql] = 1
+            if len(self._shapes) > self.size:
+                self._shapes.popitem(last=False)
+            return False
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._shapes), "max_size": self.size}
+
+
+# tables an SQL statement reads or writes, by the names following FROM/JOIN/UPDATE/INTO
+_TABLE_PATTERN = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+(?:"([^"]+)"|`([^`]+)`|(\w+))', re.IGNORECASE)
+
+
+def _tables_in(sql):
+    return {next(name for name in match if name) for match in _TABLE_PATTERN.findall(sql)}
+
+
+# rough in-memory size of a list of row tuples
+def _rows_size(rows):
+    return sys.getsizeof(rows) + sum(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row) for row in rows)
+
+
+# LRU cache of query results, bounded by entry count and by bytes. Every entry remembers the
+# versions of the tables it read; an entry whose tables changed since is dropped on lookup.
+class ResultCache:
+    def __init__(self, max_entries=128, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # cached rows for `key`, or None when missing or stale
+    def get(self, key, versions):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != versions:
+                self._drop(key)
+                self.invalidations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, versions, rows):
+        size = _rows_size(rows)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (versions, rows, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self.bytes = 0
+
+    def info(self):
+        with self._lock:
+            return {
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "invalidations": self.invalidations, "entries": len(self._entries), "bytes": self.bytes,
+                "max_entries": self.max_entries, "max_bytes": self.max_bytes,
+            }
+
+
+# a plan step that reads the whole table instead of searching an index
+def _is_full_scan(detail):
+    return detail.startswith("SCAN ") and "INDEX" not in detail and detail != "SCAN CONSTANT ROW"
+
+
+# Records the columns SQLQueryBuilder queries filter, group and order on, and recommends the
+# indexes that replace their full table scans. Candidates are checked with EXPLAIN QUERY PLAN:
+# the index is created inside a savepoint, the plan compared and the savepoint rolled back.
+class IndexAdvisor:
+    # filter operators that pin a column to one value, so it can lead a composite index
+    EQUALITY_OPERATORS = ("=", "IS", "IN")
+    RANGE_OPERATORS = ("<", "<=", ">", ">=", "BETWEEN", "LIKE")
+
+    def __init__(self, engine, auto_create=False):
+        self.engine = engine
+        self.auto_create = auto_create
+        self.usage = {}
+
+    # count one execution of a builder; `sql`/`params` are its compiled form
+    def record(self, builder, sql, params):
+        used = builder.columns_used()
+        key = (
+            used["table"],
+            tuple((connector, col, op) for connector, col, op in used["filters"]),
+            tuple(used["group_by"]),
+            tuple(used["order_by"]),
+        )
+        entry = self.usage.setdefault(key, {"count": 0, "used": used})
+        entry["count"] += 1
+        entry["sql"], entry["params"] = sql, params
+        if self.auto_create and entry["count"] == 1:
+            for advice in self._advise(entry):
+                self.engine.create_index(advice["table"], advice["columns"])
+
+    # columns of the index for one query shape: equality filters first, then the group-by or
+    # order-by columns, otherwise the first range-filtered column
+    def candidate_columns(self, used):
+        if any(connector == "OR" for connector, _, _ in used["filters"]):
+            return []
+        table_columns = set(self.engine.get_schema(used["table"]))
+        columns = [col for _, col, op in used["filters"] if op in self.EQUALITY_OPERATORS]
+        trailing = used["group_by"] or used["order_by"]
+        if not trailing:
+            trailing = [col for _, col, op in used["filters"] if op in self.RANGE_OPERATORS][:1]
+        columns += trailing
+        return [col for col in dict.fromkeys(columns) if col in table_columns]
+
+    def plan(self, sql, params=()):
+        with self.engine._writing():
+            rows = self.engine.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        return [row[3] for row in rows]
+
+    # Recommended indexes, most used query shapes first:
+    # [{"table", "columns", "count", "plan", "plan_with_index"}, ...]
+    def recommend(self, min_count=1):
+        advice = []
+        for entry in sorted(self.usage.values(), key=lambda e: -e["count"]):
+            if entry["count"] >= min_count:
+                advice += self._advise(entry)
+        unique = {}
+        for item in advice:
+            unique.setdefault((item["table"], tuple(item["columns"])), item)
+        return list(unique.values())
+
+    def _advise(self, entry):
+        columns = self.candidate_columns(entry["used"])
+        if not columns:
+            return []
+        table = entry["used"]["table"]
+        before = self.plan(entry["sql"], entry["params"])
+        if not any(_is_full_scan(step) or "TEMP B-TREE" in step for step in before):
+            return []
+
+        cols = ", ".join(f'"{col}"' for col in columns)
+        with self.engine._writing():
+            conn = self.engine.conn
+            if conn.in_transaction:
+                conn.commit()
+            conn.execute("SAVEPOINT sse_advisor")
+            try:
+                # on the storage tables of a view-backed table, like create_index
+                for index_name, target in self.engine._index_targets(table, "sse_advisor_candidate"):
+                    conn.execute(f'CREATE INDEX "{index_name}" ON "{target}" ({cols})')
+                after = self.plan(entry["sql"], entry["params"])
+            finally:
+                conn.execute("ROLLBACK TO sse_advisor")
+                conn.execute("RELEASE sse_advisor")
+        if after == before:
+            return []
+        return [{"table": table, "columns": columns, "count": entry["count"], "plan": before, "plan_with_index": after}]
+
+    # create every recommended index, returns their names
+    def apply(self, min_count=1):
+        return [self.engine.create_index(item["table"], item["columns"]) for item in self.recommend(min_count)]
+
+
+# One step of a query plan: EXPLAIN QUERY PLAN's detail text and the steps nested under it
+class PlanNode:
+    __slots__ = ("detail", "children")
+
+    def __init__(self, detail):
+        self.detail = detail
+        self.children = []
+
+    # reads every row of a table (a SCAN that uses no index)
+    @property
+    def full_scan(self):
+        return _is_full_scan(self.detail)
+
+    # sorts, groups or deduplicates rows in a temporary b-tree
+    @property
+    def temp_btree(self):
+        return "TEMP B-TREE" in self.detail
+
+    # the table (or alias) a SCAN/SEARCH step reads, otherwise None
+    @property
+    def table(self):
+        words = self.detail.split()
+        return words[1] if len(words) > 1 and words[0] in ("SCAN", "SEARCH") and words[1] != "CONSTANT" else None
+
+    def __repr__(self):
+        return f"PlanNode({self.detail!r}, children={len(self.children)})"
+
+
+# EXPLAIN QUERY PLAN of a statement as a tree of PlanNodes (`nodes` are the top-level steps),
+# with the full scans and temp b-trees of every level collected
+class QueryPlan:
+    def __init__(self, sql, params, rows):
+        self.sql = sql
+        self.params = params
+        self.nodes = []
+        by_id = {}
+        for node_id, parent, _, detail in rows:
+            node = by_id[node_id] = PlanNode(detail)
+            if parent in by_id:
+                by_id[parent].children.append(node)
+            else:
+                self.nodes.append(node)
+
+    def walk(self, nodes=None):
+        for node in self.nodes if nodes is None else nodes:
+            yield node
+            yield from self.walk(node.children)
+
+    # tables read by a full scan
+    @property
+    def full_scans(self):
+        return [node.table for node in self.walk() if node.full_scan]
+
+    @property
+    def temp_btrees(self):
+        return [node.detail for node in self.walk() if node.temp_btree]
+
+    def __str__(self):
+        def lines(nodes, depth):
+            for node in nodes:
+                yield "  " * depth + node.detail
+                yield from lines(node.children, depth + 1)
+
+        return "\n".join(lines(self.nodes, 0))
+
+
+def explain_query_plan(conn, sql, params=()):
+    return QueryPlan(sql, params, conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall())
+
+
+# Raised by a QueryGuard for a query whose plan or running time is over its budget
+class QueryBudgetExceeded(Exception):
+    def __init__(self, sql, reason):
+        self.sql = sql
+        self.reason = reason
+        super().__init__(f"Query over budget ({reason}): {sql}")
+
+
+# Budgets for the queries an engine runs (see SQLiteDataEngine.enable_query_guard):
+# - max_scan_rows: SELECTs whose plan fully scans a table of more rows are rejected before they run
+# - max_sort_rows: SELECTs that sort or group in a temp b-tree while fully scanning a table of more
+#   rows are rejected too
+# - max_seconds: statements still running after that long are interrupted through SQLite's progress
+#   handler, checked every `check_steps` virtual machine steps
+# Tables are sized by MAX(rowid), which SQLite reads from the end of the table's b-tree. Rejected,
+# interrupted and `slow_seconds` slow queries are logged and kept in `log`, the newest `log_size`
+# of them; with enforce=False queries over budget only go to the log.
+class QueryGuard:
+    def __init__(self, max_seconds=None, max_scan_rows=None, max_sort_rows=None, slow_seconds=None,
+                 enforce=True, log_size=1000, check_steps=10_000):
+        self.max_seconds = max_seconds
+        self.max_scan_rows = max_scan_rows
+        self.max_sort_rows = max_sort_rows
+        self.slow_seconds = slow_seconds
+        self.enforce = enforce
+        self.check_steps = check_steps
+        self.log = deque(maxlen=log_size)
+
+    # rows of a table as far as its largest rowid tells, None for views, subqueries and aliases
+    @staticmethod
+    def _table_rows(conn, table):
+        try:
+            return conn.execute(f'SELECT MAX(rowid) FROM "{table}"').fetchone()[0] or 0
+        except sqlite3.Error:
+            return None
+
+    # why a plan is over budget, or None
+    def _over_budget(self, conn, plan):
+        scanned = {table: self._table_rows(conn, table) for table in set(plan.full_scans) if table}
+        for table, rows in scanned.items():
+            if self.max_scan_rows is not None and rows is not None and rows > self.max_scan_rows:
+                return f"full scan of '{table}' (~{rows} rows, budget {self.max_scan_rows})"
+        if self.max_sort_rows is not None and plan.temp_btrees:
+            for table, rows in scanned.items():
+                if rows is not None and rows > self.max_sort_rows:
+                    return f"temp b-tree over a full scan of '{table}' (~{rows} rows, budget {self.max_sort_rows})"
+        return None
+
+    def _record(self, conn, sql, params, seconds, reason, plan=None):
+        if plan is None:
+            try:
+                plan = explain_query_plan(conn, sql, params)
+            except sqlite3.Error:
+                pass
+        self.log.append({"sql": sql, "params": params, "seconds": seconds, "reason": reason,
+                         "plan": str(plan) if plan is not None else None, "at": time.time()})
+        logger.warning("Query %s after %.3fs: %s %r", reason, seconds, sql, params)
+
+    # Run the block that executes `sql` on `conn` under the budgets
+    @contextmanager
+    def watch(self, conn, sql, params=()):
+        is_select = sql.lstrip().upper().startswith(("SELECT", "WITH"))
+        if is_select and (self.max_scan_rows is not None or self.max_sort_rows is not None):
+            plan = explain_query_plan(conn, sql, params)
+            reason = self._over_budget(conn, plan)
+            if reason is not None:
+                self._record(conn, sql, params, 0.0, ("rejected, " if self.enforce else "over budget, ") + reason, plan)
+                if self.enforce:
+                    raise QueryBudgetExceeded(sql, reason)
+        started = time.perf_counter()
+        deadline = None
+        if self.max_seconds is not None and self.enforce:
+            deadline = started + self.max_seconds
+            conn.set_progress_handler(lambda: time.perf_counter() > deadline, self.check_steps)
+        try:
+            yield
+        except sqlite3.OperationalError as e:
+            elapsed = time.perf_counter() - started
+            if deadline is None or elapsed <= self.max_seconds or "interrupted" not in str(e):
+                raise
+            reason = f"ran over {self.max_seconds}s"
+            self._record(conn, sql, params, elapsed, "interrupted, " + reason)
+            raise QueryBudgetExceeded(sql, reason) from e
+        finally:
+            if deadline is not None:
+                conn.set_progress_handler(None, 0)
+        elapsed = time.perf_counter() - started
+        if self.max_seconds is not None and elapsed > self.max_seconds:
+            self._record(conn, sql, params, elapsed, f"ran over {self.max_seconds}s")
+        elif self.slow_seconds is not None and elapsed >= self.slow_seconds:
+            self._record(conn, sql, params, elapsed, f"slower than {self.slow_seconds}s")
+
+
+# What execute() returns for a builder write it ran as several statements (see
+# SQLiteDataEngine._storage_writes), in place of the cursor: the rows they changed in `rowcount`
+class _SplitWrite:
+    description = None
+    lastrowid = None
+
+    def __init__(self, rowcount):
+        self.rowcount = rowcount
+
+
 class SQLiteDataEngine:
 
     # create a local db file and connect to it
-    def __init__(self, db_path="my_database.db"):
+    # `profile` is a TUNING_PROFILES name (or a dict of PRAGMAs) applied when connecting
+    def __init__(self, db_path="my_database.db", statement_cache_size=256, profile=None):
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path)
-        self.cursor = self.conn.cursor()
+        self.profile = profile
         self.schemas = {}
-        print(f"Connected to SQLite DB at: {db_path}")
-
-    # Create a table from a DataFrame by inferring the schema
-    def create_table_from_df(self, table_name, df: pd.DataFrame):
-        # Infer types from first non-null row
-        sample_row = df.dropna().iloc[0] if not df.dropna().empty else df.iloc[0]
-        schema = {
-            col: infer_sql_type(sample_row[col])
-            for col in df.columns
-        }
-        self.create_table(table_name, schema)
+        self.declared_types = {}
+        self.encodings = {}
+        self.statements = StatementCache(statement_cache_size)
+        self.result_cache = None
+        self.table_versions = {}
+        self.advisor = None
+        self.guard = None
+        self.query_hooks = []
+        self.conn = self._connect(statement_cache_size)
+        self.cursor = self.conn.cursor()
+        self._seen_changes = (None, None)
+        self.encoded = self._encoded_layouts()
+        self.partitions = self._load_partitions()
+        self.materialized = self._load_materialized()
+        logger.debug("Connected to SQLite DB at: %s", db_path)
 
-    # Import a CSV file into a table, creating the table if it doesn't exist
-    def import_csv(self, file_path, table_name=None):
-        df = pd.read_csv(file_path)
+    def _connect(self, statement_cache_size):
+        conn = sqlite3.connect(self.db_path, cached_statements=statement_cache_size)
+        _apply_pragmas(conn, _profile_pragmas(self.profile))
+        return conn
+
+    # Switch the connection to a tuning profile (name or dict of PRAGMAs), returns the previous settings
+    def apply_profile(self, profile):
+        with self._writing():
+            return _apply_pragmas(self.conn, _profile_pragmas(profile))
+
+    # Run a block under a tuning profile and restore the previous settings afterwards:
+    #   with engine.tuned("bulk-load"): engine.import_csv(...)
+    @contextmanager
+    def tuned(self, profile):
+        with self._writing():
+            previous = self.apply_profile(profile)
+            try:
+                yield self
+            finally:
+                _apply_pragmas(self.conn, previous)
+
+    # Guards everything that uses the write connection. A plain engine is single-threaded,
+    # PooledSQLiteDataEngine serializes its writers here.
+    def _writing(self):
+        return nullcontext()
+
+    # Connection to read from, for callers that want their own cursor (DataOutput uses it)
+    @contextmanager
+    def reader(self, timeout=None):
+        with self._writing():
+            yield self.conn
+
+    # Declare column types for a table ahead of import, e.g. declare_types("shows", {"imdb_score": "REAL"}).
+    # Declared types win over the inferred ones, so hot filter columns get INTEGER/REAL affinity.
+    def declare_types(self, table_name, types: dict):
+        self.declared_types.setdefault(table_name, {}).update(
+            {col: typ.upper() for col, typ in types.items()}
+        )
+
+    # Create a table from a DataFrame by inferring the schema over whole columns (or `sample` rows each)
+    # encode=True dictionary-encodes the TEXT columns with at most `encode_threshold` distinct values
+    # per value (see low_cardinality_columns), encode=[columns] the given ones (see create_encoded_table).
+    # Without `encode` the setting import_csv recorded for the table applies.
+    def create_table_from_df(self, table_name, df: pd.DataFrame, commit=True, sample=None, encode=None,
+                             encode_threshold=0.05):
+        schema = infer_schema(df, sample, self.declared_types.get(table_name))
+        if encode is None:
+            encode, encode_threshold = self.encodings.get(table_name, (None, encode_threshold))
+        if encode is True:
+            encode = low_cardinality_columns(df, schema, encode_threshold)
+        elif isinstance(encode, str):
+            encode = [encode]
+        if table_name in self.partitions:
+            self._create_partitioned_table(table_name, schema, commit=commit)
+        elif encode:
+            self.create_encoded_table(table_name, schema, encode, commit=commit)
+        else:
+            self.create_table(table_name, schema, commit=commit)
+
+    # Import a CSV file into a table, creating the table if it doesn't exist.
+    # With chunksize set the file is streamed chunk by chunk (see import_csv_chunked)
+    # The table is recreated with the inferred (and declared) schema and the rows are appended into it.
+    # `profile` (e.g. "bulk-load") is applied for the duration of the import only.
+    # With incremental=True unchanged files are skipped and appended files only ingest their new rows.
+    # text_index=[columns] gives the table an FTS5 index on those columns (see create_text_index).
+    # encode=True (or a list of columns) stores low-cardinality TEXT columns as integer codes behind
+    # a view, for this and later imports of the table (see create_table_from_df).
+    def import_csv(self, file_path, table_name=None, chunksize=None, progress=None, resume_from=0,
+                   types=None, sample=None, profile=None, incremental=False, text_index=None,
+                   encode=None, encode_threshold=0.05):
         if table_name is None:
-            table_name = os.path.splitext(os.path.basename(file_path))[0].replace(" ", "_")
+            table_name = _table_name_for(file_path)
+        if encode is not None:
+            self.encodings[table_name] = (encode, encode_threshold)
+        if text_index is not None:
+            self.import_csv(file_path, table_name, chunksize, progress, resume_from, types, sample, profile,
+                            incremental)
+            info = self.text_index_info(table_name)
+            columns = [text_index] if isinstance(text_index, str) else list(text_index)
+            if info is None or info["columns"] != columns:
+                self.create_text_index(table_name, columns)
+            return table_name
+        if types:
+            self.declare_types(table_name, types)
+        if profile is not None:
+            with self.tuned(profile):
+                return self.import_csv(file_path, table_name, chunksize, progress, resume_from, types, sample,
+                                       incremental=incremental)
+        if incremental:
+            return self._import_incremental(file_path, table_name, chunksize, progress, sample)
+
+        if chunksize is not None:
+            return self.import_csv_chunked(file_path, table_name, chunksize, progress, resume_from, sample)
+
+        df = pd.read_csv(file_path)
+
+        with self._writing():
+            if self.conn.in_transaction:
+                self.conn.commit()
+            try:
+                self._drop_table(table_name)
+                self.create_table_from_df(table_name, df, commit=False, sample=sample)
+                self._insert_df(table_name, df)
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+            finally:
+                self._table_changed(table_name)
+        logger.info("Imported %d rows into '%s'", len(df), table_name)
+        return table_name
+
+    # Import metadata of a file, as recorded by import_csv(..., incremental=True), or None
+    def import_metadata(self, file_path):
+        with self._writing():
+            self._ensure_import_table()
+            row = self.conn.execute(
+                f"SELECT * FROM {IMPORTS_TABLE} WHERE file_path = ?", (os.path.abspath(file_path),)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("file_path", "table_name", "size", "mtime", "content_hash", "bytes_ingested", "rows_ingested",
+                "columns")
+        meta = dict(zip(keys, row))
+        meta["columns"] = json.loads(meta["columns"])
+        return meta
+
+    def _ensure_import_table(self):
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {IMPORTS_TABLE} (file_path TEXT PRIMARY KEY, table_name TEXT, "
+            "size INTEGER, mtime REAL, content_hash TEXT, bytes_ingested INTEGER, rows_ingested INTEGER, "
+            "columns TEXT)"
+        )
+
+    def _record_import(self, path, table_name, stat, content_hash, rows, columns):
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO {IMPORTS_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, table_name, stat.st_size, stat.st_mtime, content_hash, stat.st_size, rows, json.dumps(columns)),
+        )
+        self.conn.commit()
 
-        if table_name not in self.schemas:
-            self.create_table_from_df(table_name, df)
+    # Compare a file with its import metadata: skip it when size and mtime are unchanged, ingest
+    # only the new tail when the already ingested bytes still hash the same (append-only export),
+    # otherwise reload the whole table.
+    def _import_incremental(self, file_path, table_name, chunksize=None, progress=None, sample=None):
+        path = os.path.abspath(file_path)
+        with self._writing():
+            self._ensure_import_table()
+            meta = self.import_metadata(path)
+            stat = os.stat(path)
+            table_exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (table_name,)
+            ).fetchone() is not None
+            usable = meta is not None and meta["table_name"] == table_name and table_exists
 
-        df.to_sql(table_name, self.conn, if_exists="replace", index=False)
-        print(f"Imported {len(df)} rows into '{table_name}'")
+            if usable and stat.st_size == meta["size"] and stat.st_mtime == meta["mtime"]:
+                logger.info("'%s' is unchanged, skipped import into '%s'", file_path, table_name)
+                return table_name
+
+            if usable and stat.st_size >= meta["bytes_ingested"]:
+                prefix_hash, content_hash, tail = _hash_file(path, meta["bytes_ingested"])
+                if prefix_hash == meta["content_hash"] and _ends_with_newline(path, meta["bytes_ingested"]):
+                    rows = meta["rows_ingested"]
+                    if tail:
+                        # the new rows are read in chunks of `chunksize` rows, all appended in one transaction
+                        started = time.perf_counter()
+                        with open(path, "rb") as f:
+                            f.seek(meta["bytes_ingested"])
+                            chunks = pd.read_csv(f, header=None, names=meta["columns"], chunksize=chunksize)
+                            try:
+                                for chunk in [chunks] if chunksize is None else chunks:
+                                    self._insert_df(table_name, chunk)
+                                    rows += len(chunk)
+                                    if progress is not None:
+                                        elapsed = time.perf_counter() - started
+                                        progress(rows, (rows - meta["rows_ingested"]) / elapsed if elapsed > 0 else 0.0)
+                            except BaseException:
+                                self.conn.rollback()
+                                raise
+                        self._table_changed(table_name)
+                        logger.info("Appended %d new rows from '%s' into '%s'", rows - meta["rows_ingested"],
+                                    file_path, table_name)
+                    self._record_import(path, table_name, stat, content_hash, rows, meta["columns"])
+                    return table_name
+
+            self.import_csv(file_path, table_name, chunksize, progress, sample=sample)
+            _, content_hash, _ = _hash_file(path, 0)
+            rows = self.conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+            columns = list(self.get_schema(table_name))
+            self._record_import(path, table_name, os.stat(path), content_hash, rows, columns)
+        return table_name
+
+    # Stream a CSV file into a table in chunks of `chunksize` rows, so peak memory depends on the
+    # chunk size instead of the file size. All chunks are inserted with executemany inside one
+    # explicit transaction, each chunk guarded by a savepoint. If a chunk fails, the chunks before
+    # it are committed and ChunkImportError tells you where to resume (pass it as `resume_from`).
+    # Column types are inferred from the first chunk, or from the first `sample` rows of the file.
+    def import_csv_chunked(self, file_path, table_name, chunksize=100_000, progress=None, resume_from=0,
+                           sample=None):
+        if chunksize <= 0:
+            raise ValueError("chunksize must be a positive number of rows.")
+
+        skip = range(1, resume_from + 1) if resume_from else None
+        reader = pd.read_csv(file_path, chunksize=chunksize, skiprows=skip)
+
+        rows_done = resume_from
+        started = time.perf_counter()
+        insert_sql = None
+        with self._writing():
+            if self.conn.in_transaction:
+                self.conn.commit()
+            self.cursor.execute("BEGIN")
+            try:
+                for index in count():
+                    # a malformed or undecodable chunk keeps the chunks before it, like a failed insert
+                    try:
+                        chunk = next(reader, None)
+                    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+                        self.conn.commit()
+                        raise ChunkImportError(table_name, index, rows_done, e) from e
+                    if chunk is None:
+                        break
+                    if insert_sql is None:
+                        if not resume_from:
+                            self._drop_table(table_name)
+                            self.schemas.pop(table_name, None)
+                        if table_name not in self.schemas:
+                            # the schema comes from the first `sample` rows of the file, or the first chunk
+                            head = pd.read_csv(file_path, nrows=sample) if sample else chunk
+                            self.create_table_from_df(table_name, head, commit=False)
+                        insert_sql = _insert_statement(table_name, chunk.columns)
+
+                    self.cursor.execute("SAVEPOINT sse_chunk")
+                    try:
+                        self._insert_df(table_name, chunk, insert_sql)
+                    except sqlite3.Error as e:
+                        self.cursor.execute("ROLLBACK TO sse_chunk")
+                        self.cursor.execute("RELEASE sse_chunk")
+                        self.conn.commit()
+                        raise ChunkImportError(table_name, index, rows_done, e) from e
+                    self.cursor.execute("RELEASE sse_chunk")
+
+                    rows_done += len(chunk)
+                    elapsed = time.perf_counter() - started
+                    rate = (rows_done - resume_from) / elapsed if elapsed > 0 else 0.0
+                    if progress is not None:
+                        progress(rows_done, rate)
+                    else:
+                        logger.info("Imported %d rows into '%s' (%.0f rows/s)", rows_done, table_name, rate)
+                self.conn.commit()
+            except ChunkImportError:
+                raise
+            except BaseException:
+                self.conn.rollback()
+                raise
+            finally:
+                self._table_changed(table_name)
         return table_name
 
+    # Import many CSV files, one table per file named like import_csv does. Files are parsed in a
+    # process pool and their rows handed to this process, the single writer, in batches of at most
+    # `batch_rows` rows through a bounded queue per file, so neither side holds more than `queue_batches`
+    # batches of a file in flight. Files are written in the given order and committed in large
+    # transactions of at least `commit_rows` rows. Returns a per-file timing report of the committed files.
+    def import_many(self, file_paths, processes=None, commit_rows=500_000, sample=None, profile=None,
+                    batch_rows=50_000, queue_batches=4):
+        if profile is not None:
+            with self.tuned(profile):
+                return self.import_many(file_paths, processes, commit_rows, sample, batch_rows=batch_rows,
+                                        queue_batches=queue_batches)
+        file_paths = list(file_paths)
+        report = []
+        # files written since the last commit, with the schema and encoding they replaced
+        uncommitted = []
+        committed = 0
+        started = time.perf_counter()
+        pending = 0
+        # the manager shuts down first on errors, so workers blocked on a full queue fail instead of hanging
+        with ProcessPoolExecutor(processes) as pool, multiprocessing.Manager() as manager, self._writing():
+            queues = [manager.Queue(queue_batches) for _ in file_paths]
+            futures = [
+                pool.submit(_parse_csv_file, path, batches, batch_rows, sample,
+                            self.declared_types.get(_table_name_for(path)),
+                            self.encodings.get(_table_name_for(path)))
+                for path, batches in zip(file_paths, queues)
+            ]
+            if self.conn.in_transaction:
+                self.conn.commit()
+            try:
+                for path, batches, future in zip(file_paths, queues, futures):
+                    table_name = _table_name_for(path)
+                    header = batches.get()
+                    if header is None:
+                        future.result()
+                    columns, schema, encode = header
+
+                    write_started = time.perf_counter()
+                    if not self.conn.in_transaction:
+                        # so the DDL below is rolled back with the rows if the import fails
+                        self.cursor.execute("BEGIN")
+                    uncommitted.append((table_name, self.schemas.get(table_name), self.encoded.get(table_name)))
+                    self._drop_table(table_name)
+                    if table_name in self.partitions:
+                        # rows are routed to the children by the view's trigger
+                        self._create_partitioned_table(table_name, schema, commit=False)
+                    elif encode:
+                        # rows are encoded by the view's insert trigger
+                        self.create_encoded_table(table_name, schema, encode, commit=False)
+                    else:
+                        self.create_table(table_name, schema, commit=False)
+                    rows = 0
+                    insert_sql = _insert_statement(table_name, columns)
+                    with self._bulk_insert(table_name):
+                        for batch in iter(batches.get, None):
+                            self.cursor.executemany(insert_sql, batch)
+                            rows += len(batch)
+                    parse_seconds = future.result()
+                    pending += rows
+                    report.append({
+                        "file": path, "table": table_name, "rows": rows,
+                        "parse_seconds": parse_seconds, "write_seconds": time.perf_counter() - write_started,
+                    })
+                    if pending >= commit_rows:
+                        self.conn.commit()
+                        uncommitted.clear()
+                        committed = len(report)
+                        pending = 0
+                self.conn.commit()
+                uncommitted.clear()
+                committed = len(report)
+            except BaseException:
+                self.conn.rollback()
+                for table_name, schema, layout in reversed(uncommitted):
+                    if schema is None:
+                        self.schemas.pop(table_name, None)
+                    else:
+                        self.schemas[table_name] = schema
+                    if layout is not None:
+                        self.encoded[table_name] = layout
+                    else:
+                        self.encoded.pop(table_name, None)
+                for pending_future in futures:
+                    pending_future.cancel()
+                raise
+            finally:
+                del report[committed:]
+                for item in report:
+                    self._table_changed(item["table"])
+
+        total_rows = sum(item["rows"] for item in report)
+        elapsed = time.perf_counter() - started
+        logger.info("Imported %d rows from %d files in %.2fs (%.0f rows/s)",
+                    total_rows, len(report), elapsed, total_rows / elapsed if elapsed > 0 else 0)
+        return report
+
+    # Import every file matching `pattern` in a directory with import_many
+    def import_directory(self, directory, pattern="*.csv", **kwargs):
+        return self.import_many(sorted(glob.glob(os.path.join(directory, pattern))), **kwargs)
+
     # Create a table with a specified schema
-    def create_table(self, table_name, columns: dict):
+    def create_table(self, table_name, columns: dict, commit=True):
         self.schemas[table_name] = columns
         col_defs = ", ".join([f'"{col}" {typ}' for col, typ in columns.items()])
         sql = f'CREATE TABLE IF NOT EXISTS "{table_name}" ({col_defs})'
-        self.cursor.execute(sql)
-        self.conn.commit()
-        print(f"Created table '{table_name}' with schema: {columns}")
+        with self._writing():
+            self.cursor.execute(sql)
+            self._reattach_text_index(table_name)
+            self._reattach_materialized(table_name)
+            if commit:
+                self.conn.commit()
+            self._table_changed(table_name)
+        logger.info("Created table '%s' with schema: %s", table_name, columns)
+
+    # Create a dictionary-encoded table: the `encoded` TEXT columns are stored in "<table>__data" as
+    # INTEGER codes into one "<table>__<column>" lookup table each, and "<table>" becomes a view that
+    # joins the values back in under the original column names, so queries read it like the table.
+    # Inserts, updates and deletes on the view go through INSTEAD OF triggers that encode new values
+    # and find the stored row by its column values; the view has no rowid.
+    def create_encoded_table(self, table_name, columns: dict, encoded, commit=True):
+        unknown = [col for col in encoded if col not in columns]
+        if unknown:
+            raise ValueError(f"Cannot encode unknown columns of '{table_name}': {', '.join(unknown)}")
+        self.schemas[table_name] = columns
+        data = {col: ("INTEGER" if col in encoded else typ) for col, typ in columns.items()}
+        col_defs = ", ".join(f'"{col}" {typ}' for col, typ in data.items())
+        with self._writing():
+            self.cursor.execute(f'CREATE TABLE IF NOT EXISTS "{table_name}{ENCODED_SEPARATOR}data" ({col_defs})')
+            for col in encoded:
+                self.cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{table_name}{ENCODED_SEPARATOR}{col}" '
+                    '("code" INTEGER PRIMARY KEY, "value" TEXT NOT NULL UNIQUE)'
+                )
+            if _encoded_tables(self.conn, table_name) is None:
+                for sql in _encoded_view(table_name, list(columns), set(encoded)):
+                    self.cursor.execute(sql)
+            self.encoded[table_name] = (list(columns), set(encoded))
+            if commit:
+                self.conn.commit()
+            self._table_changed(table_name)
+        logger.info("Created table '%s' with schema: %s, encoded: %s", table_name, columns, list(encoded))
+
+    # Split `table_name` on `column` into child tables behind a UNION ALL view with the table's name:
+    # ranges=[2000, 2010] gives children for year < 2000, 2000 <= year < 2010 and year >= 2010, and
+    # values=["MOVIE", "SHOW"] one child per value plus one for any other value (see Partitioning).
+    # Existing rows are moved into the children (indexes have to be created again), later imports
+    # of the table are split the same way, and builder SELECTs whose where/and_/between_ filters
+    # restrict `column` only read the children that can match. The table may not exist yet.
+    def partition_table(self, table_name, column, ranges=None, values=None):
+        if (ranges is None) == (values is None):
+            raise ValueError("Specify either ranges or values to partition by.")
+        kind, bounds = ("range", ranges) if ranges is not None else ("list", values)
+        partitioning = Partitioning(table_name, column, kind, bounds)
+        with self._writing():
+            if table_name in self.partitions or table_name in self.encoded:
+                raise ValueError(f"'{table_name}' is already partitioned or dictionary-encoded.")
+            if self.text_index_info(table_name) is not None:
+                raise ValueError(f"Drop the text index of '{table_name}' before partitioning it.")
+            exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+            ).fetchone() is not None
+            schema = self.get_schema(table_name) if exists else None
+            if exists and column not in schema:
+                raise ValueError(f"Cannot partition '{table_name}' on unknown column: {column}")
+            if self.conn.in_transaction:
+                self.conn.commit()
+            staging = f"{table_name}{ENCODED_SEPARATOR}unpartitioned"
+            try:
+                self.cursor.execute("BEGIN")
+                self.cursor.execute(f"CREATE TABLE IF NOT EXISTS {PARTITIONS_TABLE} "
+                                    "(table_name TEXT PRIMARY KEY, column TEXT, kind TEXT, bounds TEXT)")
+                self.cursor.execute(f"INSERT OR REPLACE INTO {PARTITIONS_TABLE} VALUES (?, ?, ?, ?)",
+                                    (table_name, column, kind, json.dumps(partitioning.bounds)))
+                self.partitions[table_name] = partitioning
+                if exists:
+                    self.cursor.execute(f'ALTER TABLE "{table_name}" RENAME TO "{staging}"')
+                    self._create_partitioned_table(table_name, schema, commit=False)
+                    for child, condition in zip(partitioning.children, partitioning.conditions()):
+                        self.cursor.execute(f'INSERT INTO "{child}" SELECT * FROM "{staging}" WHERE {condition}')
+                    self.cursor.execute(f'DROP TABLE "{staging}"')
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                self.partitions.pop(table_name, None)
+                raise
+            finally:
+                self._table_changed(table_name)
+        logger.info("Partitioned '%s' by %s of %s: %s", table_name, kind, column, partitioning.bounds)
+        return partitioning.children
+
+    # The child tables of a partitioned table, its UNION ALL view and the INSTEAD OF triggers that
+    # route rows inserted into the view to their child, and updates and deletes to the child
+    # holding the old row (an update of the partition column moves the row to its new child)
+    def _create_partitioned_table(self, table_name, columns: dict, commit=True):
+        partitioning = self.partitions[table_name]
+        if partitioning.column not in columns:
+            raise ValueError(f"Cannot partition '{table_name}' on unknown column: {partitioning.column}")
+        self.schemas[table_name] = columns
+        col_defs = ", ".join(f'"{col}" {typ}' for col, typ in columns.items())
+        cols = ", ".join(f'"{col}"' for col in columns)
+        new = ", ".join(f'new."{col}"' for col in columns)
+        route = f"{table_name}{ENCODED_SEPARATOR}route"
+        with self._writing():
+            for child in partitioning.children:
+                self.cursor.execute(f'CREATE TABLE IF NOT EXISTS "{child}" ({col_defs})')
+            if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (route,)).fetchone() is None:
+                union = " UNION ALL ".join(f'SELECT {cols} FROM "{child}"' for child in partitioning.children)
+                self.cursor.execute(f'CREATE VIEW "{table_name}" AS {union}')
+                inserts = " ".join(
+                    f'INSERT INTO "{child}" ({cols}) SELECT {new} WHERE {condition};'
+                    for child, condition in zip(partitioning.children,
+                                                partitioning.conditions(f'new."{partitioning.column}"'))
+                )
+                old = [f'old."{col}"' for col in columns]
+                deletes = " ".join(
+                    f'DELETE FROM "{child}" WHERE {condition} AND {_same_row(child, columns, old)};'
+                    for child, condition in zip(partitioning.children,
+                                                partitioning.conditions(f'old."{partitioning.column}"'))
+                )
+                self.cursor.execute(f'CREATE TRIGGER "{route}" INSTEAD OF INSERT ON "{table_name}" BEGIN {inserts} END')
+                # an update moves the row: out of the child of its old value, into the child of the new one
+                self.cursor.execute(f'CREATE TRIGGER "{table_name}{ENCODED_SEPARATOR}update" INSTEAD OF UPDATE '
+                                    f'ON "{table_name}" BEGIN {deletes} {inserts} END')
+                self.cursor.execute(f'CREATE TRIGGER "{table_name}{ENCODED_SEPARATOR}delete" INSTEAD OF DELETE '
+                                    f'ON "{table_name}" BEGIN {deletes} END')
+            if commit:
+                self.conn.commit()
+            self._table_changed(table_name)
+        logger.info("Created table '%s' with schema: %s, partitioned on %s", table_name, columns, partitioning.column)
+
+    def _load_partitions(self):
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (PARTITIONS_TABLE,)).fetchone() is None:
+            return {}
+        return {name: Partitioning(name, column, kind, json.loads(bounds))
+                for name, column, kind, bounds in self.conn.execute(f"SELECT * FROM {PARTITIONS_TABLE}")}
+
+    # Builder SELECTs on a partitioned table read only the children its filters can match. Each
+    # row of a UNION ALL is copied out of its child, so the union only carries the columns the
+    # query mentions.
+    def _prune_partitions(self, query, sql):
+        partitioning = self.partitions[query.table]
+        source = f"FROM {query.table} "
+        if not sql.startswith("SELECT ") or source not in sql:
+            return sql
+        children = [partitioning.children[i] for i in sorted(partitioning.prune(query._predicates)) or [0]]
+        if len(children) == 1:
+            return sql.replace(source, f'FROM "{children[0]}" AS {query.table} ', 1)
+        columns = list(self.get_schema(query.table))
+        if not sql.startswith("SELECT * "):
+            columns = [col for col in columns if re.search(rf"\b{re.escape(col)}\b", sql)] or columns[:1]
+        cols = ", ".join(f'"{col}"' for col in columns)
+        union = " UNION ALL ".join(f'SELECT {cols} FROM "{child}"' for child in children)
+        return sql.replace(source, f"FROM ({union}) AS {query.table} ", 1)
+
+    # Register a grouped COUNT/SUM/MIN/MAX/AVG builder over a table as a materialized aggregate:
+    # its groups are stored in a real table `name` (default "<table>__mv<i>") and kept current by
+    # triggers on row-level writes to the table, while imports into it skip the triggers and merge
+    # the aggregates of the new rows afterwards (a reloaded table starts from empty groups).
+    # Builder SELECTs of the same shape, or coarser groupings and filters on its group columns, are
+    # answered from the stored groups (see MaterializedAggregate.answer). Returns the name.
+    # Dictionary-encoded and partitioned tables are views and cannot be materialized.
+    def materialize(self, query, name=None):
+        groups, filters, aggregates = _materialized_shape(query)
+        table_name = query.table
+        with self._writing():
+            is_table = self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                         (table_name,)).fetchone() is not None
+            if not is_table or table_name in self.encoded or table_name in self.partitions:
+                raise ValueError(f"'{table_name}' is not a plain table, only tables can be materialized.")
+            schema = self.get_schema(table_name)
+            unknown = [col for col in groups + [col for _, col in aggregates] if col != "*" and col not in schema]
+            if unknown:
+                raise ValueError(f"Cannot materialize unknown columns of '{table_name}': {', '.join(unknown)}")
+            if name is None:
+                taken = set(self.materialized) | {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master")}
+                name = next(f"{table_name}{ENCODED_SEPARATOR}mv{i}" for i in range(len(taken) + 1)
+                            if f"{table_name}{ENCODED_SEPARATOR}mv{i}" not in taken)
+            elif name in self.materialized or self.conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None:
+                raise ValueError(f"'{name}' already exists.")
+            view = MaterializedAggregate(name, table_name, groups, filters, aggregates)
+            col_defs = [f'"{col}" {schema[col]}' for col in groups]
+            col_defs += [f'"{state}" {"INTEGER" if state.startswith(("_n", "_count_")) else ""}'.rstrip()
+                         for state in view.states]
+            if self.conn.in_transaction:
+                self.conn.commit()
+            try:
+                self.cursor.execute("BEGIN")
+                self.cursor.execute(f"CREATE TABLE IF NOT EXISTS {MATERIALIZED_TABLE} (name TEXT PRIMARY KEY, "
+                                    "table_name TEXT, groups TEXT, filters TEXT, aggregates TEXT)")
+                self.cursor.execute(f"INSERT INTO {MATERIALIZED_TABLE} VALUES (?, ?, ?, ?, ?)",
+                                    (name, table_name, json.dumps(groups), filters, json.dumps(aggregates)))
+                self.cursor.execute(f'CREATE TABLE "{name}" ({", ".join(col_defs)})')
+                if groups:
+                    cols = ", ".join(f'"{col}"' for col in groups)
+                    self.cursor.execute(f'CREATE INDEX "{name}{ENCODED_SEPARATOR}groups" ON "{name}" ({cols})')
+                self.cursor.execute(f'INSERT INTO "{name}" {view.aggregate_sql(chr(34) + table_name + chr(34))}')
+                for sql in view.trigger_sql(list(schema)):
+                    self.cursor.execute(sql)
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.materialized[name] = view
+            self._table_changed(name)
+        logger.info("Materialized %s of '%s' grouped by %s into '%s'", aggregates, table_name, groups, name)
+        return name
+
+    # Recompute the groups of one materialized aggregate (or all of them) from the base table,
+    # e.g. to drop the rounding that incremental REAL sums pick up
+    def refresh_materialized(self, name=None):
+        names = list(self.materialized) if name is None else [name]
+        with self._writing():
+            for name in names:
+                view = self.materialized[name]
+                self.cursor.execute(f'DELETE FROM "{name}"')
+                self.cursor.execute(f'INSERT INTO "{name}" {view.aggregate_sql(chr(34) + view.table_name + chr(34))}')
+                self._table_changed(name)
+            self.conn.commit()
+
+    def drop_materialized(self, name):
+        with self._writing():
+            view = self.materialized.pop(name)
+            for trigger in view.triggers:
+                self.cursor.execute(f'DROP TRIGGER IF EXISTS "{trigger}"')
+            self.cursor.execute(f'DROP TABLE IF EXISTS "{name}"')
+            self.cursor.execute(f"DELETE FROM {MATERIALIZED_TABLE} WHERE name = ?", (name,))
+            self.conn.commit()
+            self._table_changed(name)
+
+    def _load_materialized(self):
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (MATERIALIZED_TABLE,)).fetchone() is None:
+            return {}
+        return {name: MaterializedAggregate(name, table_name, json.loads(groups), filters, json.loads(aggregates))
+                for name, table_name, groups, filters, aggregates
+                in self.conn.execute(f"SELECT * FROM {MATERIALIZED_TABLE}")}
+
+    def _materialized_on(self, table_name):
+        return [view for view in self.materialized.values() if view.table_name == table_name]
+
+    # A table that was dropped and created again lost the triggers of its materialized aggregates:
+    # empty their groups and put the triggers back. An aggregate whose columns are gone is dropped.
+    def _reattach_materialized(self, table_name):
+        for view in self._materialized_on(table_name):
+            if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (view.triggers[0],)).fetchone():
+                continue
+            columns = [row[1] for row in self.conn.execute(f'PRAGMA table_info("{table_name}")')]
+            missing = set(view.groups) | {col for _, col in view.aggregates} - {"*"}
+            if not missing <= set(columns):
+                logger.warning("'%s' lost columns of materialized aggregate '%s', dropping it", table_name, view.name)
+                self.materialized.pop(view.name)
+                self.cursor.execute(f'DROP TABLE IF EXISTS "{view.name}"')
+                self.cursor.execute(f"DELETE FROM {MATERIALIZED_TABLE} WHERE name = ?", (view.name,))
+                continue
+            self.cursor.execute(f'DELETE FROM "{view.name}"')
+            for sql in view.trigger_sql(columns):
+                self.cursor.execute(sql)
+            self._table_changed(view.name)
+
+    # Bulk inserts into a table with materialized aggregates run without their per-row triggers:
+    # the rows added by the block are aggregated once afterwards (by rowid) and merged into the
+    # stored groups, then the triggers are put back. All of it runs in the caller's transaction
+    # (under a savepoint) or in one opened here and left for the caller to commit, so a failed
+    # insert rolls the dropped triggers back with it.
+    @contextmanager
+    def _bulk_insert(self, table_name):
+        views = self._materialized_on(table_name)
+        if not views:
+            yield
+            return
+        outermost = not self.conn.in_transaction
+        self.cursor.execute("BEGIN" if outermost else "SAVEPOINT sse_bulk")
+        try:
+            since = self.conn.execute(f'SELECT IFNULL(MAX(rowid), 0) FROM "{table_name}"').fetchone()[0]
+            for view in views:
+                for trigger in view.triggers:
+                    self.cursor.execute(f'DROP TRIGGER IF EXISTS "{trigger}"')
+            yield
+            columns = [row[1] for row in self.conn.execute(f'PRAGMA table_info("{table_name}")')]
+            for view in views:
+                self.cursor.execute("DROP TABLE IF EXISTS temp.sse_delta")
+                self.cursor.execute(f'CREATE TEMP TABLE sse_delta AS '
+                                    f'{view.aggregate_sql(chr(34) + table_name + chr(34), f"rowid > {since}")}')
+                for sql in view.merge("SELECT * FROM temp.sse_delta"):
+                    self.cursor.execute(sql)
+                self.cursor.execute("DROP TABLE temp.sse_delta")
+                for sql in view.trigger_sql(columns):
+                    self.cursor.execute(sql)
+        except BaseException:
+            if outermost:
+                self.conn.rollback()
+            else:
+                self.cursor.execute("ROLLBACK TO sse_bulk")
+                self.cursor.execute("RELEASE sse_bulk")
+            raise
+        if not outermost:
+            self.cursor.execute("RELEASE sse_bulk")
+        for view in views:
+            self._table_changed(view.name)
+
+    # Insert the rows of a DataFrame with executemany (`sql` is their INSERT statement, if already
+    # built). Rows for a partitioned table go straight to their child tables. Rows for a
+    # dictionary-encoded table bypass the per-row trigger of its view: new values are added to the
+    # lookup tables first and the codes are mapped in pandas.
+    def _insert_df(self, table_name, df: pd.DataFrame, sql=None):
+        if table_name in self.partitions:
+            partitioning = self.partitions[table_name]
+            index = partitioning.assign(df[partitioning.column])
+            for i, child in enumerate(partitioning.children):
+                part = df[index == i]
+                if len(part):
+                    self.cursor.executemany(_insert_statement(child, df.columns), _rows_from_df(part))
+            return
+        if table_name not in self.encoded:
+            with self._bulk_insert(table_name):
+                self.cursor.executemany(sql or _insert_statement(table_name, df.columns), _rows_from_df(df))
+            return
+        _, encoded = self.encoded[table_name]
+        codes = {}
+        for col in df.columns:
+            if col not in encoded:
+                continue
+            lookup = f"{table_name}{ENCODED_SEPARATOR}{col}"
+            # as the lookup table stores them, also when a chunk was parsed as numbers
+            values = df[col].astype(str).where(df[col].notna(), None)
+            self.cursor.executemany(f'INSERT OR IGNORE INTO "{lookup}" ("value") VALUES (?)',
+                                    ((value,) for value in values.dropna().unique()))
+            codes[col] = values.map(dict(self.conn.execute(f'SELECT "value", "code" FROM "{lookup}"')))
+        data = f"{table_name}{ENCODED_SEPARATOR}data"
+        self.cursor.executemany(_insert_statement(data, df.columns), _rows_from_df(df.assign(**codes)))
+
+    # drop a table, the view and child tables of a partitioned table (its partitioning stays
+    # registered), or the view, data and lookup tables of a dictionary-encoded table
+    def _drop_table(self, table_name):
+        if table_name in self.partitions:
+            self.cursor.execute(f'DROP VIEW IF EXISTS "{table_name}"')
+            for child in self.partitions[table_name].children:
+                self.cursor.execute(f'DROP TABLE IF EXISTS "{child}"')
+            return
+        tables = _encoded_tables(self.conn, table_name)
+        if tables is None:
+            self.cursor.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            return
+        self.cursor.execute(f'DROP VIEW "{table_name}"')
+        for name in tables:
+            self.cursor.execute(f'DROP TABLE "{name}"')
+        self.encoded.pop(table_name, None)
+
+    # columns and encoded columns of every dictionary-encoded table in the database
+    def _encoded_layouts(self):
+        layouts = {}
+        for (name,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'view'").fetchall():
+            tables = _encoded_tables(self.conn, name)
+            if tables is not None:
+                columns = [row[1] for row in self.conn.execute(f'PRAGMA table_info("{name}")')]
+                layouts[name] = (columns, {col for col in columns if f"{name}{ENCODED_SEPARATOR}{col}" in tables})
+        return layouts
+
+    # A builder SELECT on a dictionary-encoded table reads a copy of its view that only decodes the
+    # encoded columns the query mentions (SQLite drops unused joins from plain SELECTs by itself,
+    # but not from aggregates, where each one costs a lookup per row), and groups on the integer
+    # codes of encoded GROUP BY columns that it does not filter on, decoding once per group.
+    def _prune_encoded(self, query, sql):
+        columns, encoded = self.encoded[query.table]
+        source = f"FROM {query.table} "
+        if not sql.startswith("SELECT ") or sql.startswith("SELECT * ") or source not in sql:
+            return sql
+        used = {col for col in encoded if re.search(rf"\b{re.escape(col)}\b", sql)}
+        filtered = {col for _, col, _ in query.columns_used()["filters"]}
+        grouped = {col.strip('"') for col in query._group_columns} & used - filtered
+        if used == encoded and not grouped:
+            return sql
+        if grouped:
+            fields = [f'"{col.strip(chr(34))}{ENCODED_SEPARATOR}code"' if col.strip('"') in grouped else col
+                      for col in query._group_columns]
+            group_by = re.compile(re.escape(query._group_by) + r"(?=[ ;]|$)")
+            sql = group_by.sub(lambda _: f"GROUP BY {', '.join(fields)}", sql, count=1)
+        pruned = _encoded_select(query.table, columns, encoded, used, grouped)
+        return sql.replace(source, f"FROM ({pruned}) AS {query.table} ", 1)
+
+    # A builder UPDATE/DELETE on a view-backed table, as (sql, params, counted) statements on its
+    # storage tables, or None to run it as built. The INSTEAD OF triggers of the view find each row
+    # by its column values, a scan of the storage table per row; these statements match rows by the
+    # rowid of the storage table instead. `counted` statements make up the rowcount.
+    def _storage_writes(self, query):
+        if not hasattr(query, "build") or not query._query.startswith(("UPDATE ", "DELETE ")):
+            return None
+        if query.table in self.encoded:
+            return self._encoded_writes(query)
+        if query.table in self.partitions:
+            return self._partitioned_writes(query)
+        return None
+
+    # The filter of a builder write: its WHERE clause and parameters
+    @staticmethod
+    def _write_filter(query):
+        if not query._where_params:
+            return "", []
+        return ("WHERE " + " ".join(sql for sql, _ in query._where_params),
+                [v for _, params in query._where_params for v in params])
+
+    # UPDATE/DELETE on the children of a partitioned table that its filter can match. Rows whose
+    # partition column an update changed are moved afterwards: re-inserted through the view, which
+    # routes them to their new child, and deleted from the old one.
+    def _partitioned_writes(self, query):
+        partitioning = self.partitions[query.table]
+        children = [partitioning.children[i] for i in sorted(partitioning.prune(query._predicates))]
+        where, params = self._write_filter(query)
+        if query._query.startswith("DELETE "):
+            return [(f'DELETE FROM "{child}" {where}', params, True) for child in children]
+
+        head, values = query._query_params
+        sets = head[len(f"UPDATE {query.table} SET "):]
+        writes = [(f'UPDATE "{child}" SET {sets}{where}', list(values) + params, True) for child in children]
+        if partitioning.column in (col for col, _ in query._assignments):
+            cols = ", ".join(f'"{col}"' for col in self.get_schema(query.table))
+            conditions = partitioning.conditions()
+            for child in children:
+                moved = f"({conditions[partitioning.children.index(child)]}) IS NOT 1"
+                writes.append((f'INSERT INTO "{query.table}" ({cols}) SELECT {cols} FROM "{child}" WHERE {moved}',
+                               [], False))
+                writes.append((f'DELETE FROM "{child}" WHERE {moved}', [], False))
+        return writes
+
+    # UPDATE/DELETE on the data table of a dictionary-encoded table. The filter and new values are
+    # computed over the decoded rows once, new values of encoded columns go into their lookup tables
+    # first and are stored as their codes.
+    def _encoded_writes(self, query):
+        columns, encoded = self.encoded[query.table]
+        data = f"{query.table}{ENCODED_SEPARATOR}data"
+        rowid = f"{ENCODED_SEPARATOR}rowid"
+        rows = f'({_encoded_select(query.table, columns, encoded, rowid=True)}) AS "{query.table}"'
+        where, params = self._write_filter(query)
+        if query._query.startswith("DELETE "):
+            return [(f'DELETE FROM "{data}" WHERE rowid IN (SELECT "{rowid}" FROM {rows} {where})', params, True)]
+
+        params = list(query._query_params[1]) + params
+        values = ", ".join(f'{value} AS "{col}"' for col, value in query._assignments)
+        changed = f'(SELECT "{rowid}", {values} FROM {rows} {where})'
+        writes, sets = [], []
+        for col, _ in query._assignments:
+            if col in encoded:
+                lookup = f"{query.table}{ENCODED_SEPARATOR}{col}"
+                writes.append((f'INSERT OR IGNORE INTO "{lookup}" ("value") '
+                               f'SELECT "{col}" FROM {changed} WHERE "{col}" IS NOT NULL', params, False))
+                sets.append(f'"{col}" = (SELECT "code" FROM "{lookup}" WHERE "value" = changed."{col}")')
+            else:
+                sets.append(f'"{col}" = changed."{col}"')
+        writes.append((f'UPDATE "{data}" SET {", ".join(sets)} FROM {changed} AS changed '
+                       f'WHERE "{data}".rowid = changed."{rowid}"', params, True))
+        return writes
+
+    # Full-text index on TEXT columns: an external-content FTS5 table "<table>_fts" over the rows of
+    # the table, filled once and then kept in sync by insert/update/delete triggers. Query it with
+    # SQLQueryBuilder.match_(). The default tokenizer matches words and prefixes ("heat*");
+    # tokenizer="trigram" also matches any substring of 3+ characters. The index follows rowids, so
+    # re-run create_text_index after a VACUUM of a table without an INTEGER PRIMARY KEY.
+    def create_text_index(self, table_name, columns, tokenizer="unicode61"):
+        columns = [columns] if isinstance(columns, str) else list(columns)
+        if not columns:
+            raise ValueError("At least one column must be specified for a text index.")
+        unknown = [col for col in columns if col not in self.get_schema(table_name)]
+        if unknown:
+            raise ValueError(f"Cannot index unknown columns of '{table_name}': {', '.join(unknown)}")
+        if table_name in self.encoded or table_name in self.partitions:
+            raise ValueError(f"Text indexes need rowids, '{table_name}' is a dictionary-encoded or partitioned view.")
+        fts = table_name + TEXT_INDEX_SUFFIX
+        cols = ", ".join(f'"{col}"' for col in columns)
+        with self._writing():
+            if self.conn.in_transaction:
+                self.conn.commit()
+            try:
+                self.cursor.execute("BEGIN")
+                self._drop_text_index(table_name)
+                self.cursor.execute(
+                    f'CREATE VIRTUAL TABLE "{fts}" USING fts5({cols}, content="{table_name}", '
+                    f"content_rowid=rowid, tokenize='{tokenizer}')"
+                )
+                for sql in _text_index_triggers(table_name, columns):
+                    self.cursor.execute(sql)
+                self.cursor.execute(f'INSERT INTO "{fts}"("{fts}") VALUES (\'rebuild\')')
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+            finally:
+                self._table_changed(fts)
+        logger.info("Created text index '%s' on '%s' (%s)", fts, table_name, ", ".join(columns))
+        return fts
+
+    def drop_text_index(self, table_name):
+        with self._writing():
+            self._drop_text_index(table_name)
+            self.conn.commit()
+            self._table_changed(table_name + TEXT_INDEX_SUFFIX)
+
+    def _drop_text_index(self, table_name):
+        fts = table_name + TEXT_INDEX_SUFFIX
+        for suffix in ("_ai", "_ad", "_au"):
+            self.cursor.execute(f'DROP TRIGGER IF EXISTS "{fts}{suffix}"')
+        self.cursor.execute(f'DROP TABLE IF EXISTS "{fts}"')
+
+    # indexed columns and tokenizer of a table's text index, or None
+    def text_index_info(self, table_name):
+        fts = table_name + TEXT_INDEX_SUFFIX
+        with self._writing():
+            row = self.conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                    (fts,)).fetchone()
+            if row is None:
+                return None
+            columns = [info[1] for info in self.conn.execute(f'PRAGMA table_info("{fts}")')]
+        tokenizer = re.search(r"tokenize='([^']*)'", row[0])
+        return {"table": fts, "columns": columns, "tokenizer": tokenizer.group(1) if tokenizer else "unicode61"}
+
+    # A table that was dropped and created again (as import_csv does) lost its sync triggers: empty
+    # its text index and put the triggers back, so the rows inserted next are indexed again
+    def _reattach_text_index(self, table_name):
+        fts = table_name + TEXT_INDEX_SUFFIX
+        names = {row[0] for row in self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE name IN (?, ?)", (fts, f"{fts}_ai"))}
+        if fts not in names or f"{fts}_ai" in names:
+            return
+        columns = [info[1] for info in self.conn.execute(f'PRAGMA table_info("{fts}")')]
+        self.cursor.execute(f'INSERT INTO "{fts}"("{fts}") VALUES (\'delete-all\')')
+        for sql in _text_index_triggers(table_name, columns):
+            self.cursor.execute(sql)
+        self._table_changed(fts)
+
+    # SQL text and parameters of a query, which is either an SQL string or a SQLQueryBuilder.
+    # Builders are compiled with placeholders so every filter value shares one prepared statement.
+    def _compile(self, query, params=None):
+        if hasattr(query, "build"):
+            sql, built = query.build(params=True)
+            if params is None:
+                params = built
+            if self.advisor is not None:
+                self.advisor.record(query, sql, params)
+            if query.table in self.encoded:
+                sql = self._prune_encoded(query, sql)
+            elif query.table in self.partitions:
+                sql = self._prune_partitions(query, sql)
+            elif params is built:
+                sql, params = self._answer_materialized(query) or (sql, params)
+        else:
+            sql = query
+        self.statements.lookup(sql)
+        return sql, params or ()
+
+    # (sql, params) reading a builder SELECT from a materialized aggregate that answers it, or None
+    def _answer_materialized(self, query):
+        for view in self._materialized_on(query.table):
+            answer = view.answer(query)
+            if answer is not None:
+                logger.debug("Answering a query on '%s' from '%s'", query.table, view.name)
+                return answer
+        return None
+
+    # Call `hook(event)` with a QueryEvent after every query run through execute(), fetch(),
+    # fetch_columns() and executemany(). With plan=True the event also carries the query plan, at the
+    # cost of one EXPLAIN QUERY PLAN per SELECT. Returns the hook, for remove_query_hook().
+    def add_query_hook(self, hook, plan=False):
+        self.query_hooks = self.query_hooks + [(hook, plan)]
+        return hook
+
+    def remove_query_hook(self, hook):
+        self.query_hooks = [(h, plan) for h, plan in self.query_hooks if h != hook]
+
+    # Compile a query and time the block that runs it; the hooks and the DEBUG query log get the
+    # QueryEvent when the block exits. With no hook and DEBUG off nothing is timed.
+    # `conn` is the connection the plan is read on (default: a reader).
+    @contextmanager
+    def _traced(self, query, params=None, conn=None):
+        hooks = self.query_hooks
+        if not hooks and not logger.isEnabledFor(logging.DEBUG):
+            yield QueryEvent(*self._compile(query, params))
+            return
+        started = time.perf_counter()
+        event = QueryEvent(*self._compile(query, params))
+        compiled = time.perf_counter()
+        event.build_s = compiled - started
+        try:
+            yield event
+        except BaseException as exc:
+            event.error = exc
+            raise
+        finally:
+            event.exec_s = time.perf_counter() - compiled
+            self._emit(event, hooks, conn)
+
+    def _emit(self, event, hooks, conn=None):
+        if (event.error is None and any(plan for _, plan in hooks)
+                and event.sql.lstrip().upper().startswith(("SELECT", "WITH"))):
+            if conn is None:
+                with self.reader() as conn:
+                    event.plan = "; ".join(self._plan(conn, event.sql, event.params))
+            else:
+                event.plan = "; ".join(self._plan(conn, event.sql, event.params))
+        logger.debug("query %.3f ms (build %.3f ms), %s rows: %s %r", event.exec_s * 1000,
+                     event.build_s * 1000, event.rows, event.sql, event.params)
+        for hook, _ in hooks:
+            try:
+                hook(event)
+            except Exception:
+                logger.exception("Query hook %r failed", hook)
+
+    # EXPLAIN QUERY PLAN of a query (SQL string or SQLQueryBuilder, compiled as it would run) as a
+    # QueryPlan tree with its full scans and temp b-trees
+    def explain(self, query, params=None):
+        sql, params = self._compile(query, params)
+        with self.reader() as conn:
+            return explain_query_plan(conn, sql, params)
+
+    # Budgets for the statements run through execute(), fetch() and fetch_columns(), plus a log of
+    # the slow, rejected and interrupted ones (see QueryGuard)
+    def enable_query_guard(self, max_seconds=None, max_scan_rows=None, max_sort_rows=None, slow_seconds=None,
+                           enforce=True, log_size=1000):
+        self.guard = QueryGuard(max_seconds, max_scan_rows, max_sort_rows, slow_seconds, enforce, log_size)
+        return self.guard
+
+    def disable_query_guard(self):
+        self.guard = None
+
+    # entries of the guard's slow-query log, oldest first
+    def slow_queries(self):
+        return list(self.guard.log) if self.guard is not None else []
+
+    def _guarded(self, conn, sql, params=()):
+        return self.guard.watch(conn, sql, params) if self.guard is not None else nullcontext()
+
+    @staticmethod
+    def _plan(conn, sql, params=()):
+        return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+    # Run a write or DDL statement (SQL string or SQLQueryBuilder) and commit it; returns a cursor of
+    # its own, so its rowcount is not overwritten by another thread once the lock is released.
+    # Queries are read with fetch()/fetch_columns(), which run on a reader and under the guard.
+    def execute(self, query, params=None):
+        with self._traced(query, params) as event:
+            if event.sql.lstrip().upper().startswith(("SELECT", "WITH")):
+                raise ValueError("execute() runs writes, read queries with fetch() or fetch_columns().")
+            writes = self._storage_writes(query) if params is None else None
+            with self._writing():
+                cursor = self.conn.cursor()
+                with self._guarded(self.conn, event.sql, event.params):
+                    if writes is None:
+                        cursor.execute(event.sql, event.params)
+                    else:
+                        cursor = self._run_writes(cursor, writes)
+                if cursor.description is None:
+                    self.conn.commit()
+                    event.rows = cursor.rowcount
+                    for table in _tables_in(event.sql):
+                        self._table_changed(table)
+        return cursor
+
+    # Run the statements of _storage_writes as one unit
+    def _run_writes(self, cursor, writes):
+        rowcount = 0
+        cursor.execute("SAVEPOINT sse_write")
+        try:
+            for sql, params, counted in writes:
+                cursor.execute(sql, params)
+                rowcount += cursor.rowcount if counted else 0
+        except BaseException:
+            cursor.execute("ROLLBACK TO sse_write")
+            cursor.execute("RELEASE sse_write")
+            raise
+        cursor.execute("RELEASE sse_write")
+        return _SplitWrite(rowcount)
+
+    # Fetch a result as typed NumPy columns, {name: array}, filled batch by batch from the cursor
+    # without building a list of row tuples. Column types come from the schema of the queried table.
+    def fetch_columns(self, query, params=None, batch_size=65_536):
+        with self._traced(query, params) as event:
+            table = getattr(query, "table", None) or next(iter(_tables_in(event.sql)), None)
+            schema = self.get_schema(table) if table else {}
+            with self.reader() as conn, self._guarded(conn, event.sql, event.params):
+                cursor = conn.execute(event.sql, event.params)
+                names = [desc[0] for desc in cursor.description]
+                dtypes = [_column_dtype(schema.get(name)) for name in names]
+                arrays = _fetch_columnar(cursor, dtypes, batch_size)
+            event.rows = len(arrays[0]) if arrays else 0
+        return dict(zip(names, arrays))
+
+    # Fetch a result as a DataFrame built straight from fetch_columns()
+    def fetch_df(self, query, params=None, batch_size=65_536):
+        return pd.DataFrame(self.fetch_columns(query, params, batch_size), copy=False)
+
+    # Run an insert_many/upsert builder (or an INSERT statement) once per row with executemany,
+    # committing every `batch_size` rows. `rows` is a list or iterator of tuples or dicts, or a
+    # DataFrame, and is consumed one batch at a time. Returns the number of rows written.
+    def executemany(self, query, rows, batch_size=10_000):
+        with self._traced(query, ()) as event:
+            sql = event.sql
+            columns = getattr(query, "insert_columns", None)
+            if isinstance(rows, pd.DataFrame):
+                frame = rows[columns] if columns else rows
+                batches = (_rows_from_df(frame.iloc[i:i + batch_size]) for i in range(0, len(frame), batch_size))
+            else:
+                rows = iter(rows)
+                batches = iter(lambda: list(islice(rows, batch_size)), [])
+                if columns:
+                    batches = ([tuple(row[col] for col in columns) if isinstance(row, dict) else row for row in batch]
+                               for batch in batches)
+
+            written = 0
+            with self._writing():
+                if self.conn.in_transaction:
+                    self.conn.commit()
+                try:
+                    for batch in batches:
+                        self.cursor.executemany(sql, batch)
+                        self.conn.commit()
+                        written += self.cursor.rowcount
+                except BaseException:
+                    self.conn.rollback()
+                    raise
+                finally:
+                    for table in _tables_in(sql):
+                        self._table_changed(table)
+            event.rows = written
+        return written
+
+    # Execute a query (SQL string or SQLQueryBuilder) and return all result rows.
+    # SELECTs are answered from the result cache when it is enabled and the tables are unchanged.
+    def fetch(self, query, params=None, timeout=None):
+        with self._traced(query, params) as event:
+            sql, params = event.sql, event.params
+            if self.result_cache is None or not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+                rows = self._fetch_rows(sql, params, timeout)
+            else:
+                key = (sql, tuple(params))
+                versions = self._cache_versions(sql)
+                cached = self.result_cache.get(key, versions)
+                event.cached = cached is not None
+                if cached is None:
+                    cached = self._fetch_rows(sql, params, timeout)
+                    self.result_cache.put(key, versions, cached)
+                rows = list(cached)
+            event.rows = len(rows)
+        return rows
+
+    def _fetch_rows(self, sql, params, timeout=None):
+        with self._writing(), self._guarded(self.conn, sql, params):
+            return self.cursor.execute(sql, params).fetchall()
+
+    # Run a COUNT/SUM/MIN/MAX/AVG builder query (optionally grouped, filtered, ordered by a selected
+    # column and limited) on `processes` worker processes: the table's rowids are cut into `ranges`
+    # slices (4 per process by default), each worker aggregates its slices on its own read-only
+    # connection, and the partial results are merged here with SQLite's own GROUP BY, ORDER BY and
+    # LIMIT. Anything else (HAVING, DISTINCT, views, in-memory databases) runs serially through
+    # fetch(). Integer results match serial execution exactly; SUM and AVG of REAL columns can differ
+    # in the last digits, since the values are added in a different order.
+    def fetch_parallel(self, query, processes=None, ranges=None):
+        if self._answer_materialized(query) is not None:
+            return self.fetch(query)
+        plan, reason = _decompose_aggregate(query)
+        with self._writing():
+            db_file = self.conn.execute("PRAGMA database_list").fetchone()[2]
+            is_table = self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                         (query.table,)).fetchone() is not None
+            if plan is not None and (not db_file or not is_table):
+                plan, reason = None, "it needs a rowid table in a database file"
+            if plan is not None:
+                if self.conn.in_transaction:
+                    self.conn.commit()
+                lo, hi = self.conn.execute(f'SELECT MIN(rowid), MAX(rowid) FROM "{query.table}"').fetchone()
+                if lo is None:
+                    plan, reason = None, "the table is empty"
+        if plan is None:
+            logger.debug("Running %s serially: %s", query.table, reason)
+            return self.fetch(query)
+
+        partial_sql, params, columns, merge_sql = plan
+        processes = processes or os.cpu_count() or 1
+        ranges = max(1, min(ranges or processes * 4, hi - lo + 1))
+        step = -(-(hi - lo + 1) // ranges)
+        bounds = [(start, min(start + step - 1, hi)) for start in range(lo, hi + 1, step)]
+        with self._traced(query) as event:
+            with ProcessPoolExecutor(processes) as pool:
+                partials = pool.map(_partial_aggregate, [db_file] * len(bounds), [partial_sql] * len(bounds),
+                                    [(start, end, *params) for start, end in bounds])
+                merge = sqlite3.connect(":memory:")
+                try:
+                    merge.execute(f"CREATE TABLE partials ({', '.join(columns)})")
+                    marks = ", ".join("?" for _ in columns)
+                    for rows in partials:
+                        merge.executemany(f"INSERT INTO partials VALUES ({marks})", rows)
+                    rows = merge.execute(merge_sql).fetchall()
+                finally:
+                    merge.close()
+            event.rows = len(rows)
+        logger.debug("Merged %d rowid ranges of '%s' on %d processes", len(bounds), query.table, processes)
+        return rows
+
+    # Cache results of SELECTs run through fetch(), bounded by entry count and bytes (LRU eviction).
+    # Entries are invalidated when import_csv, execute() writes or another connection change their tables.
+    def enable_result_cache(self, max_entries=128, max_bytes=64 * 1024 * 1024):
+        self.result_cache = ResultCache(max_entries, max_bytes)
+        self._seen_changes = self._change_counters()
+        return self.result_cache
+
+    def disable_result_cache(self):
+        self.result_cache = None
+
+    # hit/miss/eviction counters of the result cache
+    def result_cache_info(self):
+        return self.result_cache.info() if self.result_cache is not None else None
+
+    # bump the version of a table so cached results that read it are no longer served
+    def _table_changed(self, table_name):
+        self.table_versions[table_name] = self.table_versions.get(table_name, 0) + 1
+        # pruned queries on a dictionary-encoded or partitioned table name its storage tables instead
+        for storage in self._storage_tables(table_name):
+            self.table_versions[storage] = self.table_versions.get(storage, 0) + 1
+        if self.result_cache is not None:
+            self._seen_changes = self._change_counters()
+
+    # tables holding the rows of a dictionary-encoded or partitioned table
+    def _storage_tables(self, table_name):
+        if table_name in self.partitions:
+            return self.partitions[table_name].children
+        if table_name in self.encoded:
+            return [f"{table_name}{ENCODED_SEPARATOR}{name}" for name in ["data", *self.encoded[table_name][1]]]
+        # materialized aggregates change with the table through their triggers
+        return [view.name for view in self._materialized_on(table_name)]
+
+    # PRAGMA data_version moves when another connection commits, total_changes when this one
+    # writes; either moving without a tracked write means we cannot tell which tables changed
+    def _change_counters(self):
+        with self._writing():
+            return self.conn.execute("PRAGMA data_version").fetchone()[0], self.conn.total_changes
+
+    def _cache_versions(self, sql):
+        counters = self._change_counters()
+        if counters != self._seen_changes:
+            self.result_cache.clear()
+            self._seen_changes = counters
+        return tuple(sorted((table, self.table_versions.get(table, 0)) for table in _tables_in(sql)))
+
+    # hit/miss counters of the compiled statement cache
+    def statement_cache_info(self):
+        return self.statements.info()
+
+    # Create an index on one or more columns. `where` (an SQL expression) makes it a partial index,
+    # `include` appends extra columns so the index covers queries that also select them.
+    # Indexes of a dictionary-encoded table go on its data table, over the codes of encoded columns;
+    # a partitioned table gets one index "<name>__p<i>" per child (unique only within a child).
+    def create_index(self, table_name, columns, name=None, unique=False, where=None, include=None):
+        columns = [columns] if isinstance(columns, str) else list(columns)
+        if not columns:
+            raise ValueError("At least one column must be specified for an index.")
+        columns += [col for col in include or [] if col not in columns]
+        name = name or f"idx_{table_name}_{'_'.join(columns)}"
+        cols = ", ".join(f'"{col}"' for col in columns)
+        with self._writing():
+            for index_name, target in self._index_targets(table_name, name):
+                sql = f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS "{index_name}" ON "{target}" ({cols})'
+                if where:
+                    sql += f" WHERE {where}"
+                self.cursor.execute(sql)
+            self.conn.commit()
+        logger.info("Created index '%s' on '%s' (%s)", name, table_name, ", ".join(columns))
+        return name
+
+    # (index name, storage table) of each index create_index makes for one index on `table_name`:
+    # one per child of a partitioned table, one on the data table of a dictionary-encoded table
+    def _index_targets(self, table_name, name):
+        if table_name in self.partitions:
+            return [(f"{name}{ENCODED_SEPARATOR}p{i}", child)
+                    for i, child in enumerate(self.partitions[table_name].children)]
+        if table_name in self.encoded:
+            return [(name, f"{table_name}{ENCODED_SEPARATOR}data")]
+        return [(name, table_name)]
+
+    def drop_index(self, name):
+        with self._writing():
+            prefix = f"{name}{ENCODED_SEPARATOR}p"
+            children = [row[0] for row in self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND substr(name, 1, ?) = ?", (len(prefix), prefix))]
+            for index_name in [name, *children]:
+                self.cursor.execute(f'DROP INDEX IF EXISTS "{index_name}"')
+            self.conn.commit()
+
+    # indexes of one table (or of all tables): [{"name", "table", "columns", "unique", "partial"}, ...]
+    def list_indexes(self, table_name=None):
+        with self._writing():
+            sql = "SELECT name, tbl_name FROM sqlite_master WHERE type = 'index'"
+            tables = self.conn.execute(sql).fetchall()
+            indexes = []
+            for name, table in tables:
+                if table_name is not None and table != table_name:
+                    continue
+                columns = [row[2] for row in self.conn.execute(f'PRAGMA index_info("{name}")')]
+                flags = {row[1]: row for row in self.conn.execute(f'PRAGMA index_list("{table}")')}
+                indexes.append({
+                    "name": name, "table": table, "columns": columns,
+                    "unique": bool(flags[name][2]), "partial": bool(flags[name][4]),
+                })
+        return indexes
+
+    # Record the columns of every SQLQueryBuilder run through execute()/fetch() so the advisor can
+    # recommend indexes; with auto_create=True they are created the first time a query shape shows up
+    def enable_index_advisor(self, auto_create=False):
+        self.advisor = IndexAdvisor(self, auto_create)
+        return self.advisor
 
     # output schema of a table
     def get_schema(self, table_name):
         if table_name in self.schemas:
             return self.schemas[table_name]
-        self.cursor.execute(f"PRAGMA table_info('{table_name}')")
-        return {row[1]: row[2] for row in self.cursor.fetchall()}
+        with self._writing():
+            self.cursor.execute(f"PRAGMA table_info('{table_name}')")
+            return {row[1]: row[2] for row in self.cursor.fetchall()}
 
-    # List all tables in the database
+    # List all tables in the database, dictionary-encoded and partitioned tables by their view
     def list_tables(self):
-        self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        return [row[0] for row in self.cursor.fetchall()]
+        with self._writing():
+            virtual, shadow = _text_index_tables(self.conn)
+            hidden = {IMPORTS_TABLE, PARTITIONS_TABLE, MATERIALIZED_TABLE} | virtual | shadow
+            for partitioning in self.partitions.values():
+                hidden.update(partitioning.children)
+            self.cursor.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view')")
+            tables = []
+            for name, typ in self.cursor.fetchall():
+                if typ == "view" and name not in self.partitions:
+                    storage = _encoded_tables(self.conn, name)
+                    if storage is None:
+                        continue
+                    hidden.update(storage)
+                tables.append(name)
+            return [name for name in tables if name not in hidden]
     # Close the database connection
     def close(self):
         self.conn.close()
-        print("Database connection closed.")
+        logger.debug("Database connection closed.")
+
+
+# Raised when no pooled connection becomes free within the checkout timeout
+class PoolTimeout(TimeoutError):
+    pass
+
+
+# Fixed-size pool of read-only connections to one database file, shareable between threads
+class ConnectionPool:
+    def __init__(self, db_path, size=4, timeout=5.0, statement_cache_size=256, pragmas=None):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1.")
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._in_use = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        for _ in range(size):
+            conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=statement_cache_size)
+            _apply_pragmas(conn, pragmas or {})
+            conn.execute("PRAGMA query_only = ON")
+            self._idle.put(conn)
+
+    # Take a connection out of the pool, waiting at most `timeout` seconds
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"No connection to {self.db_path} became free within {timeout}s.") from None
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    # Give a connection back to the pool
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    # checkout counters and wait times in seconds
+    def metrics(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "in_use": self._in_use,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "wait_total": self._wait_total,
+                "wait_max": self._wait_max,
+                "wait_avg": self._wait_total / self._checkouts if self._checkouts else 0.0,
+            }
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# SQLiteDataEngine for multi-threaded use: one writer connection guarded by a lock, a pool of
+# read connections, WAL journal mode so readers keep scanning while an import writes, and a
+# cursor per thread. fetch() reads through the pool, everything else goes through the writer.
+class PooledSQLiteDataEngine(SQLiteDataEngine):
+    def __init__(self, db_path="my_database.db", pool_size=4, timeout=5.0, statement_cache_size=256, profile=None):
+        if db_path == ":memory:":
+            raise ValueError("A pooled engine needs a database file, ':memory:' is private to one connection.")
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._data_versions = {}
+        super().__init__(db_path, statement_cache_size, profile)
+        self.pool = ConnectionPool(db_path, pool_size, timeout, statement_cache_size,
+                                   self._without_journal_mode(profile))
+
+    def _connect(self, statement_cache_size):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=statement_cache_size)
+        _apply_pragmas(conn, self._without_journal_mode(self.profile))
+        conn.execute("PRAGMA journal_mode = WAL")
+        return conn
+
+    # the pool needs WAL, and leaving WAL is not possible while the readers are connected
+    @staticmethod
+    def _without_journal_mode(profile):
+        return {name: value for name, value in _profile_pragmas(profile).items() if name != "journal_mode"}
+
+    def apply_profile(self, profile):
+        with self._writing():
+            return _apply_pragmas(self.conn, self._without_journal_mode(profile))
+
+    def _writing(self):
+        return self._write_lock
+
+    # each thread gets its own cursor on the writer connection
+    @property
+    def cursor(self):
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = self._local.cursor = self.conn.cursor()
+        return cursor
+
+    @cursor.setter
+    def cursor(self, value):
+        self._local.cursor = value
+
+    @contextmanager
+    def reader(self, timeout=None):
+        with self.pool.connection(timeout) as conn:
+            yield conn
+
+    # read queries run on a pooled connection
+    def _fetch_rows(self, sql, params, timeout=None):
+        with self.pool.connection(timeout) as conn, self._guarded(conn, sql, params):
+            return conn.execute(sql, params).fetchall()
+
+    # The result cache is checked without the write lock, so fetches do not stall behind an import:
+    # PRAGMA data_version is read on a pooled connection, where it moves on every commit of another
+    # connection (the writer's included, so those clear the cache too), and the writer's
+    # total_changes is compared on its own. Each connection has its own data_version, the first
+    # look at one clears the cache as commits before it are unknown.
+    def _change_counters(self):
+        return self.conn.total_changes
+
+    def _cache_versions(self, sql):
+        with self.pool.connection() as conn:
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if self._data_versions.get(conn) != version:
+            self._data_versions[conn] = version
+            self.result_cache.clear()
+        return super()._cache_versions(sql)
+
+    # pool checkout counters, wait times and connections in use
+    def pool_metrics(self):
+        return self.pool.metrics()
+
+    def close(self):
+        self.pool.close()
+        super().close()
+
+# SQLiteDataEngine that works on a copy of the database in RAM. The file at `db_path` (or only
+# `tables` of it) is loaded into a :memory: database with the backup API, every query runs on
+# the copy, and changes are written back to the file by snapshot(): on close() and, with
+# `snapshot_interval` set, every that many seconds from a background thread. `max_memory` caps
+# the copy in bytes: a larger database is refused at load and writes past it fail with
+# "database or disk is full". `backup_pages`/`backup_sleep` are passed to Connection.backup: copy
+# in steps of that many pages, sleeping between steps, so other writers of the file get a turn.
+class InMemorySQLiteDataEngine(SQLiteDataEngine):
+    def __init__(self, db_path="my_database.db", tables=None, max_memory=None, snapshot_interval=None,
+                 backup_pages=-1, backup_sleep=0.25, statement_cache_size=256, profile=None):
+        if db_path == ":memory:":
+            raise ValueError("An in-memory copy needs a database file to load from and snapshot to.")
+        self.tables = list(tables) if tables is not None else None
+        self.max_memory = max_memory
+        self.snapshot_interval = snapshot_interval
+        self.backup_pages = backup_pages
+        self.backup_sleep = backup_sleep
+        self.load_seconds = 0.0
+        self.snapshots = 0
+        self.last_snapshot_seconds = None
+        self._write_lock = threading.RLock()
+        super().__init__(db_path, statement_cache_size, profile)
+        self._snapshot_state = self._current_state()
+        self._stop = threading.Event()
+        self._snapshotter = None
+        if snapshot_interval:
+            self._snapshotter = threading.Thread(target=self._snapshot_loop, name="sse-snapshot", daemon=True)
+            self._snapshotter.start()
+
+    def _connect(self, statement_cache_size):
+        conn = sqlite3.connect(":memory:", check_same_thread=False, cached_statements=statement_cache_size)
+        started = time.perf_counter()
+        self._file_signature = self._disk_signature()
+        if os.path.exists(self.db_path):
+            with sqlite3.connect(self.db_path) as disk:
+                self._check_size(disk)
+                if self.tables is None:
+                    disk.backup(conn, pages=self.backup_pages, sleep=self.backup_sleep)
+                else:
+                    self._copy_tables(disk, conn)
+            disk.close()
+        self.load_seconds = time.perf_counter() - started
+        if self.max_memory is not None:
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            conn.execute(f"PRAGMA max_page_count = {max(1, self.max_memory // page_size)}")
+        _apply_pragmas(conn, {name: value for name, value in _profile_pragmas(self.profile).items()
+                              if name not in ("journal_mode", "page_size", "mmap_size")})
+        logger.info("Loaded '%s' into memory in %.3fs", self.db_path, self.load_seconds)
+        return conn
+
+    # bytes the copy will take: the file, or the pages of the selected tables and their indexes
+    def _check_size(self, disk):
+        if self.max_memory is None:
+            return
+        if self.tables is None:
+            size = os.path.getsize(self.db_path)
+        else:
+            marks = ", ".join("?" for _ in self.tables)
+            size = disk.execute(
+                f"SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN "
+                f"(SELECT name FROM sqlite_master WHERE tbl_name IN ({marks}))", self.tables
+            ).fetchone()[0]
+        if size > self.max_memory:
+            raise ValueError(f"'{self.db_path}' needs {size} bytes in memory, more than max_memory={self.max_memory}.")
+
+    # the selected tables with their indexes and triggers, through an ATTACH of the file
+    def _copy_tables(self, disk, conn):
+        # text indexes come along and are filled by their triggers as the rows are copied
+        names = self.tables + [table + TEXT_INDEX_SUFFIX for table in self.tables]
+        marks = ", ".join("?" for _ in names)
+        schema = disk.execute(
+            f"SELECT type, tbl_name, sql FROM sqlite_master WHERE tbl_name IN ({marks}) AND sql IS NOT NULL "
+            f"ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 WHEN 'view' THEN 2 ELSE 3 END", names
+        ).fetchall()
+        missing = set(self.tables) - {name for typ, name, _ in schema if typ == "table"}
+        if missing:
+            raise ValueError(f"Tables not found in '{self.db_path}': {', '.join(sorted(missing))}")
+        for _, _, sql in schema:
+            conn.execute(sql)
+        conn.execute("ATTACH DATABASE ? AS disk", (self.db_path,))
+        try:
+            for table in self.tables:
+                conn.execute(f'INSERT INTO main."{table}" SELECT * FROM disk."{table}"')
+            conn.commit()
+        finally:
+            conn.execute("DETACH DATABASE disk")
+
+    def _writing(self):
+        return self._write_lock
+
+    # what a snapshot compares: table versions, rows changed and the schema (indexes, DDL run
+    # through execute()), which moves PRAGMA schema_version but no change counter
+    def _current_state(self):
+        schema_version = self.conn.execute("PRAGMA schema_version").fetchone()[0]
+        return dict(self.table_versions), self.conn.total_changes, schema_version
+
+    # size and mtime of the file and its WAL, to notice other connections writing to it
+    def _disk_signature(self):
+        signature = []
+        for path in (self.db_path, self.db_path + "-wal"):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    # Write the copy back to the file when it changed since the last snapshot: the whole database
+    # with the backup API, or, for a copy of selected tables, the rows of each of its tables (tables
+    # created in memory are created in the file too). Returns False when there was nothing to write.
+    # When the file changed since it was loaded or last snapshotted, another connection wrote to it
+    # and the snapshot is refused with a warning, unless force=True overwrites those changes.
+    def snapshot(self, force=False):
+        with self._writing():
+            if self._current_state() == self._snapshot_state:
+                return False
+            if not force and self._disk_signature() != self._file_signature:
+                logger.warning("'%s' was changed by another connection since it was loaded, not overwriting it "
+                               "(use snapshot(force=True))", self.db_path)
+                return False
+            started = time.perf_counter()
+            if self.conn.in_transaction:
+                self.conn.commit()
+            if self.tables is None:
+                disk = sqlite3.connect(self.db_path)
+                try:
+                    self.conn.backup(disk, pages=self.backup_pages, sleep=self.backup_sleep)
+                finally:
+                    disk.close()
+            else:
+                self._write_tables()
+            self.last_snapshot_seconds = time.perf_counter() - started
+            self.snapshots += 1
+            self._snapshot_state = self._current_state()
+            self._file_signature = self._disk_signature()
+        logger.info("Snapshot of '%s' written in %.3fs", self.db_path, self.last_snapshot_seconds)
+        return True
+
+    def _write_tables(self):
+        virtual, shadow = _text_index_tables(self.conn)
+        schema = [(name, sql) for name, sql in self.conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 WHEN 'view' THEN 2 ELSE 3 END") if name not in shadow]
+        tables = [row[0] for row in self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+            if row[0] not in virtual and row[0] not in shadow]
+        # text indexes are not copied: the triggers of the file's tables keep its own FTS tables in sync
+        with sqlite3.connect(self.db_path) as disk:
+            existing = {row[0] for row in disk.execute("SELECT name FROM sqlite_master")}
+            for name, sql in schema:
+                if name not in existing:
+                    disk.execute(sql)
+        disk.close()
+        self.conn.execute("ATTACH DATABASE ? AS disk", (self.db_path,))
+        try:
+            self.conn.execute("BEGIN")
+            for table in tables:
+                self.conn.execute(f'DELETE FROM disk."{table}"')
+                self.conn.execute(f'INSERT INTO disk."{table}" SELECT * FROM main."{table}"')
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        finally:
+            self.conn.execute("DETACH DATABASE disk")
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(self.snapshot_interval):
+            try:
+                self.snapshot()
+            except Exception:
+                logger.exception("Periodic snapshot of '%s' failed", self.db_path)
+
+    # bytes used by the copy, the cap, load and snapshot timings
+    def memory_info(self):
+        with self._writing():
+            page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "bytes": page_count * page_size,
+            "max_bytes": self.max_memory,
+            "load_seconds": self.load_seconds,
+            "snapshots": self.snapshots,
+            "last_snapshot_seconds": self.last_snapshot_seconds,
+        }
+
+    # stop the periodic snapshots, write the last changes back, then close the copy
+    def close(self):
+        self._stop.set()
+        if self._snapshotter is not None:
+            self._snapshotter.join()
+        self.snapshot()
+        super().close()
+
 
 # TODO: MySQL and PostgreSQL support
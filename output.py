@@ -1,54 +1,209 @@
+import csv
+import logging
 import sqlite3
+from contextlib import contextmanager, nullcontext
 
+import numpy as np
+import pandas as pd
 from db import *
+from db_connection import _column_dtype, _fetch_columnar
 import matplotlib.pyplot as plt
 
+logger = logging.getLogger("simplesqlengine.output")
+
+
+# Indices of at most `n_out` points of (x, y) that keep the visual shape of the series, LTTB-style:
+# the first and last points plus, for each of n_out - 2 equal-count buckets, the point spanning the
+# largest triangle with the means of its neighbouring buckets. Anchoring on the previous bucket's
+# mean instead of the previously chosen point lets every bucket be solved at once with NumPy.
+# `x` must be sorted.
+def _lttb(x, y, n_out):
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    buckets = n_out - 2
+    edges = np.linspace(1, n - 1, buckets + 1).astype(np.int64)
+    starts, counts = edges[:-1], np.diff(edges)
+    mean_x = np.add.reduceat(x[:n - 1], starts) / counts
+    mean_y = np.add.reduceat(y[:n - 1], starts) / counts
+    # anchors: the previous and next bucket means, the end points at the edges
+    prev_x = np.concatenate(([x[0]], mean_x[:-1]))
+    prev_y = np.concatenate(([y[0]], mean_y[:-1]))
+    next_x = np.concatenate((mean_x[1:], [x[-1]]))
+    next_y = np.concatenate((mean_y[1:], [y[-1]]))
+
+    bucket = np.repeat(np.arange(buckets), counts)
+    px, py = x[1:n - 1], y[1:n - 1]
+    area = np.abs((prev_x[bucket] - next_x[bucket]) * (py - prev_y[bucket])
+                  - (prev_x[bucket] - px) * (next_y[bucket] - prev_y[bucket]))
+    # largest area first within each bucket, so each bucket's winner sits at its start offset
+    order = np.lexsort((-area, bucket))
+    return np.concatenate(([0], order[starts - 1] + 1, [n - 1]))
+
+
+# a result column as an identifier in a query that wraps the result as a subquery
+def _column_ref(name):
+    return '"' + name.replace('"', '""') + '"'
+
+# Lazy handle on a query result. Rows are pulled from the database with fetchmany in batches
+# whenever it is iterated, so consumers never need the whole result as rows in RAM nor the CSV.
+# `guarded(db, sql, params)` wraps each run of the query, e.g. an engine's query guard.
+class QueryResult:
+    def __init__(self, connect, query, params=(), batch_size=10_000, guarded=None, columns=None):
+        self.__connect = connect
+        self.__guarded = guarded or (lambda db, sql, params: nullcontext())
+        self.query = query
+        self.params = params
+        self.batch_size = batch_size
+        self.__columns = list(columns) if columns else None
+
+    # read from a LIMIT 0 wrapper of the query, which returns no rows
+    @property
+    def columns(self):
+        if self.__columns is None:
+            with self.__connect() as db:
+                cursor = db.execute(f"SELECT * FROM ({self.query.strip().rstrip(';')}) LIMIT 0", self.params)
+                self.__columns = [desc[0] for desc in cursor.description]
+                cursor.close()
+        return self.__columns
+
+    # lists of row tuples, at most `batch_size` rows each
+    def iter_batches(self, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        with self.__connect() as db, self.__guarded(db, self.query, self.params):
+            cursor = db.execute(self.query, self.params)
+            self.__columns = [desc[0] for desc in cursor.description]
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                yield batch
+
+    def __iter__(self):
+        for batch in self.iter_batches():
+            yield from batch
+
+    # DataFrame of the result, optionally only some of its columns, filled into NumPy column
+    # buffers batch by batch
+    def to_frame(self, columns=None):
+        with self.__connect() as db, self.__guarded(db, self.query, self.params):
+            cursor = db.execute(self.query, self.params)
+            names = [desc[0] for desc in cursor.description]
+            self.__columns = names
+            wanted = list(columns) if columns is not None else names
+            positions = [names.index(col) for col in wanted]
+            arrays = _fetch_columnar(cursor, [_column_dtype(None)] * len(names), self.batch_size, positions)
+        return pd.DataFrame(dict(zip(wanted, arrays)), columns=wanted, copy=False)
+
+
 class DataOutput:
-    def __init__(self, db_file, query=None, output_name=""):
+    # With `engine` set the query runs on a connection borrowed from that engine (a pooled
+    # connection for PooledSQLiteDataEngine) instead of a new connection to `db_file`, under the
+    # engine's query guard. Writes run through engine.execute(), on the engine's writer connection.
+    # Rows are streamed to the CSV with fetchmany, `batch_size` rows at a time.
+    def __init__(self, db_file=None, query=None, output_name="", engine=None, batch_size=10_000):
         self.__output_name = output_name
         self.__csv = f"./{self.__output_name}.csv"
+        self.__params = ()
+        # builder SELECTs can be downsampled in SQL by line_plot()
+        self.__from_builder = hasattr(query, "build")
+        if self.__from_builder:
+            query, self.__params = query.build(params=True)
+        self.__query = query
+        self.__result_query = query
+        self.__batch_size = batch_size
+        self.__db_file = db_file
+        self.__engine = engine
+
+        self.__columns = []
+
+        if engine is not None:
+            with engine.reader() as db:
+                self.__run(db)
+            return
+
         # self.__db = sqlite3.connect(db_file)
         try:
-            self.__db = sqlite3.connect(db_file)
-            print(f"[OK] Connected to SQLite DB: {db_file}")
+            db = sqlite3.connect(db_file)
+            logger.debug("Connected to SQLite DB: %s", db_file)
         except sqlite3.Error as e:
-            print(f"[ERROR] Failed to connect to DB: {e}")
+            logger.error("Failed to connect to DB: %s", e)
             raise
+        try:
+            self.__run(db)
+        finally:
+            db.close()
 
+    def __run(self, db):
+        self.__db = db
         self.__cursor = self.__db.cursor()
-        self.__query = query
-
-        self.__rows = []
-        self.__columns = []
-
-        if query:
+        if self.__query:
             self.__execute_query()
             self.__export_to_csv()
 
-        self.__db.close()
+    # the engine's query guard around running `sql`, nothing without an engine
+    def __guarded(self, db, sql, params=()):
+        return self.__engine._guarded(db, sql, params) if self.__engine is not None else nullcontext()
 
     def __execute_query(self):
-        self.__cursor.execute(self.__query)
-        self.__rows = self.__cursor.fetchall()
-        print(self.__cursor.description)
-
-        if self.__cursor.description is None:
-            print("[Info] Query executed: no result set (likely UPDATE/INSERT/DELETE).")
-
-            table = self.__query.split()[1]
-            self.__cursor.execute(
-                SQLQueryBuilder(table).select().build()
-            )
-            self.__rows = self.__cursor.fetchall()
-            self.__columns = [desc[0] for desc in self.__cursor.description]
+        if self.__engine is not None and not self.__query.lstrip().upper().startswith(("SELECT", "WITH")):
+            # writes go through the engine, on its writer connection; pooled readers are query_only
+            self.__engine.execute(self.__query, self.__params)
+            self.__select_written_table()
         else:
-            self.__columns = [desc[0] for desc in self.__cursor.description]
-        print(self.__columns)
+            with self.__guarded(self.__db, self.__query, self.__params):
+                self.__cursor.execute(self.__query, self.__params)
+            if self.__cursor.description is None:
+                self.__select_written_table()
+        self.__columns = [desc[0] for desc in self.__cursor.description]
+        logger.debug("Result columns: %s", self.__columns)
+
+    # the result of a write is the table it wrote to
+    def __select_written_table(self):
+        logger.info("Query executed: no result set (likely UPDATE/INSERT/DELETE).")
+
+        words = self.__query.split()
+        table = words[2] if words[0].upper() in ("DELETE", "INSERT") else words[1]
+        self.__result_query = SQLQueryBuilder(table).select("*").build()
+        self.__params = ()
+        self.__from_builder = False
+        with self.__guarded(self.__db, self.__result_query):
+            self.__cursor.execute(self.__result_query)
 
     def __export_to_csv(self):
-        df = pd.DataFrame(self.__rows, columns=self.__columns)
-        df.to_csv(f"{self.__output_name}.csv", index=False)
-        print(f"Exported to {self.__output_name}.csv")
+        rows = 0
+        with open(f"{self.__output_name}.csv", "w", newline="", encoding="utf-8") as f, \
+                self.__guarded(self.__db, self.__result_query, self.__params):
+            writer = csv.writer(f)
+            writer.writerow(self.__columns)
+            while True:
+                batch = self.__cursor.fetchmany(self.__batch_size)
+                if not batch:
+                    break
+                writer.writerows(batch)
+                rows += len(batch)
+        logger.info("Exported %d rows to %s.csv", rows, self.__output_name)
+
+    @contextmanager
+    def __connect(self):
+        if self.__engine is not None:
+            with self.__engine.reader() as db:
+                yield db
+            return
+        db = sqlite3.connect(self.__db_file)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    # Result handle for plotting and other consumers, reads from the database rather than the CSV
+    def result(self):
+        if not self.__result_query:
+            raise ValueError("DataOutput has no query to read results from.")
+        return QueryResult(self.__connect, self.__result_query, self.__params, self.__batch_size, self.__guarded,
+                           self.__columns)
 
     def set_figsize(self, figsize=(10, 6)):
         plt.figure(figsize=figsize)
@@ -57,14 +212,65 @@ class DataOutput:
         df = pd.read_csv(self.__csv)
         return df
 
-    def line_plot(self, kind="line", title=None):
-        df = self.get_csv()
+    # The first two result columns reduced to at most `max_points` points. Queries built with
+    # SQLQueryBuilder over a numeric x are bucketed in SQL into `max_points` equal-width x ranges,
+    # giving x (first x of the bucket), y (average) and y_min/y_max columns; other results are fetched
+    # once and reduced with _lttb. Results with at most `max_points` rows come back unchanged.
+    def downsample(self, max_points=2000, result=None):
+        result = result or self.result()
+        if len(result.columns) < 2:
+            raise ValueError("Expected at least two columns for plotting.")
+        x_col, y_col = result.columns[:2]
+        inner = result.query.strip().rstrip(";")
+
+        # only builder results are bucketed in SQL, the others are read once by to_frame below
+        if self.__from_builder:
+            with self.__connect() as db:
+                bounds = f"SELECT MIN({_column_ref(x_col)}), MAX({_column_ref(x_col)}), COUNT(*) FROM ({inner})"
+                with self.__guarded(db, bounds, result.params):
+                    lo, hi, n = db.execute(bounds, result.params).fetchone()
+                numeric = isinstance(lo, (int, float)) and isinstance(hi, (int, float))
+                if n > max_points and numeric:
+                    x, y = _column_ref(x_col), _column_ref(y_col)
+                    bucket = f"MIN(CAST((x - ?) * ? / NULLIF(? - ?, 0) AS INTEGER), ? - 1)"
+                    sql = (f"SELECT MIN(x), AVG(y), MIN(y), MAX(y) FROM "
+                           f"(SELECT {x} AS x, {y} AS y FROM ({inner}) WHERE {x} IS NOT NULL) "
+                           f"GROUP BY {bucket} ORDER BY 1")
+                    params = (*result.params, lo, max_points, hi, lo, max_points)
+                    with self.__guarded(db, sql, params):
+                        rows = db.execute(sql, params).fetchall()
+                    return pd.DataFrame(rows, columns=[x_col, y_col, f"{y_col}_min", f"{y_col}_max"])
+
+        df = result.to_frame([x_col, y_col])
+        if len(df) <= max_points:
+            return df
+        df = df.dropna(subset=[x_col]).sort_values(x_col, kind="stable").reset_index(drop=True)
+        x = df[x_col]
+        if not pd.api.types.is_numeric_dtype(x):
+            dates = pd.to_datetime(x, errors="coerce", format="ISO8601")
+            x = dates.astype("int64") if dates.notna().all() else np.arange(len(df))
+        y = pd.to_numeric(df[y_col], errors="coerce").fillna(0.0)
+        return df.iloc[_lttb(x.to_numpy(), y.to_numpy(), max_points)].reset_index(drop=True)
+
+    # Plot the first two result columns. Line and scatter plots of more than `max_points` rows are
+    # downsampled first (see downsample()), so rendering cost follows the plot width, not the row
+    # count; SQL-bucketed results are drawn as the bucket averages inside a min/max band.
+    # max_points=None plots every row.
+    def line_plot(self, kind="line", title=None, max_points=2000):
+        result = self.result()
 
-        if len(df.columns) < 2:
+        if len(result.columns) < 2:
             raise ValueError("Expected at least two columns for plotting.")
+        if kind not in ("line", "bar", "scatter"):
+            raise ValueError(f"Unsupported plot kind: {kind}, supported kinds are 'line', 'bar', 'scatter'.")
 
+        if max_points is not None and kind != "bar":
+            df = self.downsample(max_points, result)
+        else:
+            df = result.to_frame(result.columns[:2])
         x_col, y_col = str(df.columns[0]), str(df.columns[1])
         title = title or f"{y_col} vs {x_col}"
+        band = df.shape[1] == 4
 
         plt.figure(figsize=(10, 6))
 
@@ -72,10 +278,10 @@ class DataOutput:
             plt.bar(df[x_col], df[y_col])
         elif kind == "scatter":
             plt.scatter(df[x_col], df[y_col])
-        elif kind == "line":  # default: line
-            plt.plot(df[x_col], df[y_col], marker='o')
-        else:
-            raise ValueError(f"Unsupported plot kind: {kind}, supported kinds are 'line', 'bar', 'scatter'.")
+        else:  # default: line
+            if band:
+                plt.fill_between(df[x_col], df.iloc[:, 2], df.iloc[:, 3], alpha=0.3, label="min/max")
+            plt.plot(df[x_col], df[y_col], marker='o' if max_points is None or len(df) <= 200 else None)
 
         plt.xlabel(x_col)
         plt.ylabel(y_col)
@@ -1,10 +1,20 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from time import sleep
 import pytest
 
+import numpy as np
 from numpy.version import release
 
 from db_connection import *
+from db_connection import _decompose_aggregate
 from output import *
+from output import _lttb
+from async_engine import AsyncSQLiteDataEngine
 
 #
 # args = ['-v','-s','./']
@@ -18,6 +28,21 @@ engine = SQLiteDataEngine("my_database.db")
 table = engine.import_csv("NetflixTVShowsAndMovies.csv")
 engine.close()
 
+
+# builds an engine on a fresh database in tmp_path with one table of `schema` holding `rows`
+@pytest.fixture
+def make_engine(tmp_path):
+    def make(db_name, table_name, schema, rows, engine_class=SQLiteDataEngine):
+        engine = engine_class(str(tmp_path / db_name))
+        engine.create_table(table_name, schema)
+        marks = ", ".join("?" * len(schema))
+        engine.cursor.executemany(f'INSERT INTO "{table_name}" VALUES ({marks})', rows)
+        engine.conn.commit()
+        return engine
+
+    return make
+
+
 class TestSQLite:
     def test_query_select(self):
         query = SQLQueryBuilder("NetflixTVShowsAndMovies") \
@@ -168,3 +193,1324 @@ class TestSQLite:
                  .exists_(SQLQueryBuilder("NetflixTVShowsAndMovies").select("index").build(exists=True), with_where=False))
 
         assert query.build() == 'SELECT AVG("index") AS avg_index FROM NetflixTVShowsAndMovies WHERE type IS NOT NULL AND "index" >= 7 GROUP BY type HAVING avg_index > 8 ORDER BY avg_index DESC LIMIT 5 AND EXISTS (SELECT "index" FROM NetflixTVShowsAndMovies);'
+
+
+class TestChunkedImport:
+    def _write_csv(self, path, rows):
+        pd.DataFrame({"n": range(rows), "name": [f"row{i}" for i in range(rows)]}).to_csv(path, index=False)
+
+    def test_chunked_import(self, tmp_path):
+        csv_path = tmp_path / "events.csv"
+        self._write_csv(csv_path, 10)
+        progress = []
+        engine = SQLiteDataEngine(str(tmp_path / "chunked.db"))
+        table = engine.import_csv(str(csv_path), chunksize=3, progress=lambda done, rate: progress.append(done))
+        rows = engine.cursor.execute(f'SELECT name FROM "{table}" ORDER BY rowid').fetchall()
+        engine.close()
+
+        assert table == "events"
+        assert progress == [3, 6, 9, 10]
+        assert rows == [(f"row{i}",) for i in range(10)]
+
+    def test_chunked_import_resume(self, tmp_path):
+        csv_path = tmp_path / "events.csv"
+        self._write_csv(csv_path, 10)
+        engine = SQLiteDataEngine(str(tmp_path / "chunked.db"))
+        engine.import_csv(str(csv_path), chunksize=4, progress=lambda done, rate: None)
+        engine.cursor.execute('DELETE FROM "events" WHERE rowid > 4')
+        engine.conn.commit()
+
+        engine.import_csv(str(csv_path), chunksize=4, progress=lambda done, rate: None, resume_from=4)
+        rows = engine.cursor.execute('SELECT name FROM "events" ORDER BY rowid').fetchall()
+        engine.close()
+
+        assert rows == [(f"row{i}",) for i in range(10)]
+
+    def test_chunked_import_keeps_chunks_before_bad_line(self, tmp_path):
+        csv_path = tmp_path / "events.csv"
+        self._write_csv(csv_path, 10)
+        with open(csv_path, "a") as f:
+            f.write("10,row10,extra\n")
+        engine = SQLiteDataEngine(str(tmp_path / "chunked.db"))
+        with pytest.raises(ChunkImportError) as error:
+            engine.import_csv(str(csv_path), chunksize=4, progress=lambda done, rate: None)
+        rows = engine.fetch('SELECT COUNT(*) FROM "events"')
+        engine.close()
+
+        assert (error.value.chunk_index, error.value.rows_done) == (2, 8)
+        assert rows == [(8,)]
+
+    def test_chunked_import_infers_over_sample(self, tmp_path):
+        csv_path = tmp_path / "events.csv"
+        pd.DataFrame({"score": [1, 2, 3, 4, 5.5, 6]}).to_csv(csv_path, index=False)
+        engine = SQLiteDataEngine(str(tmp_path / "chunked.db"))
+        engine.import_csv(str(csv_path), chunksize=2, progress=lambda done, rate: None)
+        assert engine.get_schema("events") == {"score": "INTEGER"}
+        engine.import_csv(str(csv_path), chunksize=2, progress=lambda done, rate: None, sample=100)
+        assert engine.get_schema("events") == {"score": "REAL"}
+        assert engine.fetch('SELECT SUM(score) FROM "events"') == [(21.5,)]
+        engine.close()
+
+
+class TestSchemaInference:
+    def test_infer_schema_whole_column(self):
+        df = pd.DataFrame({
+            "votes": [None, 3.0, 5.0],
+            "score": [7.5, None, 8.0],
+            "count": pd.array([1, None, 3], dtype="Int64"),
+            "flag": [True, False, True],
+            "added": ["2024-01-02", None, "2024-03-04"],
+            "year": ["1999", "2001", None],
+            "title": ["a", "b", "c"],
+        })
+        assert infer_schema(df) == {
+            "votes": "INTEGER", "score": "REAL", "count": "INTEGER", "flag": "INTEGER",
+            "added": "TIMESTAMP", "year": "INTEGER", "title": "TEXT",
+        }
+
+    def test_import_keeps_inferred_schema(self, tmp_path):
+        csv_path = tmp_path / "shows.csv"
+        pd.DataFrame({"year": [2001, None, 1999], "score": [1, 2, 3]}).to_csv(csv_path, index=False)
+        engine = SQLiteDataEngine(str(tmp_path / "schema.db"))
+        table = engine.import_csv(str(csv_path), types={"score": "real"})
+        declared = {row[1]: row[2] for row in engine.cursor.execute(f'PRAGMA table_info("{table}")')}
+        stored = engine.cursor.execute(f'SELECT typeof(year), typeof(score) FROM "{table}" WHERE year IS NOT NULL').fetchall()
+        ordered = engine.cursor.execute(f'SELECT year FROM "{table}" WHERE year > 2000').fetchall()
+        engine.close()
+
+        assert declared == engine.schemas[table] == {"year": "INTEGER", "score": "REAL"}
+        assert stored == [("integer", "real"), ("integer", "real")]
+        assert ordered == [(2001,)]
+
+
+class TestParameterizedBuild:
+    def test_select_params(self):
+        query = (SQLQueryBuilder("NetflixTVShowsAndMovies")
+                 .select(("AVG(imdb_score)", "avg_score"))
+                 .where("type", False)
+                 .and_("imdb_score", (">=", 7))
+                 .or_("title", "Taxi Driver")
+                 .group_by("type")
+                 .having("avg_score", (">", 8))
+                 .order_by("avg_score", desc=True)
+                 .limit(5))
+
+        assert query.build(params=True) == (
+            'SELECT AVG(imdb_score) AS avg_score FROM NetflixTVShowsAndMovies WHERE type IS NOT NULL AND imdb_score >= ? OR title = ? GROUP BY type HAVING avg_score > ? ORDER BY avg_score DESC LIMIT 5;',
+            (7, "Taxi Driver", 8),
+        )
+
+    def test_update_params(self):
+        query = (SQLQueryBuilder("NetflixTVShowsAndMovies")
+                 .update(release_year=2026, age_certification="R", title="'It''s'")
+                 .where("index", 3))
+
+        assert query.build(params=True) == (
+            'UPDATE NetflixTVShowsAndMovies SET "release_year" = ?, "age_certification" = ?, "title" = ? WHERE "index" = ?;',
+            (2026, "R", "It's", 3),
+        )
+
+    def test_between_params(self):
+        query = (SQLQueryBuilder("orders")
+                 .select("order_id")
+                 .between_("order_date", "'2025-01-01'", "'2025-06-30'"))
+
+        assert query.build(params=True) == (
+            'SELECT order_id FROM orders WHERE "order_date" BETWEEN ? AND ?;',
+            ("2025-01-01", "2025-06-30"),
+        )
+
+    def test_quoted_where_value_matches_literal_mode(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE t (v TEXT)")
+        conn.executemany("INSERT INTO t VALUES (?)", [("x",), ("'x'",)])
+        query = SQLQueryBuilder("t").select("v").where("v", "'x'").or_("v", ("=", "'x'"))
+        assert query.build(params=True)[1] == ("'x'", "'x'")
+        assert conn.execute(query.build()).fetchall() == conn.execute(*query.build(params=True)).fetchall() == [("'x'",)]
+        conn.close()
+
+    def test_like_params(self):
+        query = SQLQueryBuilder("employees").select("name").like_("email", "%@example.com")
+
+        assert query.build(params=True) == ('SELECT name FROM employees WHERE "email" LIKE ?;', ("%@example.com",))
+
+    def test_engine_reuses_statement(self, tmp_path):
+        engine = SQLiteDataEngine(str(tmp_path / "params.db"))
+        engine.create_table("scores", {"id": "INTEGER", "score": "REAL"})
+        engine.cursor.executemany("INSERT INTO scores VALUES (?, ?)", [(i, i / 10) for i in range(100)])
+        engine.conn.commit()
+
+        results = [engine.fetch(SQLQueryBuilder("scores").select("score").where("id", i)) for i in range(10)]
+        info = engine.statement_cache_info()
+        engine.close()
+
+        assert results == [[(i / 10,)] for i in range(10)]
+        assert info["misses"] == 1 and info["hits"] == 9
+
+
+class TestConnectionPool:
+    def test_readers_during_write(self, tmp_path):
+        engine = PooledSQLiteDataEngine(str(tmp_path / "pool.db"), pool_size=2)
+        engine.create_table("events", {"id": "INTEGER"})
+        engine.execute("INSERT INTO events VALUES (1)")
+
+        with engine._writing():
+            engine.cursor.execute("BEGIN")
+            engine.cursor.execute("INSERT INTO events VALUES (2)")
+            # readers see the last committed state while the writer holds its transaction
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                counts = list(pool.map(lambda _: engine.fetch("SELECT COUNT(*) FROM events"), range(8)))
+            engine.conn.commit()
+
+        assert counts == [[(1,)]] * 8
+        assert engine.fetch("SELECT COUNT(*) FROM events") == [(2,)]
+        assert engine.conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+        metrics = engine.pool_metrics()
+        engine.close()
+
+        assert metrics["checkouts"] == 9 and metrics["in_use"] == 0
+
+    def test_checkout_timeout(self, tmp_path):
+        engine = PooledSQLiteDataEngine(str(tmp_path / "pool.db"), pool_size=1)
+        with engine.reader():
+            with pytest.raises(PoolTimeout):
+                engine.fetch("SELECT 1", timeout=0.05)
+        metrics = engine.pool_metrics()
+        engine.close()
+
+        assert metrics["timeouts"] == 1
+
+    def test_data_output_uses_engine(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        engine = PooledSQLiteDataEngine(str(tmp_path / "pool.db"), pool_size=1)
+        engine.create_table("events", {"id": "INTEGER"})
+        engine.execute("INSERT INTO events VALUES (7)")
+        out = DataOutput(query="SELECT id FROM events", output_name="events_out", engine=engine)
+        assert out.get_csv()["id"].tolist() == [7]
+
+        # writes go to the writer connection, the pooled readers are query_only
+        written = DataOutput(query=SQLQueryBuilder("events").update(id=8).where("id", 7),
+                             output_name="events_out", engine=engine)
+        assert written.get_csv()["id"].tolist() == [8]
+        updated = engine.execute("UPDATE events SET id = 9")
+        engine.execute("INSERT INTO events VALUES (10), (11)")
+        assert updated.rowcount == 1
+        with pytest.raises(ValueError):
+            engine.execute("SELECT id FROM events")
+        engine.close()
+
+
+class TestStreamingExport:
+    @pytest.fixture
+    def engine(self, make_engine):
+        return make_engine("export.db", "scores", {"id": "INTEGER", "score": "REAL", "name": "TEXT"},
+                           [(i, i / 4, None if i % 3 else f"n{i}") for i in range(25)])
+
+    def test_export_in_batches(self, tmp_path, monkeypatch, engine):
+        monkeypatch.chdir(tmp_path)
+        query = SQLQueryBuilder("scores").select("id", "score", "name").where("id", ("<", 20))
+        out = DataOutput(str(tmp_path / "export.db"), query, "scores_out", batch_size=7)
+        engine.close()
+
+        df = out.get_csv()
+        assert df["id"].tolist() == list(range(20))
+        assert df["score"].tolist() == [i / 4 for i in range(20)]
+        assert df["name"].isna().sum() == 13
+
+    def test_result_handle(self, tmp_path, monkeypatch, engine):
+        monkeypatch.chdir(tmp_path)
+        out = DataOutput(str(tmp_path / "export.db"), "SELECT id, score FROM scores", "scores_out", batch_size=10)
+        engine.close()
+
+        result = out.result()
+        assert result.columns == ["id", "score"]
+        statements = []
+
+        @contextmanager
+        def connect():
+            db = sqlite3.connect(str(tmp_path / "export.db"))
+            db.set_trace_callback(statements.append)
+            yield db
+            db.close()
+
+        assert QueryResult(connect, "SELECT id, score AS s FROM scores;").columns == ["id", "s"]
+        assert statements == ["SELECT * FROM (SELECT id, score AS s FROM scores) LIMIT 0"]
+        assert [len(batch) for batch in result.iter_batches()] == [10, 10, 5]
+        assert result.to_frame(["score"])["score"].tolist() == [i / 4 for i in range(25)]
+
+
+class TestResultCache:
+    @pytest.fixture
+    def engine_class(self):
+        return SQLiteDataEngine
+
+    @pytest.fixture
+    def engine(self, make_engine, engine_class):
+        engine = make_engine("cache.db", "shows", {"type": "TEXT", "score": "REAL"},
+                             [("MOVIE", 7.0), ("MOVIE", 9.0), ("SHOW", 8.0)], engine_class)
+        engine.enable_result_cache(max_entries=2)
+        return engine
+
+    def _query(self):
+        return SQLQueryBuilder("shows").select("type", ("AVG(score)", "avg_score")).group_by("type").order_by("type")
+
+    def test_hits_and_invalidation(self, engine):
+        first = engine.fetch(self._query())
+        second = engine.fetch(self._query())
+        engine.execute(SQLQueryBuilder("shows").update(score=10).where("type", "SHOW"))
+        third = engine.fetch(self._query())
+        info = engine.result_cache_info()
+        engine.close()
+
+        assert first == second == [("MOVIE", 8.0), ("SHOW", 8.0)]
+        assert third == [("MOVIE", 8.0), ("SHOW", 10.0)]
+        assert (info["hits"], info["misses"], info["invalidations"]) == (1, 2, 1)
+
+    def test_external_write_invalidates(self, tmp_path, engine):
+        engine.fetch(self._query())
+        other = sqlite3.connect(str(tmp_path / "cache.db"))
+        other.execute("DELETE FROM shows WHERE type = 'SHOW'")
+        other.commit()
+        other.close()
+        rows = engine.fetch(self._query())
+        engine.close()
+
+        assert rows == [("MOVIE", 8.0)]
+
+    def test_lru_eviction(self, engine):
+        for score in (7, 8, 9):
+            engine.fetch(SQLQueryBuilder("shows").select("type").where("score", score))
+        engine.fetch(SQLQueryBuilder("shows").select("type").where("score", 7))
+        info = engine.result_cache_info()
+        engine.close()
+
+        assert info["entries"] == 2 and info["evictions"] == 2 and info["hits"] == 0
+
+    @pytest.mark.parametrize("engine_class", [PooledSQLiteDataEngine])
+    def test_pooled_check_skips_write_lock(self, tmp_path, engine):
+        held, release, released = threading.Event(), threading.Event(), threading.Event()
+
+        def hold():
+            with engine._writing():
+                held.set()
+                release.wait(5)
+            released.set()
+
+        with ThreadPoolExecutor(1) as executor:
+            executor.submit(hold)
+            held.wait(5)
+            first = engine.fetch(self._query())
+            second = engine.fetch(self._query())
+            blocked = released.is_set()
+            release.set()
+        other = sqlite3.connect(str(tmp_path / "cache.db"))
+        other.execute("DELETE FROM shows WHERE type = 'SHOW'")
+        other.commit()
+        other.close()
+        third = engine.fetch(self._query())
+        info = engine.result_cache_info()
+        engine.close()
+
+        assert not blocked
+        assert first == second == [("MOVIE", 8.0), ("SHOW", 8.0)]
+        assert third == [("MOVIE", 8.0)]
+        assert info["hits"] == 1
+
+
+class TestIndexes:
+    @pytest.fixture
+    def engine(self, make_engine):
+        return make_engine("index.db", "shows", {"type": "TEXT", "release_year": "INTEGER", "score": "REAL"},
+                           [("MOVIE" if i % 2 else "SHOW", 1990 + i % 30, i % 10) for i in range(300)])
+
+    def test_create_and_list_indexes(self, engine):
+        engine.create_index("shows", ["type", "release_year"], include=["score"])
+        engine.create_index("shows", "score", name="good_scores", where="score >= 8")
+        indexes = {index["name"]: index for index in engine.list_indexes("shows")}
+        engine.drop_index("good_scores")
+        remaining = [index["name"] for index in engine.list_indexes()]
+        engine.close()
+
+        assert indexes["idx_shows_type_release_year_score"]["columns"] == ["type", "release_year", "score"]
+        assert indexes["good_scores"]["partial"] is True
+        assert remaining == ["idx_shows_type_release_year_score"]
+
+    def test_columns_used(self):
+        query = (SQLQueryBuilder("shows")
+                 .select("type", ("AVG(score)", "avg_score"))
+                 .where("type", "MOVIE")
+                 .and_("release_year", (">=", 2000))
+                 .group_by("type")
+                 .order_by("avg_score"))
+
+        assert query.columns_used() == {
+            "table": "shows",
+            "filters": [("", "type", "="), ("AND", "release_year", ">=")],
+            "group_by": ["type"],
+            "order_by": ["avg_score"],
+        }
+
+    def test_advisor_recommends_and_creates(self, engine):
+        advisor = engine.enable_index_advisor()
+        for year in (2000, 2005, 2010):
+            engine.fetch(SQLQueryBuilder("shows").select("score").where("type", "MOVIE").and_("release_year", (">=", year)))
+        engine.fetch(SQLQueryBuilder("shows").select("type", ("AVG(score)", "avg_score")).group_by("type").order_by("avg_score"))
+
+        advice = advisor.recommend()
+        names = advisor.apply()
+        plan = advisor.plan(*SQLQueryBuilder("shows").select("score").where("type", "MOVIE")
+                            .and_("release_year", (">=", 2000)).build(params=True))
+        engine.close()
+
+        assert [(item["columns"], item["count"]) for item in advice] == [(["type", "release_year"], 3), (["type"], 1)]
+        assert names == ["idx_shows_type_release_year", "idx_shows_type"]
+        assert plan[0].startswith("SEARCH shows USING INDEX idx_shows_type_release_year")
+
+    def test_advisor_on_views(self, engine):
+        engine.partition_table("shows", "release_year", ranges=[2000, 2010])
+        engine.create_encoded_table("labels", {"type": "TEXT", "score": "INTEGER"}, ["type"])
+        engine.execute("INSERT INTO labels SELECT type, score FROM shows")
+        engine.enable_index_advisor(auto_create=True)
+        assert engine.fetch(SQLQueryBuilder("shows").select(("COUNT(*)", "n")).where("score", 3)) == [(30,)]
+        assert engine.fetch(SQLQueryBuilder("labels").select(("COUNT(*)", "n")).where("score", 3)) == [(30,)]
+        names = {index["name"] for index in engine.list_indexes()}
+        engine.close()
+
+        assert {"idx_shows_score__p0", "idx_shows_score__p2", "idx_labels_score"} <= names
+
+
+class TestAsyncEngine:
+    def test_import_fetch_and_stream(self, tmp_path):
+        csv_path = tmp_path / "scores.csv"
+        pd.DataFrame({"id": range(50), "score": [i % 5 for i in range(50)]}).to_csv(csv_path, index=False)
+
+        async def run():
+            async with AsyncSQLiteDataEngine(str(tmp_path / "async.db"), pool_size=2) as engine:
+                table = await engine.import_csv(str(csv_path))
+                changed = await engine.execute(SQLQueryBuilder(table).update(score=9).where("id", ("<", 10)))
+                counts = await asyncio.gather(*[
+                    engine.fetch(SQLQueryBuilder(table).select(("COUNT(*)", "n")).where("score", score))
+                    for score in range(10)
+                ])
+                batches = [len(batch) async for batch in engine.stream(f"SELECT * FROM {table}", batch_size=20)]
+                return changed, counts, batches, engine.pool_metrics()
+
+        changed, counts, batches, metrics = asyncio.run(run())
+
+        assert changed == 10
+        assert [c[0][0] for c in counts] == [8, 8, 8, 8, 8, 0, 0, 0, 0, 10]
+        assert batches == [20, 20, 10]
+        assert metrics["in_use"] == 0
+
+    def test_cancel_interrupts_query(self, tmp_path):
+        endless = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+
+        async def run():
+            async with AsyncSQLiteDataEngine(str(tmp_path / "async.db"), pool_size=1) as engine:
+                task = asyncio.ensure_future(engine.fetch(endless))
+                await asyncio.sleep(0.2)
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+                # the interrupted connection went back to the pool and is usable again
+                return await engine.fetch("SELECT 1")
+
+        assert asyncio.run(asyncio.wait_for(run(), timeout=10)) == [(1,)]
+
+    def test_cancel_stream(self, tmp_path):
+        endless = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+
+        async def consume(engine):
+            async for _ in engine.stream(endless):
+                pass
+
+        async def run():
+            async with AsyncSQLiteDataEngine(str(tmp_path / "async.db"), pool_size=1) as engine:
+                task = asyncio.ensure_future(consume(engine))
+                await asyncio.sleep(0.2)
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+                return engine.pool_metrics()["in_use"], await engine.fetch("SELECT 2")
+
+        assert asyncio.run(asyncio.wait_for(run(), timeout=10)) == (0, [(2,)])
+
+    def test_stream_is_traced_and_guarded(self, tmp_path):
+        endless = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+        events = []
+
+        async def run():
+            async with AsyncSQLiteDataEngine(str(tmp_path / "async.db"), pool_size=1) as engine:
+                engine.engine.add_query_hook(events.append, plan=True)
+                batches = [batch async for batch in engine.stream("SELECT 1 UNION ALL SELECT 2", batch_size=1)]
+                engine.engine.enable_query_guard(max_seconds=0.05)
+                with pytest.raises(QueryBudgetExceeded):
+                    async for _ in engine.stream(endless):
+                        pass
+                return batches, engine.pool_metrics()["in_use"]
+
+        batches, in_use = asyncio.run(asyncio.wait_for(run(), timeout=10))
+
+        assert batches == [[(1,)], [(2,)]] and in_use == 0
+        assert [(event.rows, event.error is None) for event in events] == [(2, True), (None, False)]
+        assert events[0].plan
+
+
+class TestImportMany:
+    def test_import_directory(self, tmp_path):
+        data = tmp_path / "nightly"
+        data.mkdir()
+        for day in range(4):
+            pd.DataFrame({"id": range(day + 1), "score": [1.5] * (day + 1)}).to_csv(data / f"day {day}.csv", index=False)
+        (data / "notes.txt").write_text("not a csv")
+
+        engine = SQLiteDataEngine(str(tmp_path / "many.db"))
+        report = engine.import_directory(str(data), processes=2, commit_rows=3)
+        counts = {table: engine.fetch(f'SELECT COUNT(*) FROM "{table}"')[0][0] for table in engine.list_tables()}
+        schema = engine.get_schema("day_2")
+        engine.close()
+
+        assert sorted(item["table"] for item in report) == ["day_0", "day_1", "day_2", "day_3"]
+        assert {item["table"]: item["rows"] for item in report} == {"day_0": 1, "day_1": 2, "day_2": 3, "day_3": 4}
+        assert counts == {"day_0": 1, "day_1": 2, "day_2": 3, "day_3": 4}
+        assert schema == {"id": "INTEGER", "score": "REAL"}
+        assert all(item["parse_seconds"] >= 0 and item["write_seconds"] >= 0 for item in report)
+
+    def test_batches_and_failed_files(self, tmp_path):
+        pd.DataFrame({"id": range(25), "score": [0.5] * 25}).to_csv(tmp_path / "good.csv", index=False)
+        (tmp_path / "broken.csv").write_text("")
+        engine = SQLiteDataEngine(str(tmp_path / "many.db"))
+        report = engine.import_many([str(tmp_path / "good.csv")], processes=1, batch_rows=4, queue_batches=1)
+        assert report[0]["rows"] == 25 and engine.fetch('SELECT COUNT(*) FROM "good"') == [(25,)]
+
+        engine.execute('DROP TABLE "good"')
+        engine.schemas.pop("good")
+        files = [str(tmp_path / "good.csv"), str(tmp_path / "broken.csv")]
+        with pytest.raises(pd.errors.EmptyDataError):
+            engine.import_many(files, processes=2, batch_rows=4)
+        assert "good" not in engine.list_tables() and "good" not in engine.schemas
+
+        with pytest.raises(pd.errors.EmptyDataError):
+            engine.import_many(files, processes=2, commit_rows=1, batch_rows=4)
+        assert engine.fetch('SELECT COUNT(*) FROM "good"') == [(25,)] and "good" in engine.schemas
+        engine.close()
+
+    def test_keeps_recorded_encoding(self, tmp_path):
+        csv_path = tmp_path / "titles.csv"
+        pd.DataFrame({"type": ["MOVIE", "SHOW"] * 20, "year": range(40)}).to_csv(csv_path, index=False)
+        engine = SQLiteDataEngine(str(tmp_path / "many.db"))
+        engine.import_csv(str(csv_path), encode=True)
+        engine.import_many([str(csv_path)], processes=1, batch_rows=7)
+        layout = engine.encoded.get("titles")
+        kind = engine.fetch("SELECT type FROM sqlite_master WHERE name = 'titles'")
+        rows = engine.fetch('SELECT type, COUNT(*) FROM "titles" GROUP BY type')
+        engine.close()
+
+        assert layout == (["type", "year"], {"type"})
+        assert kind == [("view",)]
+        assert rows == [("MOVIE", 20), ("SHOW", 20)]
+
+
+class TestInsert:
+    def test_insert_builds(self):
+        query = SQLQueryBuilder("shows").insert(title="It's", release_year=1995, rating=None)
+
+        assert query.build() == 'INSERT INTO shows ("title", "release_year", "rating") VALUES (\'It\'\'s\', 1995, NULL);'
+        assert query.build(params=True) == (
+            'INSERT INTO shows ("title", "release_year", "rating") VALUES (?, ?, ?);', ("It's", 1995, None))
+
+    def test_insert_many_and_upsert_build(self):
+        assert SQLQueryBuilder("shows").insert_many("id", "title").build() == \
+            'INSERT INTO shows ("id", "title") VALUES (?, ?);'
+        assert SQLQueryBuilder("shows").upsert("id", "title", "score", key="id").build() == \
+            'INSERT INTO shows ("id", "title", "score") VALUES (?, ?, ?) ON CONFLICT ("id") DO UPDATE SET "title" = excluded."title", "score" = excluded."score";'
+        assert SQLQueryBuilder("shows").upsert(key="id", update=[], id=1, title="Heat").build(params=True) == \
+            ('INSERT INTO shows ("id", "title") VALUES (?, ?) ON CONFLICT ("id") DO NOTHING;', (1, "Heat"))
+
+    def test_executemany(self, tmp_path):
+        engine = SQLiteDataEngine(str(tmp_path / "insert.db"))
+        engine.create_table("shows", {"id": "INTEGER PRIMARY KEY", "title": "TEXT", "score": "REAL"})
+        written = engine.executemany(SQLQueryBuilder("shows").insert_many("id", "title", "score"),
+                                     ((i, f"t{i}", i / 2) for i in range(25)), batch_size=10)
+        engine.executemany(SQLQueryBuilder("shows").upsert("id", "score", key="id"),
+                           [{"id": 1, "score": 99.0}, {"id": 100, "score": 1.0}])
+        engine.executemany(SQLQueryBuilder("shows").insert_many("id", "title"),
+                           pd.DataFrame({"title": ["x", "y"], "id": [200, 201], "extra": [0, 0]}))
+        engine.execute(SQLQueryBuilder("shows").insert(id=300, title="single"))
+        rows = engine.fetch("SELECT id, title, score FROM shows WHERE id IN (1, 100, 200, 201, 300) ORDER BY id")
+        total = engine.fetch("SELECT COUNT(*) FROM shows")
+        engine.close()
+
+        assert written == 25
+        assert rows == [(1, "t1", 99.0), (100, None, 1.0), (200, "x", None), (201, "y", None), (300, "single", None)]
+        assert total == [(29,)]
+
+
+class TestTuningProfiles:
+    def _pragmas(self, engine):
+        return {name: engine.conn.execute(f"PRAGMA {name}").fetchone()[0]
+                for name in ("journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store")}
+
+    def test_profile_at_connect(self, tmp_path):
+        engine = SQLiteDataEngine(str(tmp_path / "tuned.db"), profile="read-heavy")
+        pragmas = self._pragmas(engine)
+        page_size = engine.conn.execute("PRAGMA page_size").fetchone()[0]
+        engine.close()
+
+        assert pragmas == {"journal_mode": "wal", "synchronous": 1, "cache_size": -131072,
+                           "mmap_size": 1 << 30, "temp_store": 2}
+        assert page_size == 8192
+
+    def test_import_restores_profile(self, tmp_path):
+        csv_path = tmp_path / "events.csv"
+        pd.DataFrame({"n": range(100)}).to_csv(csv_path, index=False)
+        engine = SQLiteDataEngine(str(tmp_path / "tuned.db"), profile="durable")
+        before = self._pragmas(engine)
+        with engine.tuned("bulk-load"):
+            during = self._pragmas(engine)
+        engine.import_csv(str(csv_path), profile="bulk-load")
+        after = self._pragmas(engine)
+        count = engine.fetch("SELECT COUNT(*) FROM events")
+        engine.close()
+
+        assert during["journal_mode"] == "memory" and during["synchronous"] == 0
+        assert before == after and after["journal_mode"] == "wal"
+        assert count == [(100,)]
+
+    def test_unknown_profile(self, tmp_path):
+        with pytest.raises(ValueError):
+            SQLiteDataEngine(str(tmp_path / "tuned.db"), profile="turbo")
+
+
+class TestIncrementalImport:
+    def test_skip_append_and_reload(self, tmp_path):
+        csv_path = tmp_path / "log.csv"
+        csv_path.write_text("id,event\n1,start\n2,run\n")
+        engine = SQLiteDataEngine(str(tmp_path / "incremental.db"))
+
+        engine.import_csv(str(csv_path), incremental=True)
+        first = engine.import_metadata(str(csv_path))
+        engine.cursor.execute("UPDATE log SET event = 'kept' WHERE id = 1")
+        engine.conn.commit()
+
+        engine.import_csv(str(csv_path), incremental=True)
+        unchanged = engine.fetch("SELECT event FROM log WHERE id = 1")
+
+        with open(csv_path, "a") as f:
+            f.write("3,stop\n4,exit\n")
+        engine.import_csv(str(csv_path), incremental=True)
+        appended = engine.fetch("SELECT id, event FROM log ORDER BY id")
+        second = engine.import_metadata(str(csv_path))
+        appended_size = os.path.getsize(csv_path)
+
+        csv_path.write_text("id,event\n9,rewritten\n")
+        engine.import_csv(str(csv_path), incremental=True)
+        reloaded = engine.fetch("SELECT id, event FROM log")
+        tables = engine.list_tables()
+        engine.close()
+
+        assert (first["rows_ingested"], first["columns"]) == (2, ["id", "event"])
+        assert unchanged == [("kept",)]
+        assert appended == [(1, "kept"), (2, "run"), (3, "stop"), (4, "exit")]
+        assert second["rows_ingested"] == 4 and second["bytes_ingested"] == appended_size
+        assert reloaded == [(9, "rewritten")]
+        assert tables == ["log"]
+
+    def test_append_in_chunks(self, tmp_path):
+        csv_path = tmp_path / "log.csv"
+        csv_path.write_text("id,event\n1,start\n")
+        engine = SQLiteDataEngine(str(tmp_path / "incremental.db"))
+        engine.import_csv(str(csv_path), incremental=True)
+        with open(csv_path, "a") as f:
+            f.write("".join(f"{i},run\n" for i in range(2, 9)))
+        progress = []
+        engine.import_csv(str(csv_path), chunksize=3, progress=lambda done, rate: progress.append(done),
+                          incremental=True)
+        rows = engine.fetch("SELECT COUNT(*), MAX(id) FROM log")
+        meta = engine.import_metadata(str(csv_path))
+        engine.close()
+
+        assert progress == [4, 7, 8]
+        assert rows == [(8, 8)] and meta["rows_ingested"] == 8
+
+
+class TestColumnarFetch:
+    def test_fetch_columns_typed(self, tmp_path):
+        engine = SQLiteDataEngine(str(tmp_path / "columns.db"))
+        engine.create_table("shows", {"id": "INTEGER", "votes": "INTEGER", "score": "REAL", "title": "TEXT"})
+        engine.cursor.executemany("INSERT INTO shows VALUES (?, ?, ?, ?)",
+                                  [(i, None if i == 3 else i * 10, i / 2, f"t{i}") for i in range(10)])
+        engine.conn.commit()
+        columns = engine.fetch_columns(SQLQueryBuilder("shows").select("id", "votes", "score", "title"), batch_size=4)
+        df = engine.fetch_df(SQLQueryBuilder("shows").select("title", ("COUNT(*)", "n")).group_by("title"), batch_size=3)
+        engine.close()
+
+        assert columns["id"].dtype == np.int64 and columns["id"].tolist() == list(range(10))
+        assert columns["votes"].dtype == np.float64 and np.isnan(columns["votes"][3])
+        assert columns["score"].dtype == np.float64 and columns["score"][9] == 4.5
+        assert columns["title"].dtype == object and columns["title"][0] == "t0"
+        assert df["n"].dtype == np.int64 and df["n"].sum() == 10 and len(df) == 10
+
+
+class TestKeysetPagination:
+    def test_paginate_rowid_with_filters(self, tmp_path):
+        engine = SQLiteDataEngine(str(tmp_path / "pages.db"))
+        engine.create_table("shows", {"title": "TEXT", "type": "TEXT", "year": "INTEGER"})
+        engine.cursor.executemany("INSERT INTO shows VALUES (?, ?, ?)",
+                                  [(f"t{i}", "MOVIE" if i % 3 else "SHOW", 2000 + i % 5) for i in range(100)])
+        engine.conn.commit()
+        query = SQLQueryBuilder("shows").select("title").where("type", "MOVIE").or_("year", 2004)
+        pages = list(query.paginate(engine, page_size=10))
+        expected = engine.fetch("SELECT title FROM shows WHERE type = 'MOVIE' OR year = 2004 ORDER BY rowid")
+        engine.close()
+
+        assert all(len(page) <= 10 for page in pages)
+        assert [row for page in pages for row in page] == expected
+        assert len(pages) == -(-len(expected) // 10)
+
+    def test_page_composite_key(self, tmp_path):
+        engine = SQLiteDataEngine(str(tmp_path / "pages.db"))
+        engine.create_table("shows", {"title": "TEXT", "year": "INTEGER"})
+        engine.cursor.executemany("INSERT INTO shows VALUES (?, ?)", [(f"t{i}", 2000 + i % 4) for i in range(23)])
+        engine.conn.commit()
+        query = SQLQueryBuilder("shows").select("title", "year")
+        sql, params = query.page(5, key=("year", "rowid"), after=(2001, 9))
+        rows = [row for page in query.paginate(engine.conn, 4, key=("year", "rowid"), desc=True) for row in page]
+        engine.close()
+
+        assert sql == "SELECT year, rowid, title, year FROM shows WHERE (year, rowid) > (?, ?) ORDER BY year ASC, rowid ASC LIMIT 5;"
+        assert params == (2001, 9)
+        assert len(rows) == 23 and [r[1] for r in rows] == sorted((r[1] for r in rows), reverse=True)
+
+    def test_page_rejects_non_select(self):
+        with pytest.raises(ValueError):
+            SQLQueryBuilder("shows").delete().page(10)
+        for query in (SQLQueryBuilder("shows").select("title").order_by("year"),
+                      SQLQueryBuilder("shows").select("title").limit(5),
+                      SQLQueryBuilder("shows").select("title").having_exists("SELECT 1")):
+            with pytest.raises(ValueError):
+                query.page(10)
+
+
+class TestInstrumentation:
+    def test_builder_is_silent(self, capsys):
+        SQLQueryBuilder("shows").select("index", "title").where("type", "MOVIE").update(title="x").build()
+        assert capsys.readouterr().out == ""
+
+    def test_query_hooks(self, tmp_path):
+        engine = SQLiteDataEngine(str(tmp_path / "hooks.db"))
+        engine.create_table("shows", {"title": "TEXT", "year": "INTEGER"})
+        events, planned = [], []
+        engine.add_query_hook(events.append)
+        engine.add_query_hook(planned.append, plan=True)
+        engine.executemany(SQLQueryBuilder("shows").insert_many("title", "year"), [("a", 2000), ("b", 2001)])
+        rows = engine.fetch(SQLQueryBuilder("shows").select("title").where("year", 2001))
+        engine.remove_query_hook(events.append)
+        engine.execute("UPDATE shows SET year = 1999")
+        engine.close()
+
+        assert rows == [("b",)]
+        assert [event.rows for event in events] == [2, 1]
+        select = events[1]
+        assert select.sql == "SELECT title FROM shows WHERE year = ?;" and select.params == (2001,)
+        assert select.build_s > 0 and select.exec_s > 0
+        assert "SCAN shows" in planned[1].plan and planned[0].plan is None
+        assert planned[2].rows == 2 and len(planned) == 3
+
+    def test_failing_query_and_hook(self, tmp_path):
+        engine = SQLiteDataEngine(str(tmp_path / "hooks.db"))
+        events = []
+        engine.add_query_hook(events.append)
+        engine.add_query_hook(lambda event: 1 / 0)
+        with pytest.raises(sqlite3.OperationalError):
+            engine.fetch("SELECT * FROM missing")
+        assert engine.fetch("SELECT 1") == [(1,)]
+        engine.close()
+        assert isinstance(events[0].error, sqlite3.OperationalError) and events[1].rows == 1
+
+    def test_debug_log(self, tmp_path, caplog):
+        engine = SQLiteDataEngine(str(tmp_path / "hooks.db"))
+        with caplog.at_level(logging.DEBUG, logger="simplesqlengine"):
+            engine.fetch("SELECT 1")
+        engine.close()
+        assert any("SELECT 1" in record.getMessage() for record in caplog.records)
+
+
+class TestIdentifierQuoting:
+    def test_dialects(self):
+        assert check_reserved_word("index") == '"index"'
+        assert check_reserved_word("COUNT(index)") == 'COUNT("index")'
+        assert check_reserved_word(["title", "order"]) == ("title", '"order"')
+        assert check_reserved_word("key", "mysql") == "`key`"
+        assert check_reserved_word("key", "postgresql") == "key"
+        assert check_reserved_word("user", "postgresql") == '"user"'
+
+    def test_builder_uses_db_type(self):
+        sql = SQLQueryBuilder("shows", db_type="mysql").select("key", "title").where("rank", 3).build()
+        assert sql == "SELECT `key`, title FROM shows WHERE `rank` = 3;"
+        mysql = lambda: SQLQueryBuilder("shows", db_type="mysql").select("title")
+        assert mysql().between_("key", 1, 5).build(params=True) == ("SELECT title FROM shows WHERE `key` BETWEEN ? AND ?;", (1, 5))
+        assert mysql().not_between_("key", 1, 5).build() == "SELECT title FROM shows WHERE `key` NOT BETWEEN 1 AND 5;"
+        assert mysql().like_("key", "H%").build(params=True) == ("SELECT title FROM shows WHERE `key` LIKE ?;", ("H%",))
+        assert SQLQueryBuilder("shows", db_type="mysql").update(key=2).build() == "UPDATE shows SET `key` = 2;"
+        assert SQLQueryBuilder("shows", db_type="mysql").insert(key=2).build() == "INSERT INTO shows (`key`) VALUES (2);"
+
+    def test_values_are_not_memoized(self):
+        check_reserved_word("year")
+        cached = quote_identifier.cache_info().currsize
+        SQLQueryBuilder("shows").select("title").between_("year", "'2001-01-01'", "'2001-12-31'").build()
+        assert quote_identifier.cache_info().currsize == cached
+
+    def test_memoized(self):
+        check_reserved_word("release_year")
+        hits = quote_identifier.cache_info().hits
+        check_reserved_word("release_year")
+        assert quote_identifier.cache_info().hits == hits + 1
+
+
+class TestDownsampledPlot:
+    @staticmethod
+    def _series(tmp_path, n=5000):
+        path = str(tmp_path / "series.db")
+        engine = SQLiteDataEngine(path)
+        engine.create_table("ts", {"t": "INTEGER", "v": "REAL"})
+        engine.cursor.executemany("INSERT INTO ts VALUES (?, ?)",
+                                  [(i, 100.0 if i == 1234 else float(i % 50)) for i in range(n)])
+        engine.conn.commit()
+        engine.close()
+        return path
+
+    def test_lttb_keeps_ends_and_peaks(self):
+        x = np.arange(10_000)
+        y = np.zeros(10_000)
+        y[4321] = 9.0
+        picked = _lttb(x, y, 100)
+        assert len(picked) == 100 and picked[0] == 0 and picked[-1] == 9999
+        assert 4321 in picked and (np.diff(picked) > 0).all()
+
+    def test_builder_buckets_in_sql(self, tmp_path, monkeypatch):
+        path = self._series(tmp_path)
+        monkeypatch.chdir(tmp_path)
+        out = DataOutput(path, SQLQueryBuilder("ts").select("t", "v").where("t", (">=", 1000)), "series")
+        df = out.downsample(max_points=100)
+        assert list(df.columns) == ["t", "v", "v_min", "v_max"]
+        assert len(df) == 100 and df["t"].iloc[0] == 1000
+        assert df["v_max"].max() == 100.0 and df["v_min"].min() == 0.0
+
+    def test_sql_string_uses_lttb(self, tmp_path, monkeypatch):
+        path = self._series(tmp_path)
+        monkeypatch.chdir(tmp_path)
+        df = DataOutput(path, "SELECT t, v FROM ts", "series").downsample(max_points=50)
+        small = DataOutput(path, "SELECT t, v FROM ts WHERE t < 20", "small").downsample(max_points=50)
+        assert list(df.columns) == ["t", "v"] and len(df) == 50 and 100.0 in df["v"].tolist()
+        assert len(small) == 20
+
+
+class TestInMemoryEngine:
+    @staticmethod
+    def _database(tmp_path):
+        path = str(tmp_path / "disk.db")
+        engine = SQLiteDataEngine(path)
+        engine.create_table("shows", {"title": "TEXT", "year": "INTEGER"})
+        engine.create_table("people", {"name": "TEXT"})
+        engine.cursor.executemany("INSERT INTO shows VALUES (?, ?)", [(f"t{i}", 2000 + i) for i in range(100)])
+        engine.cursor.execute("CREATE INDEX idx_year ON shows (year)")
+        engine.conn.commit()
+        engine.close()
+        return path
+
+    def test_load_and_snapshot_on_close(self, tmp_path):
+        path = self._database(tmp_path)
+        engine = InMemorySQLiteDataEngine(path)
+        assert engine.fetch("SELECT COUNT(*) FROM shows") == [(100,)]
+        assert engine.snapshot() is False
+        engine.execute("DELETE FROM shows WHERE year >= 2050")
+        with sqlite3.connect(path) as disk:
+            assert disk.execute("SELECT COUNT(*) FROM shows").fetchone() == (100,)
+        engine.close()
+        with sqlite3.connect(path) as disk:
+            assert disk.execute("SELECT COUNT(*) FROM shows").fetchone() == (50,)
+        assert engine.snapshots == 1 and engine.load_seconds > 0
+
+    def test_selected_tables(self, tmp_path):
+        path = self._database(tmp_path)
+        engine = InMemorySQLiteDataEngine(path, tables=["shows"])
+        assert engine.list_tables() == ["shows"]
+        assert "idx_year" in [index["name"] for index in engine.list_indexes("shows")]
+        engine.cursor.execute("UPDATE shows SET year = 1999 WHERE title = 't0'")
+        engine.create_table_from_df("scores", pd.DataFrame({"score": [1.5, 2.5]}))
+        engine.cursor.execute("INSERT INTO scores VALUES (3.5)")
+        engine.close()
+        with sqlite3.connect(path) as disk:
+            assert disk.execute("SELECT year FROM shows WHERE title = 't0'").fetchone() == (1999,)
+            assert disk.execute("SELECT COUNT(*) FROM shows").fetchone() == (100,)
+            assert disk.execute("SELECT COUNT(*) FROM scores").fetchone() == (1,)
+            assert disk.execute("SELECT COUNT(*) FROM people").fetchone() == (0,)
+        with pytest.raises(ValueError):
+            InMemorySQLiteDataEngine(path, tables=["missing"])
+
+    def test_schema_changes_and_other_writers(self, tmp_path):
+        path = self._database(tmp_path)
+        engine = InMemorySQLiteDataEngine(path)
+        engine.create_index("people", "name")
+        engine.execute("CREATE TABLE extra (x)")
+        engine.close()
+        with sqlite3.connect(path) as disk:
+            names = {row[0] for row in disk.execute("SELECT name FROM sqlite_master")}
+        assert {"idx_people_name", "extra"} <= names
+
+        engine = InMemorySQLiteDataEngine(path)
+        engine.execute("DELETE FROM shows")
+        with sqlite3.connect(path) as disk:
+            disk.execute("INSERT INTO people VALUES ('bob')")
+        assert engine.snapshot() is False
+        engine.close()
+        with sqlite3.connect(path) as disk:
+            assert disk.execute("SELECT COUNT(*) FROM shows").fetchone() == (100,)
+            assert disk.execute("SELECT name FROM people").fetchall() == [("bob",)]
+        engine = InMemorySQLiteDataEngine(path)
+        engine.execute("DELETE FROM people")
+        engine.close()
+        with sqlite3.connect(path) as disk:
+            assert disk.execute("SELECT COUNT(*) FROM people").fetchone() == (0,)
+
+    def test_memory_cap_and_periodic_snapshot(self, tmp_path):
+        path = self._database(tmp_path)
+        with pytest.raises(ValueError):
+            InMemorySQLiteDataEngine(path, max_memory=1024)
+        engine = InMemorySQLiteDataEngine(path, max_memory=64 * 4096, snapshot_interval=0.05)
+        with pytest.raises(sqlite3.OperationalError):
+            engine.execute("INSERT INTO people SELECT hex(randomblob(1000)) FROM shows, shows")
+        engine.execute("INSERT INTO people VALUES ('ann')")
+        for _ in range(100):
+            if engine.snapshots:
+                break
+            sleep(0.05)
+        with sqlite3.connect(path) as disk:
+            assert disk.execute("SELECT name FROM people").fetchall() == [("ann",)]
+        assert engine.memory_info()["bytes"] <= 64 * 4096
+        engine.close()
+
+
+class TestTextIndex:
+    @pytest.fixture
+    def engine(self, make_engine):
+        return make_engine("text.db", "shows", {"title": "TEXT", "description": "TEXT", "year": "INTEGER"}, [
+            ("Heat", "a crew of bank robbers", 1995),
+            ("Heist", "one last job", 2001),
+            ("Up", "a house carried by balloons", 2009),
+        ])
+
+    def test_match_builds(self):
+        query = SQLQueryBuilder("shows").select("title").where("year", 1995).match_("description", "bank")
+        assert query.build() == ("SELECT title FROM shows WHERE year = 1995 AND rowid IN "
+                                 "(SELECT rowid FROM \"shows_fts\" WHERE \"description\" MATCH 'bank');")
+        assert query.build(params=True) == ("SELECT title FROM shows WHERE year = ? AND rowid IN "
+                                            "(SELECT rowid FROM \"shows_fts\" WHERE \"description\" MATCH ?);",
+                                            (1995, "bank"))
+
+    def test_match_and_sync(self, engine):
+        engine.create_text_index("shows", ["title", "description"])
+        search = lambda col, text: sorted(engine.fetch(SQLQueryBuilder("shows").select("title").match_(col, text)))
+        assert search("description", "bank") == [("Heat",)]
+        assert search(None, "he*") == [("Heat",), ("Heist",)]
+        engine.execute("INSERT INTO shows VALUES ('Bank Job', 'a tunnel', 2008)")
+        engine.execute("UPDATE shows SET description = 'a bank vault' WHERE title = 'Heist'")
+        engine.execute("DELETE FROM shows WHERE title = 'Heat'")
+        assert search("description", "bank") == [("Heist",)]
+        assert search(None, "bank") == [("Bank Job",), ("Heist",)]
+        assert engine.list_tables() == ["shows"]
+        assert engine.text_index_info("shows")["columns"] == ["title", "description"]
+        engine.drop_text_index("shows")
+        assert engine.text_index_info("shows") is None
+        engine.close()
+
+    def test_trigram_substring(self, engine):
+        engine.create_text_index("shows", "description", tokenizer="trigram")
+        rows = engine.fetch(SQLQueryBuilder("shows").select("title").match_("description", "ball"))
+        engine.close()
+        assert rows == [("Up",)]
+
+    def test_import_keeps_index(self, tmp_path):
+        path = tmp_path / "shows.csv"
+        pd.DataFrame({"title": ["Heat", "Up"], "description": ["bank crew", "balloons"]}).to_csv(path, index=False)
+        engine = SQLiteDataEngine(str(tmp_path / "text.db"))
+        engine.import_csv(str(path), "shows", text_index=["description"])
+        pd.DataFrame({"title": ["Heist"], "description": ["bank job"]}).to_csv(path, index=False)
+        engine.import_csv(str(path), "shows")
+        rows = engine.fetch(SQLQueryBuilder("shows").select("title").match_("description", "bank"))
+        engine.close()
+        assert rows == [("Heist",)]
+
+
+class TestDictionaryEncoding:
+    @staticmethod
+    def _csv(tmp_path, rows=200):
+        path = tmp_path / "titles.csv"
+        pd.DataFrame({
+            "title": [f"title {i}" for i in range(rows)],
+            "type": ["MOVIE" if i % 3 else "SHOW" for i in range(rows)],
+            "genre": [None if i % 10 == 0 else ["drama", "comedy"][i % 2] for i in range(rows)],
+            "score": [i % 7 + 0.5 for i in range(rows)],
+        }).to_csv(path, index=False)
+        return str(path)
+
+    def test_low_cardinality_columns(self):
+        df = pd.DataFrame({"a": ["x", "y"] * 50, "b": [str(i) + "z" for i in range(100)], "c": range(100)})
+        schema = infer_schema(df)
+        assert low_cardinality_columns(df, schema) == ["a"]
+        assert low_cardinality_columns(df, schema, threshold=1.0) == ["a", "b"]
+
+    def test_encoded_import_reads_like_a_table(self, tmp_path):
+        path = self._csv(tmp_path)
+        plain = SQLiteDataEngine(str(tmp_path / "plain.db"))
+        plain.import_csv(path, "titles")
+        engine = SQLiteDataEngine(str(tmp_path / "encoded.db"))
+        engine.import_csv(path, "titles", encode=True)
+        assert engine.encoded["titles"][1] == {"type", "genre"}
+        assert engine.list_tables() == ["titles"]
+        assert list(engine.get_schema("titles")) == ["title", "type", "genre", "score"]
+        queries = [
+            SQLQueryBuilder("titles").select("*"),
+            SQLQueryBuilder("titles").select("type", ("COUNT(*)", "n")).group_by("type"),
+            SQLQueryBuilder("titles").select("genre", "type", ("AVG(score)", "s")).where("type", "SHOW")
+            .group_by("genre", "type").order_by("genre"),
+            SQLQueryBuilder("titles").select("title").where("genre", "drama").and_("score", (">", 3)),
+        ]
+        for query in queries:
+            assert sorted(engine.fetch(query), key=str) == sorted(plain.fetch(query), key=str)
+        assert "GROUP BY \"type__code\"" in engine._compile(queries[1])[0]
+        plain.close()
+        engine.close()
+
+    def test_inserts_and_reimport(self, tmp_path):
+        path = self._csv(tmp_path, rows=50)
+        engine = SQLiteDataEngine(str(tmp_path / "encoded.db"))
+        engine.import_csv(path, "titles", chunksize=20, encode=["type"])
+        engine.enable_result_cache()
+        count = SQLQueryBuilder("titles").select("type", ("COUNT(*)", "n")).group_by("type").order_by("type")
+        assert engine.fetch(count) == [("MOVIE", 33), ("SHOW", 17)]
+        engine.execute("INSERT INTO titles (title, type, genre, score) VALUES ('new', 'SPECIAL', 'drama', 1.0)")
+        assert engine.fetch(count) == [("MOVIE", 33), ("SHOW", 17), ("SPECIAL", 1)]
+        engine.execute(SQLQueryBuilder("titles").update(type="DOC").where("title", "new"))
+        engine.execute(SQLQueryBuilder("titles").delete().where("type", "SHOW").and_("score", ("<", 3)))
+        assert engine.fetch(count) == [("DOC", 1), ("MOVIE", 33), ("SHOW", 10)]
+        assert engine.fetch('SELECT COUNT(*) FROM "titles__data"') == [(44,)]
+        # builder writes run on the data table, the new values computed over the decoded rows
+        scores = engine.fetch(SQLQueryBuilder("titles").select("SUM(score)").where("type", "SHOW"))[0][0]
+        changed = engine.execute(SQLQueryBuilder("titles").update(type="TV", score='"score" * 2').where("type", "SHOW"))
+        assert changed.rowcount == 10
+        assert engine.fetch(SQLQueryBuilder("titles").select("SUM(score)").where("type", "TV")) == [(scores * 2,)]
+        assert engine.fetch(count) == [("DOC", 1), ("MOVIE", 33), ("TV", 10)]
+        engine.execute(SQLQueryBuilder("titles").update(type="SHOW", score='"score" / 2').where("type", "TV"))
+        with pytest.raises(ValueError):
+            next(SQLQueryBuilder("titles").select("title").paginate(engine, page_size=10))
+        with pytest.raises(ValueError):
+            next(SQLQueryBuilder("titles").select("title").paginate(engine.conn, page_size=100, key="genre", desc=True))
+        pages = list(SQLQueryBuilder("titles").select("title").paginate(engine, page_size=10, key="title"))
+        assert sum(len(rows) for rows in pages) == 44
+        engine.import_csv(path, "titles")
+        assert engine.fetch(count) == [("MOVIE", 33), ("SHOW", 17)]
+        with pytest.raises(ValueError):
+            engine.create_text_index("titles", "title")
+        engine.close()
+
+        reopened = SQLiteDataEngine(str(tmp_path / "encoded.db"))
+        assert reopened.encoded["titles"][1] == {"type"}
+        reopened.import_csv(path, "titles", encode=False)
+        assert reopened.encoded == {}
+        assert reopened.list_tables() == ["titles"]
+        reopened.close()
+
+
+class TestPartitioning:
+    @staticmethod
+    def _csv(tmp_path, rows=120):
+        path = tmp_path / "titles.csv"
+        pd.DataFrame({
+            "title": [f"title {i}" for i in range(rows)],
+            "type": ["MOVIE" if i % 3 else "SHOW" for i in range(rows)],
+            "release_year": [None if i == 0 else 1990 + i % 30 for i in range(rows)],
+        }).to_csv(path, index=False)
+        return str(path)
+
+    def test_prune(self):
+        years = Partitioning("titles", "release_year", "range", [2000, 2010])
+        where = lambda query: years.prune(query._predicates)
+        assert where(SQLQueryBuilder("titles").where("release_year", 2005)) == {1}
+        assert where(SQLQueryBuilder("titles").where("release_year", (">=", 2010))) == {2}
+        assert where(SQLQueryBuilder("titles").where("release_year", ("<", 2000)).and_("type", "MOVIE")) == {0}
+        assert where(SQLQueryBuilder("titles").where("type", "MOVIE").between_("release_year", 1995, 2000)) == {0, 1}
+        assert where(SQLQueryBuilder("titles").where("release_year", None)) == {0}
+        assert where(SQLQueryBuilder("titles").where("release_year", 1995).or_("release_year", 2015)) == {0, 1, 2}
+        types = Partitioning("titles", "type", "list", ["MOVIE", "SHOW"])
+        assert types.prune(SQLQueryBuilder("titles").where("type", "SHOW")._predicates) == {1}
+        assert types.prune(SQLQueryBuilder("titles").where("type", "OTHER")._predicates) == {2}
+        assert list(types.assign(pd.Series(["SHOW", None, "X", "MOVIE"]))) == [1, 2, 2, 0]
+        with pytest.raises(ValueError):
+            Partitioning("titles", "release_year", "range", [2010, 2000])
+
+    def test_partition_existing_table(self, tmp_path):
+        path = self._csv(tmp_path)
+        plain = SQLiteDataEngine(str(tmp_path / "plain.db"))
+        plain.import_csv(path, "titles")
+        engine = SQLiteDataEngine(str(tmp_path / "parts.db"))
+        engine.import_csv(path, "titles")
+        children = engine.partition_table("titles", "release_year", ranges=[2000, 2010])
+        assert children == ["titles__p0", "titles__p1", "titles__p2"]
+        assert engine.list_tables() == ["titles"]
+        queries = [
+            SQLQueryBuilder("titles").select("*"),
+            SQLQueryBuilder("titles").select("title").where("release_year", 2005),
+            SQLQueryBuilder("titles").select("type", ("COUNT(*)", "n")).where("release_year", (">=", 2000))
+            .group_by("type"),
+            SQLQueryBuilder("titles").select(("COUNT(*)", "n")).between_("release_year", 1995, 2003),
+            SQLQueryBuilder("titles").select("title").where("release_year", None),
+        ]
+        for query in queries:
+            assert sorted(engine.fetch(query), key=str) == sorted(plain.fetch(query), key=str)
+        assert 'FROM "titles__p1" AS titles' in engine._compile(queries[1])[0]
+        engine.execute("INSERT INTO titles (title, type, release_year) VALUES ('new', 'MOVIE', 2024)")
+        assert engine.fetch('SELECT title FROM "titles__p2" WHERE release_year = 2024') == [("new",)]
+        engine.execute(SQLQueryBuilder("titles").update(release_year=1999).where("title", "new"))
+        engine.execute(SQLQueryBuilder("titles").update(type="DOC").where("release_year", 2005))
+        assert engine.fetch('SELECT title FROM "titles__p0" WHERE release_year = 1999 AND title = \'new\'') == [("new",)]
+        assert engine.fetch('SELECT COUNT(*) FROM "titles__p2" WHERE title = \'new\'') == [(0,)]
+        assert engine.fetch('SELECT DISTINCT type FROM "titles__p1" WHERE release_year = 2005') == [("DOC",)]
+        engine.execute(SQLQueryBuilder("titles").delete().where("release_year", (">=", 2010)))
+        assert engine.fetch('SELECT COUNT(*) FROM "titles__p2"') == [(0,)]
+        assert engine.fetch("SELECT COUNT(*) FROM titles") == [(121 - 40,)]
+        # builder writes go to the pruned children, rows whose year moves change child
+        shift = SQLQueryBuilder("titles").update(release_year='"release_year" + 8').where("release_year", ("<", 2005))
+        years = [year for (year,) in engine.fetch("SELECT release_year FROM titles")]
+        shifted = [year + 8 if year is not None and year < 2005 else year for year in years]
+        assert engine.execute(shift).rowcount == sum(a != b for a, b in zip(years, shifted)) > 0
+        assert sorted(engine.fetch("SELECT release_year FROM titles"), key=str) == sorted(((y,) for y in shifted), key=str)
+        assert engine.fetch('SELECT COUNT(*) FROM "titles__p0" WHERE release_year >= 2000') == [(0,)]
+        assert engine.fetch('SELECT COUNT(*) FROM "titles__p1" WHERE release_year >= 2010') == [(0,)]
+        assert engine.execute(SQLQueryBuilder("titles").update(type="X").where("release_year", 1990)).rowcount == 0
+        engine.create_index("titles", "type")
+        assert [index["name"] for index in engine.list_indexes("titles__p1")] == ["idx_titles_type__p1"]
+        engine.drop_index("idx_titles_type")
+        assert engine.list_indexes("titles__p1") == []
+        plain.close()
+        engine.close()
+
+    def test_imports_are_routed(self, tmp_path):
+        path = self._csv(tmp_path, rows=60)
+        engine = SQLiteDataEngine(str(tmp_path / "parts.db"))
+        engine.partition_table("titles", "type", values=["MOVIE"])
+        engine.enable_result_cache()
+        shows = SQLQueryBuilder("titles").select(("COUNT(*)", "n")).where("type", "SHOW")
+        engine.import_csv(path, "titles", chunksize=25)
+        assert engine.fetch(shows) == [(20,)]
+        assert engine.fetch('SELECT COUNT(*) FROM "titles__p0"') == [(40,)]
+        engine.import_csv(path, "titles")
+        assert engine.fetch(shows) == [(20,)]
+        engine.close()
+
+        reopened = SQLiteDataEngine(str(tmp_path / "parts.db"))
+        assert reopened.partitions["titles"].bounds == ["MOVIE"]
+        assert 'FROM "titles__p0" AS titles' in reopened._compile(SQLQueryBuilder("titles").select("title")
+                                                                 .where("type", "MOVIE"))[0]
+        with pytest.raises(ValueError):
+            reopened.partition_table("titles", "release_year", ranges=[2000])
+        reopened.close()
+
+
+class TestParallelAggregate:
+    @pytest.fixture
+    def rows(self):
+        return 500
+
+    @pytest.fixture
+    def engine(self, make_engine, rows):
+        schema = {"type": "TEXT", "year": "INTEGER", "score": "REAL", "votes": "INTEGER"}
+        return make_engine("parallel.db", "titles", schema, [
+            ("MOVIE" if i % 3 else "SHOW", 1990 + i % 25, (i * 37 % 100) / 10, None if i % 11 == 0 else i)
+            for i in range(rows)
+        ])
+
+    def test_matches_serial(self, engine):
+        queries = [
+            SQLQueryBuilder("titles").select("type", ("COUNT(*)", "n"), ("SUM(votes)", "v"), ("MIN(score)", "lo"),
+                                             ("MAX(votes)", "hi"), ("COUNT(votes)", "nv")).group_by("type"),
+            SQLQueryBuilder("titles").select("year", "type", ("COUNT(*)", "n")).where("year", (">=", 2000))
+            .and_("type", "MOVIE").group_by("year", "type").order_by("n", desc=True).limit(5),
+            SQLQueryBuilder("titles").select(("COUNT(*)", "n"), ("SUM(votes)", "v")).where("year", 1800),
+        ]
+        for query in queries:
+            assert engine.fetch_parallel(query, processes=2, ranges=7) == engine.fetch(query)
+        average = SQLQueryBuilder("titles").select("type", ("AVG(score)", "s")).group_by("type")
+        serial, parallel = engine.fetch(average), engine.fetch_parallel(average, processes=2, ranges=7)
+        assert [row[0] for row in parallel] == [row[0] for row in serial]
+        assert [row[1] for row in parallel] == pytest.approx([row[1] for row in serial])
+        engine.close()
+
+    @pytest.mark.parametrize("rows", [50])
+    def test_serial_fallback(self, engine):
+        having = SQLQueryBuilder("titles").select("type", ("COUNT(*)", "n")).group_by("type").having("COUNT(*)", (">", 20))
+        plan, reason = _decompose_aggregate(having)
+        assert plan is None and "HAVING" in reason
+        assert engine.fetch_parallel(having, processes=2) == [("MOVIE", 33)]
+        engine.close()
+
+
+class TestMaterializedView:
+    @staticmethod
+    def _csv(tmp_path, rows=90, name="titles.csv"):
+        path = tmp_path / name
+        pd.DataFrame({
+            "type": ["MOVIE" if i % 3 else "SHOW" for i in range(rows)],
+            "year": [1990 + i % 20 for i in range(rows)],
+            "score": [None if i % 7 == 0 else float(i % 10) for i in range(rows)],
+        }).to_csv(path, index=False)
+        return str(path)
+
+    @staticmethod
+    def _same(engine, query):
+        sql, params = query.build(params=True)
+        rows = engine.fetch(query)
+        assert sorted(rows, key=str) == sorted(engine.conn.execute(sql, params).fetchall(), key=str)
+        return rows
+
+    def test_answers_and_maintains(self, tmp_path):
+        engine = SQLiteDataEngine(str(tmp_path / "mv.db"))
+        engine.import_csv(self._csv(tmp_path), "titles")
+        by_type = SQLQueryBuilder("titles").select("type", "year", ("COUNT(*)", "n"), ("AVG(score)", "s"),
+                                                   ("MIN(score)", "lo"), ("MAX(score)", "hi")).group_by("type", "year")
+        name = engine.materialize(by_type)
+        assert name == "titles__mv0"
+        assert engine.list_tables() == ["titles", "titles__mv0"]
+        coarser = SQLQueryBuilder("titles").select("type", "COUNT(*)", "MAX(score)").where("type", "SHOW") \
+            .group_by("type").having("COUNT(*)", (">", 1)).order_by("type")
+        for query in (by_type, coarser):
+            assert f'FROM "{name}"' in engine._compile(query)[0]
+            self._same(engine, query)
+        assert f'FROM "{name}"' not in engine._compile(SQLQueryBuilder("titles").select("SUM(year)"))[0]
+
+        engine.execute("INSERT INTO titles VALUES ('DOC', 2030, 9.5)")
+        engine.execute("DELETE FROM titles WHERE score = 9.0")
+        engine.execute("UPDATE titles SET type = 'DOC' WHERE year = 1991")
+        engine.execute("DELETE FROM titles WHERE type = 'DOC' AND year = 2030")
+        self._same(engine, by_type)
+        engine.close()
+
+        reopened = SQLiteDataEngine(str(tmp_path / "mv.db"))
+        assert reopened.materialized[name].groups == ["type", "year"]
+        self._same(reopened, by_type)
+        reopened.drop_materialized(name)
+        assert reopened.list_tables() == ["titles"]
+        reopened.close()
+
+    def test_imports_merge_new_rows(self, tmp_path):
+        path = self._csv(tmp_path)
+        engine = SQLiteDataEngine(str(tmp_path / "mv.db"))
+        engine.import_csv(path, "titles", incremental=True)
+        movies = SQLQueryBuilder("titles").select("year", ("SUM(score)", "total"), ("COUNT(score)", "n")) \
+            .where("type", "MOVIE").group_by("year")
+        engine.materialize(movies)
+        engine.enable_result_cache()
+        before = self._same(engine, movies)
+        with open(path, "a") as f:
+            f.write("MOVIE,1990,100.0\nSHOW,1990,100.0\n")
+        engine.import_csv(path, "titles", incremental=True)
+        after = dict((year, total) for year, total, _ in self._same(engine, movies))
+        assert after[1990] == dict((year, total) for year, total, _ in before)[1990] + 100
+        engine.import_csv(self._csv(tmp_path, rows=30, name="small.csv"), "titles", chunksize=10)
+        self._same(engine, movies)
+        engine.refresh_materialized()
+        self._same(engine, movies)
+        with pytest.raises(ValueError):
+            engine.materialize(SQLQueryBuilder("titles").select("type", "COUNT(*)").group_by("type").limit(1))
+        engine.close()
+
+    def test_failed_import_keeps_triggers(self, tmp_path):
+        path = tmp_path / "values.csv"
+        path.write_text("k,v\n" + "".join(f"a,{i}\n" for i in range(4)))
+        engine = SQLiteDataEngine(str(tmp_path / "mv.db"))
+        engine.import_csv(str(path), "t", incremental=True)
+        engine.create_index("t", "v", unique=True)
+        counts = SQLQueryBuilder("t").select("k", "COUNT(*)").group_by("k")
+        engine.materialize(counts)
+        with open(path, "a") as f:
+            f.write("a,3\n")
+        with pytest.raises(sqlite3.IntegrityError):
+            engine.import_csv(str(path), "t", incremental=True)
+        assert len(engine.fetch("SELECT name FROM sqlite_master WHERE type = 'trigger'")) == 3
+        engine.execute("INSERT INTO t SELECT 'a', v + 100 FROM t")
+        assert engine.fetch(counts) == [("a", 8)]
+        engine.close()
+
+    def test_rejects_unsupported_shapes(self, tmp_path):
+        engine = SQLiteDataEngine(str(tmp_path / "mv.db"))
+        engine.create_table("titles", {"type": "TEXT"})
+        with pytest.raises(ValueError):
+            engine.materialize(SQLQueryBuilder("titles").select("title", "COUNT(*)").group_by("title"))
+        engine.close()
+
+
+class TestQueryGuard:
+    @pytest.fixture
+    def rows(self):
+        return 20_000
+
+    @pytest.fixture
+    def engine(self, make_engine, rows):
+        return make_engine("guard.db", "titles", {"type": "TEXT", "year": "INTEGER", "score": "REAL"},
+                           [("MOVIE" if i % 3 else "SHOW", 1990 + i % 30, i % 97 / 3) for i in range(rows)])
+
+    @pytest.mark.parametrize("rows", [10])
+    def test_explain(self, engine):
+        grouped = SQLQueryBuilder("titles").select("year", "COUNT(*)").where("type", "MOVIE").group_by("year")
+        plan = grouped.explain(engine)
+        assert plan.full_scans == ["titles"]
+        assert plan.temp_btrees == ["USE TEMP B-TREE FOR GROUP BY"]
+        assert str(grouped.explain(engine.conn)) == str(plan)
+        engine.create_index("titles", ["type", "year"])
+        assert engine.explain(grouped).full_scans == [] and engine.explain(grouped).temp_btrees == []
+        nested = engine.explain("SELECT * FROM titles WHERE year IN (SELECT year FROM titles WHERE score > 1)")
+        assert [node.detail for node in nested.nodes[1].children] == ["SCAN titles"]
+        assert not any(node.full_scan for node in engine.explain("SELECT 1").walk())
+        engine.close()
+
+    def test_budgets_and_slow_log(self, engine):
+        grouped = SQLQueryBuilder("titles").select("year", "COUNT(*)").group_by("year")
+        engine.enable_query_guard(max_sort_rows=1000)
+        with pytest.raises(QueryBudgetExceeded):
+            engine.fetch(grouped)
+        assert engine.fetch("SELECT COUNT(*) FROM titles") == [(20_000,)]
+        assert engine.slow_queries()[0]["reason"].startswith("rejected, temp b-tree")
+
+        engine.enable_query_guard(max_seconds=0.1)
+        with pytest.raises(QueryBudgetExceeded):
+            engine.fetch("SELECT COUNT(*) FROM titles a, titles b WHERE a.score < b.year")
+        assert engine.slow_queries()[0]["reason"].startswith("interrupted")
+        assert engine.fetch(grouped)[0] == (1990, 667)
+
+        engine.enable_query_guard(max_scan_rows=10, slow_seconds=0.0, enforce=False)
+        assert len(engine.fetch(grouped)) == 30
+        assert [entry["reason"].split(",")[0] for entry in engine.slow_queries()] == ["over budget", "slower than 0.0s"]
+        assert engine.slow_queries()[1]["plan"].startswith("SCAN titles")
+        engine.disable_query_guard()
+        assert engine.slow_queries() == []
+        engine.close()
+
+    def test_execute_and_output_are_guarded(self, tmp_path, monkeypatch, engine):
+        monkeypatch.chdir(tmp_path)
+        engine.enable_query_guard(max_seconds=0.01)
+        # the first row comes quickly, fetching the rest runs over budget
+        streamed = "SELECT a.year FROM titles a, titles b WHERE a.score < b.year"
+        with pytest.raises(QueryBudgetExceeded):
+            engine.execute(f"CREATE TABLE copied AS {streamed}")
+        with pytest.raises(QueryBudgetExceeded):
+            DataOutput(query=streamed, output_name="guarded", engine=engine)
+        engine.disable_query_guard()
+        output = DataOutput(query="SELECT year, score FROM titles", output_name="guarded", engine=engine)
+        engine.enable_query_guard(max_scan_rows=10)
+        with pytest.raises(QueryBudgetExceeded):
+            output.result().to_frame()
+        engine.disable_query_guard()
+        assert engine.fetch("SELECT COUNT(*) FROM titles") == [(20_000,)]
+        assert "copied" not in engine.list_tables()
+        engine.close()